@@ -0,0 +1,185 @@
+import fnmatch
+import os
+import posixpath
+import tarfile
+import zipfile
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional
+
+from app.config import (
+    ARCHIVE_MAX_FILE_SIZE, ARCHIVE_MAX_FILES, ARCHIVE_SKIP_DIRS, ARCHIVE_SKIP_FILES,
+    INGEST_LOCAL_ROOTS
+)
+from app.utils import language_from_filename
+
+# Bytes inspected to tell text from binary files
+BINARY_SNIFF_BYTES = 8192
+
+class ArchiveFile(NamedTuple):
+    # Path relative to the archive or directory root, with "/" separators
+    path: str
+    language: str
+    data: bytes
+
+def _member_path(name: str) -> str:
+    # Anchoring at "/" keeps "../" from leaving the archive root
+    return posixpath.normpath("/" + name).lstrip("/")
+
+def _skip_path(path: str) -> bool:
+    parts = path.split("/")
+    if any(part in ARCHIVE_SKIP_DIRS for part in parts[:-1]):
+        return True
+    return any(fnmatch.fnmatch(parts[-1], pattern) for pattern in ARCHIVE_SKIP_FILES)
+
+def _is_binary(data: bytes) -> bool:
+    return b"\0" in data[:BINARY_SNIFF_BYTES]
+
+class ArchiveScan:
+    """
+    Walks the files of an archive or directory and keeps count of what it
+    skipped and why.
+    """
+
+    def __init__(self):
+        self.skipped: Dict[str, int] = {}
+        # Set when ARCHIVE_MAX_FILES stopped the scan early
+        self.truncated = False
+
+    def skip(self, reason: str) -> None:
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def _accept(self, path: str, size: int, read) -> Optional[ArchiveFile]:
+        if _skip_path(path):
+            self.skip("excluded")
+            return None
+        if size > ARCHIVE_MAX_FILE_SIZE:
+            self.skip("too_large")
+            return None
+        # Extensions decide without reading the file; only files without
+        # one are read to look for a shebang line
+        language = language_from_filename(path)
+        if not language and os.path.splitext(path)[1]:
+            self.skip("unknown_language")
+            return None
+        data = read()
+        if not data.strip():
+            self.skip("empty")
+            return None
+        if _is_binary(data):
+            self.skip("binary")
+            return None
+        language = language or language_from_filename(None, data[:256].decode("utf-8", errors="replace"))
+        if not language:
+            self.skip("unknown_language")
+            return None
+        return ArchiveFile(path, language, data)
+
+    def _limited(self, files: Iterator[ArchiveFile]) -> Iterator[ArchiveFile]:
+        count = 0
+        for archive_file in files:
+            if archive_file is None:
+                continue
+            if count >= ARCHIVE_MAX_FILES:
+                self.truncated = True
+                return
+            count += 1
+            yield archive_file
+
+    def iter_archive(self, stream: BinaryIO) -> Iterator[ArchiveFile]:
+        """
+        Iterate over the code files of a zip or tar archive, one at a time.
+
+        Args:
+            stream: Seekable binary file holding the archive
+
+        Returns:
+            Iterator over accepted files
+        """
+        if zipfile.is_zipfile(stream):
+            stream.seek(0)
+            return self._limited(self._iter_zip(stream))
+        stream.seek(0)
+        return self._limited(self._iter_tar(stream))
+
+    def _iter_zip(self, stream: BinaryIO) -> Iterator[Optional[ArchiveFile]]:
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                yield self._accept(_member_path(info.filename), info.file_size, lambda: archive.read(info))
+
+    def _iter_tar(self, stream: BinaryIO) -> Iterator[Optional[ArchiveFile]]:
+        # Stream mode reads members in order without building an index
+        with tarfile.open(fileobj=stream, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                yield self._accept(_member_path(member.name), member.size, lambda: archive.extractfile(member).read())
+
+    def iter_directory(self, root: str) -> Iterator[ArchiveFile]:
+        """
+        Iterate over the code files below a directory, one at a time.
+
+        Excluded directories are not descended into and symlinks are not
+        followed.
+
+        Args:
+            root: Directory to walk
+
+        Returns:
+            Iterator over accepted files
+        """
+        def walk() -> Iterator[Optional[ArchiveFile]]:
+            for directory, dirnames, filenames in os.walk(root):
+                dirnames[:] = sorted(name for name in dirnames if name not in ARCHIVE_SKIP_DIRS)
+                for filename in sorted(filenames):
+                    full_path = os.path.join(directory, filename)
+                    if os.path.islink(full_path) or not os.path.isfile(full_path):
+                        continue
+                    path = os.path.relpath(full_path, root).replace(os.sep, "/")
+
+                    def read(full_path=full_path):
+                        with open(full_path, "rb") as source:
+                            return source.read()
+
+                    yield self._accept(path, os.path.getsize(full_path), read)
+
+        return self._limited(walk())
+
+def resolve_local_path(path: str) -> str:
+    """
+    Resolve a server-local path and check that ingesting it is allowed.
+
+    Args:
+        path: Directory or archive path on the server
+
+    Returns:
+        The resolved absolute path
+
+    Raises:
+        ValueError: If the path is outside every INGEST_LOCAL_ROOTS entry
+    """
+    resolved = os.path.realpath(path)
+    for root in INGEST_LOCAL_ROOTS:
+        root = os.path.realpath(root)
+        if resolved == root or resolved.startswith(root + os.sep):
+            return resolved
+    raise ValueError("Path is not inside an allowed ingest root")
+
+# Suffixes stripped from archive file names, longest first
+ARCHIVE_SUFFIXES = (".tar.gz", ".tar.bz2", ".tar.xz", ".tgz", ".tbz2", ".txz", ".tar", ".zip")
+
+def archive_name(filename: str) -> str:
+    """
+    Derive a name for the ingested files from an archive or directory name.
+
+    Args:
+        filename: Archive file name or directory path
+
+    Returns:
+        Name without directories and archive suffixes
+    """
+    name = os.path.basename(filename.rstrip("/\\"))
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)] or name
+    return name
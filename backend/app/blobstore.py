@@ -0,0 +1,195 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from app import database
+from app.config import BLOB_STORE, BLOB_DIR
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size of the pieces streamed into and out of the store
+BLOB_IO_CHUNK_SIZE = 1024 * 1024
+
+# References look like "local:<name>" or "pg:<large object oid>"
+LOCAL_PREFIX = "local:"
+PG_PREFIX = "pg:"
+
+class PayloadTooLarge(Exception):
+    """Raised when a blob grows beyond the allowed size while being written."""
+
+def _local_path(name: str) -> str:
+    # Names are generated by write_blob; refuse anything that could escape BLOB_DIR
+    if os.path.basename(name) != name or not name:
+        raise ValueError(f"Invalid blob name: {name}")
+    return os.path.join(BLOB_DIR, name)
+
+def _copy(stream: BinaryIO, write, max_size: Optional[int], head_size: int) -> Tuple[int, bytes]:
+    size = 0
+    head = bytearray()
+    while True:
+        piece = stream.read(BLOB_IO_CHUNK_SIZE)
+        if not piece:
+            break
+        size += len(piece)
+        if max_size is not None and size > max_size:
+            raise PayloadTooLarge(f"Payload exceeds maximum allowed ({max_size} bytes)")
+        if len(head) < head_size:
+            head += piece[:head_size - len(head)]
+        write(piece)
+    return size, bytes(head)
+
+def _write_local(stream: BinaryIO, max_size: Optional[int], head_size: int) -> Tuple[str, int, bytes]:
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    name = uuid.uuid4().hex
+    path = _local_path(name)
+    partial = path + ".part"
+
+    try:
+        with open(partial, "wb") as out:
+            size, head = _copy(stream, out.write, max_size, head_size)
+        # Readers never see a half-written blob
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    return LOCAL_PREFIX + name, size, head
+
+def _write_pg(stream: BinaryIO, max_size: Optional[int], head_size: int) -> Tuple[str, int, bytes]:
+    conn = database.engine.raw_connection()
+    try:
+        lobject = conn.lobject(0, "wb")
+        size, head = _copy(stream, lobject.write, max_size, head_size)
+        oid = lobject.oid
+        lobject.close()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return f"{PG_PREFIX}{oid}", size, head
+
+def write_blob(stream: BinaryIO, max_size: Optional[int] = None, head_size: int = 0) -> Tuple[str, int, bytes]:
+    """
+    Stream data into the configured blob store.
+
+    Args:
+        stream: Binary file-like object to read from
+        max_size: Maximum number of bytes, None for no limit
+        head_size: Number of leading bytes to return alongside the reference
+
+    Returns:
+        Tuple of the blob reference, its size in bytes and its first
+        head_size bytes
+
+    Raises:
+        PayloadTooLarge: If the data exceeds max_size; nothing is stored
+    """
+    if BLOB_STORE == "local":
+        return _write_local(stream, max_size, head_size)
+    return _write_pg(stream, max_size, head_size)
+
+def write_text(text: str, max_size: Optional[int] = None) -> str:
+    """
+    Store text as a UTF-8 blob.
+
+    Args:
+        text: The text to store
+        max_size: Maximum number of bytes, None for no limit
+
+    Returns:
+        Blob reference
+    """
+    return write_blob(io.BytesIO(text.encode("utf-8")), max_size)[0]
+
+def read_blob(ref: str) -> bytes:
+    """
+    Read a whole blob.
+
+    Args:
+        ref: Blob reference returned by write_blob
+
+    Returns:
+        The blob contents
+    """
+    if ref.startswith(LOCAL_PREFIX):
+        with open(_local_path(ref[len(LOCAL_PREFIX):]), "rb") as blob:
+            return blob.read()
+
+    if ref.startswith(PG_PREFIX):
+        conn = database.engine.raw_connection()
+        try:
+            lobject = conn.lobject(int(ref[len(PG_PREFIX):]), "rb")
+            data = lobject.read()
+            lobject.close()
+            conn.commit()
+            return data
+        finally:
+            conn.close()
+
+    raise ValueError(f"Unknown blob reference: {ref}")
+
+@contextmanager
+def open_blob(ref: str) -> Iterator[BinaryIO]:
+    """
+    Open a blob as a seekable binary file without loading it into memory.
+
+    Large objects are copied to a temporary file first.
+
+    Args:
+        ref: Blob reference returned by write_blob
+
+    Returns:
+        Context manager yielding the open file
+    """
+    if ref.startswith(LOCAL_PREFIX):
+        with open(_local_path(ref[len(LOCAL_PREFIX):]), "rb") as blob:
+            yield blob
+        return
+
+    if not ref.startswith(PG_PREFIX):
+        raise ValueError(f"Unknown blob reference: {ref}")
+
+    with tempfile.TemporaryFile() as copy:
+        conn = database.engine.raw_connection()
+        try:
+            lobject = conn.lobject(int(ref[len(PG_PREFIX):]), "rb")
+            shutil.copyfileobj(lobject, copy, BLOB_IO_CHUNK_SIZE)
+            lobject.close()
+            conn.commit()
+        finally:
+            conn.close()
+        copy.seek(0)
+        yield copy
+
+def delete_blob(ref: str) -> None:
+    """
+    Delete a blob; missing blobs are ignored.
+
+    Args:
+        ref: Blob reference returned by write_blob
+    """
+    try:
+        if ref.startswith(LOCAL_PREFIX):
+            path = _local_path(ref[len(LOCAL_PREFIX):])
+            if os.path.exists(path):
+                os.remove(path)
+        elif ref.startswith(PG_PREFIX):
+            conn = database.engine.raw_connection()
+            try:
+                conn.lobject(int(ref[len(PG_PREFIX):])).unlink()
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        logger.error(f"Error deleting blob {ref}: {str(e)}")
@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Dict, Any, Optional, TypeVar
+
+import redis
+
+from app import metrics
+from app.config import LLM_CACHE_ENABLED, LLM_CACHE_URL, LLM_CACHE_MAX_ENTRIES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Redis key layout
+KEY_PREFIX = "llmcache:entry:"
+LRU_KEY = "llmcache:lru"
+STATS_KEY = "llmcache:stats"
+
+T = TypeVar("T")
+
+# Redis client is created lazily on first use
+_client = None
+
+def get_client() -> redis.Redis:
+    """
+    Get the shared Redis client for the LLM cache.
+
+    Returns:
+        Redis client instance
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(LLM_CACHE_URL, socket_timeout=1, socket_connect_timeout=1)
+    return _client
+
+def make_key(model: str, kind: str, language: Optional[str], text: str) -> str:
+    """
+    Build a content-addressed cache key.
+
+    Args:
+        model: Model that produces the value
+        kind: Kind of prompt (embedding, description, ...)
+        language: Programming language of the text, if relevant
+        text: The input text
+
+    Returns:
+        Cache key
+    """
+    digest = hashlib.sha256()
+    for part in (model, kind, language or "", text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return KEY_PREFIX + digest.hexdigest()
+
+def encode_embedding(embedding: List[float]) -> bytes:
+    """Pack an embedding as float32, the precision pgvector stores anyway."""
+    return array("f", embedding).tobytes()
+
+def decode_embedding(data: bytes) -> List[float]:
+    """Unpack an embedding packed by encode_embedding."""
+    values = array("f")
+    values.frombytes(data)
+    return values.tolist()
+
+def lookup_many(kind: str, keys: List[str]) -> List[Optional[bytes]]:
+    """
+    Look up several cache entries and count hits and misses.
+
+    Args:
+        kind: Kind of prompt, used for the hit/miss counters
+        keys: Cache keys built by make_key
+
+    Returns:
+        Cached values in key order, None for misses
+    """
+    if not LLM_CACHE_ENABLED or not keys:
+        return [None] * len(keys)
+
+    try:
+        client = get_client()
+        values = client.mget(keys)
+        hits = [key for key, value in zip(keys, values) if value is not None]
+        metrics.record_cache(f"llm_{kind}", len(hits), len(keys) - len(hits))
+
+        pipe = client.pipeline(transaction=False)
+        if hits:
+            # Refresh recency so eviction drops the least recently used entries
+            now = time.time()
+            pipe.zadd(LRU_KEY, {key: now for key in hits})
+            pipe.hincrby(STATS_KEY, f"{kind}:hits", len(hits))
+        if len(hits) < len(keys):
+            pipe.hincrby(STATS_KEY, f"{kind}:misses", len(keys) - len(hits))
+        pipe.execute()
+
+        return values
+    except redis.RedisError as e:
+        logger.warning(f"LLM cache lookup failed: {e}")
+        return [None] * len(keys)
+
+def store_many(entries: Dict[str, bytes], ttl: Optional[int] = None) -> None:
+    """
+    Store several cache entries, evicting the least recently used ones
+    when the cache grows beyond LLM_CACHE_MAX_ENTRIES.
+
+    Args:
+        entries: Mapping of cache key to value
+        ttl: Seconds until the entries expire, None keeps them until evicted
+    """
+    if not LLM_CACHE_ENABLED or not entries:
+        return
+
+    try:
+        client = get_client()
+        now = time.time()
+
+        pipe = client.pipeline(transaction=False)
+        if ttl:
+            for key, value in entries.items():
+                pipe.set(key, value, ex=ttl)
+        else:
+            pipe.mset(entries)
+        pipe.zadd(LRU_KEY, {key: now for key in entries})
+        pipe.zcard(LRU_KEY)
+        size = pipe.execute()[-1]
+
+        if size > LLM_CACHE_MAX_ENTRIES:
+            evicted = [key for key, _ in client.zpopmin(LRU_KEY, size - LLM_CACHE_MAX_ENTRIES)]
+            if evicted:
+                client.delete(*evicted)
+                client.hincrby(STATS_KEY, "evictions", len(evicted))
+    except redis.RedisError as e:
+        logger.warning(f"LLM cache store failed: {e}")
+
+class LocalCache:
+    """
+    Thread-safe in-process LRU cache whose entries expire after ttl seconds.
+
+    Sits in front of Redis for hot keys, so hits cost no network round trip.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, name: str = "local"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                metrics.record_cache(self.name, 0, 1)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.record_cache(self.name, 1, 0)
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+def single_flight(key: str, compute: Callable[[], T]) -> T:
+    """
+    Run compute once for concurrent callers with the same key.
+
+    The first caller computes the value; callers arriving while it runs
+    wait and share its result (or its exception).
+
+    Args:
+        key: Identifies the computation
+        compute: Function producing the value
+
+    Returns:
+        The computed value
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        flight.value = compute()
+        return flight.value
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+_async_flights: Dict[str, asyncio.Future] = {}
+
+async def async_single_flight(key: str, compute: Callable[[], Awaitable[T]]) -> T:
+    """
+    Await compute once for concurrent coroutines with the same key.
+
+    The event loop counterpart of single_flight: callers arriving while
+    the first one computes await its result instead of computing again.
+
+    Args:
+        key: Identifies the computation
+        compute: Coroutine function producing the value
+
+    Returns:
+        The computed value
+    """
+    flight = _async_flights.get(key)
+    if flight is not None:
+        # Shielded, so a caller that goes away doesn't cancel the others
+        return await asyncio.shield(flight)
+
+    flight = _async_flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        value = await compute()
+        flight.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    except Exception as e:
+        flight.set_exception(e)
+        # Mark the error as retrieved in case no one else was waiting
+        flight.exception()
+        raise
+    finally:
+        del _async_flights[key]
+
+def lookup(kind: str, key: str) -> Optional[bytes]:
+    """
+    Look up a single cache entry.
+
+    Args:
+        kind: Kind of prompt, used for the hit/miss counters
+        key: Cache key built by make_key
+
+    Returns:
+        Cached value or None
+    """
+    return lookup_many(kind, [key])[0]
+
+def store(key: str, value: bytes) -> None:
+    """
+    Store a single cache entry.
+
+    Args:
+        key: Cache key built by make_key
+        value: Value to store
+    """
+    store_many({key: value})
+
+def get_stats() -> Dict[str, Any]:
+    """
+    Get cache size and hit/miss counters per prompt kind.
+
+    Returns:
+        Dictionary with cache statistics
+    """
+    if not LLM_CACHE_ENABLED:
+        return {"enabled": False}
+
+    try:
+        client = get_client()
+        counters = {
+            field.decode(): int(value)
+            for field, value in client.hgetall(STATS_KEY).items()
+        }
+        entries = client.zcard(LRU_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"LLM cache stats failed: {e}")
+        return {"enabled": True, "available": False}
+
+    kinds = {}
+    for field, value in counters.items():
+        if ":" not in field:
+            continue
+        kind, counter = field.split(":", 1)
+        kinds.setdefault(kind, {"hits": 0, "misses": 0})[counter] = value
+    for stats in kinds.values():
+        total = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / total if total else 0.0
+
+    return {
+        "enabled": True,
+        "available": True,
+        "entries": entries,
+        "max_entries": LLM_CACHE_MAX_ENTRIES,
+        "evictions": counters.get("evictions", 0),
+        "kinds": kinds
+    }
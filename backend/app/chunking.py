@@ -0,0 +1,261 @@
+import ast
+import bisect
+import logging
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.config import TOKEN_COUNTER, EMBEDDING_MODEL
+from app.syntax import LANGUAGE_RULES, BRACKETS, CLOSING_BRACKETS, scan_brackets
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Counts tokens in a piece of text
+TokenCounter = Callable[[str], float]
+
+# Simple approximation: 1 token ≈ 4 characters for code
+CHARS_PER_TOKEN = 4
+
+class CodeSpan(NamedTuple):
+    text: str
+    # 1-based, inclusive line numbers
+    start_line: int
+    end_line: int
+    # UTF-8 byte offsets, end exclusive
+    start_byte: int
+    end_byte: int
+
+def estimate_tokens(text: str) -> float:
+    """
+    Estimate the number of tokens in the given text.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        Approximate token count
+    """
+    return len(text) / CHARS_PER_TOKEN
+
+_token_counters: Dict[str, TokenCounter] = {"estimate": estimate_tokens}
+
+def get_token_counter(name: str = TOKEN_COUNTER) -> TokenCounter:
+    """
+    Get a local token counter by name.
+
+    "estimate" uses the character-based approximation; "tiktoken" counts
+    with the embedding model's tokenizer when tiktoken is installed.
+
+    Args:
+        name: Name of the counter
+
+    Returns:
+        Token counting function
+    """
+    if name in _token_counters:
+        return _token_counters[name]
+
+    counter = estimate_tokens
+    if name == "tiktoken":
+        try:
+            import tiktoken
+            encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+            counter = lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, falling back to estimated token counts: {e}")
+    else:
+        logger.warning(f"Unknown token counter {name!r}, using estimated token counts")
+
+    _token_counters[name] = counter
+    return counter
+
+# Lines that belong to the definition below them
+_LEADING_PREFIXES = ("#", "//", "/*", "*", "@", "///", "--")
+
+# Lines that continue the construct above them in indentation-based languages
+_CONTINUATION_KEYWORDS = (
+    "end", "else", "elif", "elsif", "except", "finally", "rescue", "ensure",
+    "when", "fi", "done", "esac", "then", "do"
+)
+
+def _python_boundaries(code: str, lines: List[str]) -> Optional[List[int]]:
+    try:
+        module = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+
+    boundaries = []
+    for node in module.body:
+        start = node.lineno
+        for decorator in getattr(node, "decorator_list", ()):
+            start = min(start, decorator.lineno)
+        boundaries.append(start - 1)
+    return boundaries
+
+def _bracket_boundaries(code: str, lines: List[str], language: str) -> List[int]:
+    # A line starts a top-level unit when no bracket is open at its start
+    boundaries = []
+    depth = 0
+    tokens = scan_brackets(code, language)
+    token = next(tokens, None)
+    offset = 0
+
+    for i, line in enumerate(lines):
+        while token is not None and token[0] < offset:
+            if token[1] in BRACKETS:
+                depth += 1
+            elif token[1] in CLOSING_BRACKETS:
+                depth = max(0, depth - 1)
+            token = next(tokens, None)
+        if depth == 0:
+            boundaries.append(i)
+        offset += len(line) + 1
+
+    return boundaries
+
+def _indent_boundaries(lines: List[str]) -> List[int]:
+    boundaries = []
+    for i, line in enumerate(lines):
+        if not line or line[0] in " \t":
+            continue
+        word = line.split(None, 1)[0].rstrip(":;")
+        if word in _CONTINUATION_KEYWORDS or line[0] in ")]}":
+            continue
+        boundaries.append(i)
+    return boundaries
+
+def _is_leading(line: str) -> bool:
+    return line.lstrip().startswith(_LEADING_PREFIXES)
+
+def _attach_leading_lines(boundaries: List[int], lines: List[str]) -> List[int]:
+    # Keep comments, decorators and annotations with the definition they precede
+    attached = []
+    for boundary in boundaries:
+        previous = attached[-1] if attached else -1
+        while boundary - 1 > previous and _is_leading(lines[boundary - 1]):
+            boundary -= 1
+        if boundary - 1 == previous >= 0 and _is_leading(lines[previous]):
+            continue
+        attached.append(boundary)
+    return attached
+
+def top_level_boundaries(code: str, lines: List[str], language: Optional[str]) -> List[int]:
+    """
+    Find the lines where top-level definitions or statements start.
+
+    Python uses ast, bracket languages track bracket depth with the lexer,
+    keyword/indentation languages use indentation. Anything else can be cut
+    at every line.
+
+    Args:
+        code: The code to analyze
+        lines: The code split into lines
+        language: The programming language of the code
+
+    Returns:
+        Sorted 0-based line indexes where a chunk may start
+    """
+    boundaries = None
+    if language == "python":
+        boundaries = _python_boundaries(code, lines)
+        if boundaries is None:
+            boundaries = _indent_boundaries(lines)
+    elif language in LANGUAGE_RULES and (
+        LANGUAGE_RULES[language].brackets_define_blocks or LANGUAGE_RULES[language].statement_terminator
+    ):
+        boundaries = _bracket_boundaries(code, lines, language)
+    elif language in ("ruby", "bash", "yaml"):
+        boundaries = _indent_boundaries(lines)
+
+    if boundaries is None:
+        return list(range(len(lines)))
+
+    boundaries = _attach_leading_lines(boundaries, lines)
+    if not boundaries or boundaries[0] != 0:
+        boundaries.insert(0, 0)
+    return boundaries
+
+def iter_chunks(
+    code: str,
+    max_tokens: int = 1000,
+    overlap: int = 50,
+    language: Optional[str] = None,
+    count_tokens: Optional[TokenCounter] = None
+) -> Iterator[CodeSpan]:
+    """
+    Split code into chunks at top-level definitions, lazily.
+
+    Units between boundaries are packed greedily up to max_tokens; a unit
+    larger than that is split at line breaks. Each chunk after the first
+    repeats up to overlap tokens from the end of the previous one, counted
+    within max_tokens: whole definitions when the cut falls on a boundary,
+    lines when it falls inside a split definition. Runs in linear time.
+
+    Args:
+        code: The code to chunk
+        max_tokens: Maximum tokens per chunk
+        overlap: Number of overlapping tokens between chunks
+        language: Programming language, enables syntax-aware boundaries
+        count_tokens: Token counter, defaults to the configured one
+
+    Returns:
+        Iterator over chunks with their line and byte spans
+    """
+    count_tokens = count_tokens or get_token_counter()
+    lines = code.split("\n")
+
+    # Prefix sums of tokens and bytes per line (including its newline)
+    token_prefix = [0.0]
+    byte_prefix = [0]
+    for line in lines:
+        token_prefix.append(token_prefix[-1] + count_tokens(line + "\n"))
+        byte_prefix.append(byte_prefix[-1] + len(line.encode("utf-8")) + 1)
+
+    def span(start: int, end: int) -> CodeSpan:
+        return CodeSpan(
+            text="\n".join(lines[start:end]),
+            start_line=start + 1,
+            end_line=end,
+            start_byte=byte_prefix[start],
+            end_byte=byte_prefix[end] - 1
+        )
+
+    boundaries = top_level_boundaries(code, lines, language)
+    boundaries.append(len(lines))
+
+    def units() -> Iterator[Tuple[int, int, bool]]:
+        # Yields (start, end, whole): whole units are complete top-level ones
+        for start, end in zip(boundaries, boundaries[1:]):
+            # Units that are too large on their own are packed line by line
+            if token_prefix[end] - token_prefix[start] > max_tokens:
+                for line in range(start, end):
+                    yield line, line + 1, False
+            else:
+                yield start, end, True
+
+    def overlap_start(chunk_units: List[Tuple[int, int, bool]], unit_start: int, unit_end: int) -> int:
+        # The overlap and the unit that opens the next chunk share max_tokens
+        floor = max(token_prefix[unit_start] - overlap, token_prefix[unit_end] - max_tokens)
+        if unit_start not in boundary_set:
+            # Inside a split definition: repeat trailing lines
+            return bisect.bisect_left(token_prefix, floor, chunk_units[0][0] + 1, unit_start)
+        # At a boundary: repeat whole definitions only, so the chunk starts complete
+        start = unit_start
+        for previous_start, _, whole in reversed(chunk_units[1:]):
+            if not whole or token_prefix[previous_start] < floor:
+                break
+            start = previous_start
+        return start
+
+    boundary_set = set(boundaries)
+    chunk_start = 0
+    chunk_units: List[Tuple[int, int, bool]] = []
+    for unit in units():
+        unit_start, unit_end, _ = unit
+        if unit_start > chunk_start and token_prefix[unit_end] - token_prefix[chunk_start] > max_tokens:
+            yield span(chunk_start, unit_start)
+            chunk_start = overlap_start(chunk_units, unit_start, unit_end)
+            chunk_units = [previous for previous in chunk_units if previous[0] >= chunk_start]
+        chunk_units.append(unit)
+
+    yield span(chunk_start, len(lines))
@@ -12,24 +12,160 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "optiq")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "changeme")
 
 # Database connection string
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+DATABASE_URL = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# Same database through the async driver, used by the API's request path
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-# LLM configuration
-LLM_MODE = os.getenv("LLM_MODE", "OPENAI")
+# Connection pool, per process and engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Set when POSTGRES_HOST is a transaction-mode pooler such as PgBouncer: the
+# pooler then owns the connections and prepared statement caching is off
+DB_TRANSACTION_POOLER = os.getenv("DB_TRANSACTION_POOLER", "false").lower() == "true"
+# Migrations and vector index builds hold session state (session advisory
+# locks, SET), so behind a transaction pooler they connect to Postgres directly
+POSTGRES_DIRECT_HOST = os.getenv("POSTGRES_DIRECT_HOST") or POSTGRES_HOST
+POSTGRES_DIRECT_PORT = os.getenv("POSTGRES_DIRECT_PORT") or POSTGRES_PORT
+DIRECT_DATABASE_URL = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_DIRECT_HOST}:{POSTGRES_DIRECT_PORT}/{POSTGRES_DB}"
+
+# LLM configuration. LLM_MODE picks the completion provider, "OPENAI" or
+# "LOCAL" (self-hosted OpenAI-compatible server), and EMBEDDING_MODE
+# (defaulting to it) the embedding provider, which may also be "HASHING"
+# (offline hashed embeddings); see app.providers
+LLM_MODE = (os.getenv("LLM_MODE") or "OPENAI").upper()
+if LLM_MODE == "HASHING":
+    # Descriptions and checks would all fail one by one during ingest
+    raise ValueError("LLM_MODE=HASHING is not supported: hashing only computes embeddings, set it as EMBEDDING_MODE")
+EMBEDDING_MODE = (os.getenv("EMBEDDING_MODE") or LLM_MODE).upper()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL") or "http://localhost:8000/v1"
+# Most local servers ignore the key, but the client requires one
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY") or "local"
+LOCAL_EMBEDDING_BASE_URL = os.getenv("LOCAL_EMBEDDING_BASE_URL") or LOCAL_LLM_BASE_URL
+
+# OpenAI HTTP connection pool (one shared client per process)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# LLM response cache (content-addressed, Redis-backed)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_URL = os.getenv("LLM_CACHE_URL", "redis://redis:6379/1")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500000"))
+# Search query embeddings: in-process LRU in front of Redis, both expiring after the TTL
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "3600"))
 
 # Celery configuration
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
 
 # Application settings
-MAX_PAYLOAD_SIZE = 5 * 1024 * 1024  # 5 MB
+MAX_PAYLOAD_SIZE = int(os.getenv("MAX_PAYLOAD_SIZE", str(5 * 1024 * 1024)))  # 5 MB
+# Where ingested code waits for the worker: "postgres" (large objects) or
+# "local" (BLOB_DIR, which must be shared by the API and the workers)
+BLOB_STORE = os.getenv("BLOB_STORE", "postgres").lower()
+BLOB_DIR = os.getenv("BLOB_DIR", "/tmp/code-indexer-blobs")
 MAX_TOKENS_PER_CHUNK = 1000
+# Local token counter used for chunking: "estimate" or "tiktoken"
+TOKEN_COUNTER = os.getenv("TOKEN_COUNTER", "estimate")
 DEFAULT_CHUNK_OVERLAP = 50
+# Maximum concurrent LLM calls per ingest task (1 processes chunks serially)
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+# Ask the LLM about code the incompleteness checker can't decide on
+INCOMPLETE_LLM_CONFIRM = os.getenv("INCOMPLETE_LLM_CONFIRM", "false").lower() == "true"
+# Characters of raw code returned per result by the compact search view
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "300"))
+# Archive and directory ingestion
+ARCHIVE_MAX_SIZE = int(os.getenv("ARCHIVE_MAX_SIZE", str(500 * 1024 * 1024)))  # 500 MB
+ARCHIVE_MAX_FILES = int(os.getenv("ARCHIVE_MAX_FILES", "20000"))
+# Larger files are almost always generated or data
+ARCHIVE_MAX_FILE_SIZE = int(os.getenv("ARCHIVE_MAX_FILE_SIZE", str(1024 * 1024)))  # 1 MB
+ARCHIVE_SKIP_DIRS = set(os.getenv(
+    "ARCHIVE_SKIP_DIRS",
+    ".git,.hg,.svn,node_modules,bower_components,vendor,third_party,__pycache__,"
+    ".venv,venv,env,site-packages,dist,build,target,.idea,.vscode,.tox,.mypy_cache,coverage"
+).split(","))
+ARCHIVE_SKIP_FILES = os.getenv(
+    "ARCHIVE_SKIP_FILES",
+    "*.min.js,*.min.css,*.map,package-lock.json,yarn.lock,pnpm-lock.yaml,*.lock,*.pb.go,*_pb2.py"
+).split(",")
+# Server directories that may be ingested by path; empty disables path ingestion
+INGEST_LOCAL_ROOTS = [root for root in os.getenv("INGEST_LOCAL_ROOTS", "").split(",") if root]
+# Maximum number of chunks fetched by one GET /chunks/ request
+MAX_BULK_CHUNKS = int(os.getenv("MAX_BULK_CHUNKS", "500"))
+# Compiled templates kept in process (entries, seconds)
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "256"))
+TEMPLATE_CACHE_TTL = int(os.getenv("TEMPLATE_CACHE_TTL", "3600"))
+# Hybrid search: candidates taken from each of the lexical and vector
+# searches, and the reciprocal rank fusion constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Duplicate chunks at ingest: "link" stores them pointing at the canonical
+# chunk, "skip" doesn't store them at all. Either way no LLM call is made.
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", "link").lower()
+# Estimated Jaccard similarity (MinHash) from which a chunk counts as a
+# near duplicate; 0 disables near-duplicate detection
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+
+# Models, as named by the provider
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or "text-embedding-ada-002"
+COMPLETION_MODEL = os.getenv("COMPLETION_MODEL") or "gpt-3.5-turbo"
+# Length of the stored embeddings; must match the embedding model. Changing
+# it on a database with embeddings requires re-ingesting into a fresh one.
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION") or "1536")
+# Column type of the stored embeddings: "vector" (float32) or "halfvec"
+# (float16, half the disk and memory at nearly the same precision)
+EMBEDDING_STORAGE = (os.getenv("EMBEDDING_STORAGE") or "vector").lower()
+# Ask the model for EMBEDDING_DIMENSION-long vectors, for models that can
+# shorten theirs (text-embedding-3-*)
+EMBEDDING_REQUEST_DIMENSIONS = os.getenv("EMBEDDING_REQUEST_DIMENSIONS", "false").lower() == "true"
+
+# Embedding batching (OpenAI accepts up to 2048 inputs per request)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+
+# Vector (ANN) index managed by the backend: "hnsw" or "ivfflat"
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# "auto" sizes lists from the row count at build time
+IVFFLAT_LISTS = os.getenv("IVFFLAT_LISTS", "auto")
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+# IVFFlat centroids are only meaningful once the table has data
+IVFFLAT_MIN_ROWS = int(os.getenv("IVFFLAT_MIN_ROWS", "10000"))
+# Rebuild IVFFlat once the table has grown by this factor since the last build
+IVFFLAT_REBUILD_GROWTH = float(os.getenv("IVFFLAT_REBUILD_GROWTH", "2.0"))
+VECTOR_INDEX_MAINTENANCE_WORK_MEM = os.getenv("VECTOR_INDEX_MAINTENANCE_WORK_MEM", "")
+# What the ANN index holds: "full" (the stored embeddings), "half" (float16
+# copies) or "binary" (one bit per dimension, 32x smaller than float32).
+# Compact indexes find RERANK_FACTOR times the wanted results, which are
+# then re-ranked by their exact distance.
+VECTOR_INDEX_PRECISION = (os.getenv("VECTOR_INDEX_PRECISION") or "full").lower()
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+# Token required in the X-Admin-Token header for /admin endpoints (disabled when empty)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Prometheus metrics: port of each worker's /metrics server (0 disables it)
+# and the broker queues whose depth the API reports. Processes that fork
+# (Celery prefork, several uvicorn workers) also need PROMETHEUS_MULTIPROC_DIR.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9808"))
+METRICS_QUEUES = [queue.strip() for queue in os.getenv("METRICS_QUEUES", "celery").split(",") if queue.strip()]
 
-# OpenAI models
-EMBEDDING_MODEL = "text-embedding-ada-002"
-COMPLETION_MODEL = "gpt-3.5-turbo"
+# On-demand profiles (cProfile) of requests and tasks, kept in Redis for
+# PROFILE_TTL seconds; at most PROFILE_MAX_TASKS tasks can be armed at once
+PROFILE_STORE_URL = os.getenv("PROFILE_STORE_URL", CELERY_RESULT_BACKEND)
+PROFILE_TTL = int(os.getenv("PROFILE_TTL", "86400"))
+PROFILE_MAX_TASKS = int(os.getenv("PROFILE_MAX_TASKS", "100"))
 
 # Supported languages
 SUPPORTED_LANGUAGES = [
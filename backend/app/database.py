@@ -0,0 +1,78 @@
+import uuid
+from typing import Any, Dict
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app import metrics, profiling
+from app.config import (
+    DATABASE_URL, ASYNC_DATABASE_URL, DIRECT_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_TRANSACTION_POOLER
+)
+
+# Engines connect on first use, so importing this module never touches the
+# database. The schema is set up separately by `python -m app.schema`.
+
+def pool_options() -> Dict[str, Any]:
+    """
+    Get the engine pool arguments from the configuration.
+
+    Behind a transaction pooler connections are not pooled locally: the
+    pooler already hands out server connections per transaction.
+
+    Returns:
+        Keyword arguments for create_engine / create_async_engine
+    """
+    if DB_TRANSACTION_POOLER:
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+def _pool_capacity():
+    return None if DB_TRANSACTION_POOLER else DB_POOL_SIZE + DB_MAX_OVERFLOW
+
+engine = create_engine(DATABASE_URL, **pool_options())
+metrics.instrument_pool(engine, "sync", _pool_capacity())
+profiling.instrument_sql(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Session-level state (advisory locks, SET) needs one server connection for
+# its whole lifetime, which a transaction pooler doesn't guarantee
+if DB_TRANSACTION_POOLER:
+    direct_engine = create_engine(DIRECT_DATABASE_URL, poolclass=NullPool)
+else:
+    direct_engine = engine
+
+_async_engine = None
+
+def get_async_engine():
+    """
+    Get the process-wide async engine, created on first use.
+
+    Only the API uses it, so workers never import the async driver. Behind
+    a transaction pooler prepared statements are neither cached nor reused
+    by name, since each transaction may run on another server connection.
+
+    Returns:
+        AsyncEngine for ASYNC_DATABASE_URL
+    """
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        connect_args = {}
+        if DB_TRANSACTION_POOLER:
+            connect_args = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__"
+            }
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=connect_args, **pool_options())
+        metrics.instrument_pool(_async_engine.sync_engine, "async", _pool_capacity())
+        profiling.instrument_sql(_async_engine.sync_engine)
+    return _async_engine
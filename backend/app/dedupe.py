@@ -0,0 +1,369 @@
+import hashlib
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.config import NEAR_DUPLICATE_THRESHOLD
+from app.models import ChunkMinhashBand, CodeChunk, content_hash
+
+# MinHash/LSH layout. Stored signatures and bands depend on it, so changing
+# any of these requires re-ingesting.
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+# Shingles are runs of this many tokens; whitespace and layout don't count
+SHINGLE_SIZE = 5
+# Fewer distinct shingles than this make similarity estimates meaningless
+MIN_SHINGLES = 10
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_PRIME = (1 << 61) - 1
+_HASH_MASK = (1 << 32) - 1
+
+def _hash64(data: bytes, signed: bool = False) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=signed)
+
+# Universal hash functions (a * x + b) mod p simulating the permutations;
+# derived from fixed seeds so every process computes the same signatures
+_PERMUTATIONS = [
+    (_hash64(f"minhash-a-{i}".encode()) % (_PRIME - 1) + 1, _hash64(f"minhash-b-{i}".encode()) % _PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+
+# Advisory locks serializing writers of the same code, in buckets so one
+# transaction never holds more than HASH_LOCK_BUCKETS locks
+HASH_LOCK_NAMESPACE = 7_340_002
+HASH_LOCK_BUCKETS = 256
+
+class Duplicate(NamedTuple):
+    # Canonical chunk the code duplicates
+    chunk_id: int
+    # Estimated Jaccard similarity, 1.0 for identical code
+    similarity: float
+
+def minhash_signature(code: str) -> Optional[bytes]:
+    """
+    Compute the MinHash signature of a piece of code.
+
+    Args:
+        code: The code to sign
+
+    Returns:
+        Packed signature, or None when the code is too short to compare
+    """
+    tokens = _TOKEN_RE.findall(code)
+    shingles = {
+        _hash64(" ".join(tokens[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    return array("I", [
+        min((a * shingle + b) % _PRIME for shingle in shingles) & _HASH_MASK
+        for a, b in _PERMUTATIONS
+    ]).tobytes()
+
+def signature_similarity(first: bytes, second: bytes) -> float:
+    """
+    Estimate the Jaccard similarity of the code behind two signatures.
+
+    Args:
+        first: Signature from minhash_signature
+        second: Signature from minhash_signature
+
+    Returns:
+        Fraction of matching signature values
+    """
+    a, b = array("I"), array("I")
+    a.frombytes(first)
+    b.frombytes(second)
+    if len(a) != len(b):
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def band_hashes(signature: bytes) -> List[int]:
+    """
+    Hash each LSH band of a signature.
+
+    Code sharing any band hash is a near-duplicate candidate; with 16 bands
+    of 8 rows, pairs above ~0.7 similarity are very likely to share one.
+
+    Args:
+        signature: Signature from minhash_signature
+
+    Returns:
+        Signed 64-bit hash per band, in band order
+    """
+    width = len(signature) // BANDS
+    return [_hash64(signature[band * width:(band + 1) * width], signed=True) for band in range(BANDS)]
+
+def lock_hashes(db: Session, hashes: Iterable[str]) -> None:
+    """
+    Serialize transactions writing the same code until they commit.
+
+    Without this two workers could both store the same new code as
+    canonical; the second one now waits and links to the first.
+
+    Args:
+        db: Database session inside the writing transaction
+        hashes: Content hashes about to be written
+    """
+    buckets = sorted({int(chunk_hash[:8], 16) % HASH_LOCK_BUCKETS for chunk_hash in hashes})
+    if buckets:
+        # Locks are taken in bucket order, so concurrent writers can't deadlock
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, bucket) FROM unnest(:buckets) AS bucket ORDER BY bucket"),
+            {"namespace": HASH_LOCK_NAMESPACE, "buckets": buckets}
+        )
+
+def canonical_ids(db: Session, hashes: Iterable[str], exclude: Sequence[int] = ()) -> Dict[str, int]:
+    """
+    Find the canonical chunk of each content hash that is already stored.
+
+    Args:
+        db: Database session
+        hashes: Content hashes to look up
+        exclude: Chunk ids that don't count, e.g. rows about to change
+
+    Returns:
+        Canonical chunk id by content hash, for the stored hashes
+    """
+    hashes = list(set(hashes))
+    if not hashes:
+        return {}
+
+    root = func.coalesce(CodeChunk.duplicate_of, CodeChunk.id)
+    statement = (
+        select(CodeChunk.content_hash, func.min(root))
+        .where(CodeChunk.content_hash.in_(hashes))
+        .group_by(CodeChunk.content_hash)
+    )
+    if exclude:
+        statement = statement.where(CodeChunk.id.notin_(exclude), root.notin_(exclude))
+    return dict(db.execute(statement).all())
+
+def near_duplicates(
+    db: Session,
+    signatures: Dict[Any, bytes],
+    exclude: Sequence[int] = (),
+    threshold: float = NEAR_DUPLICATE_THRESHOLD
+) -> Dict[Any, Duplicate]:
+    """
+    Find the most similar canonical chunk for each signature.
+
+    Candidates come from the LSH bands in one query; their similarity is
+    then estimated from the stored signatures.
+
+    Args:
+        db: Database session
+        signatures: Signatures to match, by caller-chosen key
+        exclude: Chunk ids that don't count
+        threshold: Minimum estimated similarity
+
+    Returns:
+        Best match by key, for keys with a match at or above threshold
+    """
+    signatures = {key: signature for key, signature in signatures.items() if signature}
+    if threshold <= 0 or not signatures:
+        return {}
+
+    keys_by_band: Dict[Tuple[int, int], List[Any]] = {}
+    for key, signature in signatures.items():
+        for band, band_hash in enumerate(band_hashes(signature)):
+            keys_by_band.setdefault((band, band_hash), []).append(key)
+
+    rows = db.execute(
+        select(ChunkMinhashBand.band, ChunkMinhashBand.band_hash, ChunkMinhashBand.chunk_id)
+        .where(tuple_(ChunkMinhashBand.band, ChunkMinhashBand.band_hash).in_(list(keys_by_band)))
+    ).all()
+
+    excluded = set(exclude)
+    candidates: Dict[Any, set] = {}
+    for row in rows:
+        if row.chunk_id not in excluded:
+            for key in keys_by_band[(row.band, row.band_hash)]:
+                candidates.setdefault(key, set()).add(row.chunk_id)
+    if not candidates:
+        return {}
+
+    stored = dict(db.execute(
+        select(CodeChunk.id, CodeChunk.minhash)
+        .where(CodeChunk.id.in_(set().union(*candidates.values())), CodeChunk.duplicate_of.is_(None))
+    ).all())
+
+    matches = {}
+    for key, chunk_ids in candidates.items():
+        scored = [
+            (signature_similarity(signatures[key], stored[chunk_id]), -chunk_id)
+            for chunk_id in chunk_ids
+            if stored.get(chunk_id)
+        ]
+        if scored:
+            similarity, chunk_id = max(scored)
+            if similarity >= threshold:
+                matches[key] = Duplicate(-chunk_id, similarity)
+    return matches
+
+def find_duplicates(
+    db: Session,
+    hashes: Dict[Any, str],
+    signatures: Dict[Any, Optional[bytes]],
+    exclude: Sequence[int] = ()
+) -> Dict[Any, Duplicate]:
+    """
+    Find stored canonical chunks that new code duplicates, exactly or nearly.
+
+    Args:
+        db: Database session
+        hashes: Content hashes of the new code, by caller-chosen key
+        signatures: MinHash signatures of the new code, by the same keys
+        exclude: Chunk ids that don't count, e.g. rows about to change
+
+    Returns:
+        Duplicate by key, for keys whose code is already stored
+    """
+    roots = canonical_ids(db, hashes.values(), exclude)
+    found = {key: Duplicate(roots[chunk_hash], 1.0) for key, chunk_hash in hashes.items() if chunk_hash in roots}
+    found.update(near_duplicates(
+        db, {key: signature for key, signature in signatures.items() if key not in found}, exclude
+    ))
+    return found
+
+def load_analyses(db: Session, chunk_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Load the LLM results of stored chunks so duplicates can reuse them.
+
+    Args:
+        db: Database session
+        chunk_ids: Chunk ids to load
+
+    Returns:
+        Dictionary with incomplete, description and embedding by chunk id
+    """
+    chunk_ids = list(set(chunk_ids))
+    if not chunk_ids:
+        return {}
+
+    rows = db.execute(
+        select(CodeChunk.id, CodeChunk.incomplete, CodeChunk.description, CodeChunk.embedding)
+        .where(CodeChunk.id.in_(chunk_ids))
+    ).all()
+    return {
+        row.id: {"incomplete": row.incomplete, "description": row.description, "embedding": row.embedding}
+        for row in rows
+    }
+
+def index_signatures(db: Session, chunks: Iterable[Tuple[int, Optional[bytes]]]) -> None:
+    """
+    Store the LSH bands of canonical chunks so later code can match them.
+
+    Args:
+        db: Database session
+        chunks: (chunk id, signature) pairs; chunks without a signature are skipped
+    """
+    rows = [
+        {"band": band, "band_hash": band_hash, "chunk_id": chunk_id}
+        for chunk_id, signature in chunks
+        if signature
+        for band, band_hash in enumerate(band_hashes(signature))
+    ]
+    if rows:
+        db.execute(insert(ChunkMinhashBand).on_conflict_do_nothing(), rows)
+
+def unindex_signatures(db: Session, chunk_ids: Sequence[int]) -> None:
+    """
+    Drop the LSH bands of chunks whose code is about to change.
+
+    Args:
+        db: Database session
+        chunk_ids: Chunk ids
+    """
+    if chunk_ids:
+        db.execute(delete(ChunkMinhashBand).where(ChunkMinhashBand.chunk_id.in_(chunk_ids)))
+
+def release_duplicates(db: Session, chunk_ids: Sequence[int]) -> None:
+    """
+    Hand the duplicates of canonical chunks about to change or be deleted
+    over to new canonical chunks.
+
+    The oldest exact copy takes over the whole cluster, and the released
+    chunk itself is linked to it until it is rewritten or deleted. Without
+    an exact copy, each group of identical near duplicates gets its own
+    canonical chunk.
+
+    Args:
+        db: Database session inside the writing transaction
+        chunk_ids: Chunk ids about to change or be deleted
+    """
+    released = set(chunk_ids)
+    if not released:
+        return
+
+    canonical = dict(db.execute(
+        select(CodeChunk.id, CodeChunk.content_hash)
+        .where(CodeChunk.id.in_(released), CodeChunk.duplicate_of.is_(None))
+    ).all())
+    if not canonical:
+        return
+
+    dependents = db.execute(
+        select(CodeChunk.id, CodeChunk.duplicate_of, CodeChunk.content_hash, CodeChunk.minhash)
+        .where(CodeChunk.duplicate_of.in_(list(canonical)), CodeChunk.id.notin_(released))
+        .order_by(CodeChunk.id)
+    ).all()
+    if not dependents:
+        return
+
+    groups: Dict[Tuple[int, str], List[Any]] = {}
+    for row in dependents:
+        groups.setdefault((row.duplicate_of, row.content_hash), []).append(row)
+
+    demoted, promoted, relinked = [], [], []
+    for (old_id, chunk_hash), rows in groups.items():
+        exact = groups.get((old_id, canonical[old_id]))
+        heir = exact[0] if exact else rows[0]
+        if exact and rows is exact:
+            demoted.append({"id": old_id, "duplicate_of": heir.id})
+        if heir is rows[0]:
+            promoted.append(heir)
+            rows = rows[1:]
+        relinked += [{"id": row.id, "duplicate_of": heir.id} for row in rows]
+
+    # The released chunk must stop being canonical before its copy takes over
+    if demoted:
+        db.execute(update(CodeChunk), demoted)
+    db.execute(update(CodeChunk), [{"id": row.id, "duplicate_of": None} for row in promoted])
+    if relinked:
+        db.execute(update(CodeChunk), relinked)
+    index_signatures(db, [(row.id, row.minhash) for row in promoted])
+
+def link_chunk(db: Session, chunk: CodeChunk) -> None:
+    """
+    Keep a chunk written through the ORM consistent with deduplication.
+
+    A new chunk whose code is stored already is linked to the canonical
+    chunk; a chunk whose code changed first hands its duplicates over.
+    Canonical chunks get their LSH bands. The chunk is flushed.
+
+    Args:
+        db: Database session
+        chunk: New or modified chunk
+    """
+    if chunk.id is not None:
+        release_duplicates(db, [chunk.id])
+        unindex_signatures(db, [chunk.id])
+
+    chunk.content_hash = content_hash(chunk.raw)
+    chunk.minhash = minhash_signature(chunk.raw) if NEAR_DUPLICATE_THRESHOLD > 0 else None
+    exclude = [chunk.id] if chunk.id is not None else []
+    chunk.duplicate_of = canonical_ids(db, [chunk.content_hash], exclude).get(chunk.content_hash)
+
+    db.add(chunk)
+    db.flush()
+    if chunk.duplicate_of is None:
+        index_signatures(db, [(chunk.id, chunk.minhash)])
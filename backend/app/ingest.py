@@ -1,12 +1,25 @@
+import contextvars
+import io
 import os
-from celery import Celery
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
+from celery import Celery, chord
+from celery.exceptions import Ignore
+from datetime import datetime, timezone
+from sqlalchemy import and_, delete, func, insert, or_, select, update
 import logging
 
-from app.config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, DATABASE_URL
-from app.models import Base, CodeChunk
-from app.utils import detect_language, generate_embedding, generate_description, chunk_code, is_incomplete_code
+from app.config import (
+    CELERY_BROKER_URL, CELERY_RESULT_BACKEND, INGEST_CONCURRENCY, DUPLICATE_POLICY,
+    NEAR_DUPLICATE_THRESHOLD
+)
+from app.chunking import iter_chunks
+from app.models import CodeChunk, content_hash, template_chunks
+from app.reingest import plan_reingest
+from app.syntax import check_incomplete
+from app.utils import generate_embeddings, generate_description, is_incomplete_code
+from app import blobstore, dedupe, metrics, vector_index
+from app.database import SessionLocal, direct_engine, engine
+from app.archive import ArchiveScan, resolve_local_path
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,22 +28,70 @@ logger = logging.getLogger(__name__)
 # Initialize Celery
 celery_app = Celery("code_indexer", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
 
-# Database setup
-engine = create_engine(DATABASE_URL)
-Base.metadata.create_all(bind=engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def analyze_chunks(code_chunks, language, concurrency=None):
+    """
+    Run the LLM analysis for many chunks with bounded concurrency.
+    
+    Incompleteness checks and descriptions are fanned out per chunk while
+    embeddings are generated in batches alongside them.
+    
+    Args:
+        code_chunks: The code chunks to analyze
+        language: Programming language of the code
+        concurrency: Maximum concurrent LLM calls (1 runs serially)
+        
+    Returns:
+        List of dictionaries with incomplete, description and embedding,
+        in chunk order
+    """
+    concurrency = max(1, concurrency or INGEST_CONCURRENCY)
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Each call runs in a copy of this context, so the task's timing
+        # breakdown sees the LLM time
+        def submit(fn, *args):
+            return executor.submit(contextvars.copy_context().run, fn, *args)
+        
+        embeddings_future = submit(generate_embeddings, code_chunks)
+        incomplete_futures = [
+            submit(is_incomplete_code, code_chunk, language)
+            for code_chunk in code_chunks
+        ]
+        description_futures = [
+            submit(generate_description, code_chunk, language)
+            for code_chunk in code_chunks
+        ]
+        
+        embeddings = embeddings_future.result()
+        
+        return [
+            {
+                "incomplete": incomplete_future.result(),
+                "description": description_future.result(),
+                "embedding": embedding
+            }
+            for incomplete_future, description_future, embedding
+            in zip(incomplete_futures, description_futures, embeddings)
+        ]
 
 @celery_app.task(name="app.ingest.process_code")
-def process_code(code, name, language, max_tokens=1000, overlap=50):
+def process_code(code, name, language, max_tokens=1000, overlap=50, concurrency=None, blob_ref=None):
     """
     Process code by chunking, generating embeddings and descriptions.
     
+    Code ingested again under the same name is diffed against the stored
+    chunks; only chunks whose code changed are analyzed and written.
+    Changed chunks that duplicate stored code, exactly or nearly, reuse its
+    analysis and are linked to it (or skipped, see DUPLICATE_POLICY).
+    
     Args:
-        code: The code to process
-        name: Name for the code snippet
+        code: The code to process, or None when it is passed by blob_ref
+        name: Name for the code snippet, also identifies its source
         language: Programming language of the code
         max_tokens: Maximum tokens per chunk
         overlap: Number of overlapping tokens between chunks
+        concurrency: Maximum concurrent LLM calls, defaults to INGEST_CONCURRENCY
+        blob_ref: Reference to the code in the blob store, deleted once processed
         
     Returns:
         Dictionary with processing results
@@ -38,23 +99,46 @@ def process_code(code, name, language, max_tokens=1000, overlap=50):
     logger.info(f"Processing code: {name}, language: {language}")
     
     try:
+        if blob_ref:
+            with metrics.stage("read_blob"):
+                code = blobstore.read_blob(blob_ref).decode("utf-8", errors="replace")
+        
         # Chunk the code
-        code_chunks = chunk_code(code, max_tokens, overlap)
-        logger.info(f"Split into {len(code_chunks)} chunks")
-        
-        # Process each chunk
-        chunk_ids = []
-        for i, code_chunk in enumerate(code_chunks):
-            chunk_id = process_code_chunk(
-                code_chunk, 
-                f"{name}_chunk_{i+1}" if len(code_chunks) > 1 else name,
-                language
+        with metrics.stage("chunk"):
+            spans = list(iter_chunks(code, max_tokens, overlap, language))
+            hashes = [content_hash(span.text) for span in spans]
+        logger.info(f"Split into {len(spans)} chunks")
+        
+        # Run the LLM calls only for chunks that aren't stored already,
+        # neither in this source nor as a duplicate elsewhere
+        signatures = {}
+        db = SessionLocal()
+        try:
+            with metrics.stage("plan"):
+                plan = plan_reingest(load_source_chunks(db, name), hashes)
+                leaders = find_chunk_duplicates(db, plan, spans, hashes, signatures)[1]
+        finally:
+            db.close()
+        to_analyze = sorted(leaders.values())
+        with metrics.stage("llm_analysis"):
+            analyses = dict(zip(
+                to_analyze,
+                analyze_chunks([spans[i].text for i in to_analyze], language, concurrency)
+            ))
+        
+        with metrics.stage("save"):
+            chunk_ids, plan, duplicates = save_source_chunks(
+                name, language, spans, hashes, analyses, concurrency, signatures
             )
-            chunk_ids.append(chunk_id)
+        schedule_index_maintenance()
         
         return {
             "status": "success",
-            "message": f"Processed {len(code_chunks)} chunks",
+            "message": (
+                f"Processed {len(spans)} chunks: {len(plan.keep)} unchanged, {len(plan.update)} updated, "
+                f"{len(plan.insert)} inserted, {len(plan.delete)} removed, {duplicates} duplicates"
+            ),
+            "name": name,
             "chunk_ids": chunk_ids
         }
     
@@ -62,58 +146,459 @@ def process_code(code, name, language, max_tokens=1000, overlap=50):
         logger.error(f"Error processing code: {str(e)}")
         return {
             "status": "error",
-            "message": f"Failed to process code: {str(e)}"
+            "message": f"Failed to process code: {str(e)}",
+            "name": name
         }
+    
+    finally:
+        if blob_ref:
+            blobstore.delete_blob(blob_ref)
 
-def process_code_chunk(code, name, language):
+def load_source_chunks(db, name):
     """
-    Process a single code chunk.
+    Load the stored chunks of an ingested source.
+    
+    Chunks stored before sources were tracked are matched by their name.
     
     Args:
-        code: The code chunk to process
-        name: Name for the chunk
-        language: Programming language of the code
+        db: Database session
+        name: Name the source was ingested under
+        
+    Returns:
+        List of rows with id, content_hash, start_line, end_line and name
+    """
+    legacy_names = or_(
+        CodeChunk.name == name,
+        CodeChunk.name.startswith(f"{name}_chunk_", autoescape=True)
+    )
+    return db.execute(
+        select(CodeChunk.id, CodeChunk.content_hash, CodeChunk.start_line, CodeChunk.end_line, CodeChunk.name)
+        .where(or_(
+            CodeChunk.source_name == name,
+            and_(CodeChunk.source_name.is_(None), CodeChunk.type == "code", legacy_names)
+        ))
+    ).all()
+
+def find_chunk_duplicates(db, plan, spans, hashes, signatures):
+    """
+    Find the changed chunks of a plan whose code is stored already, or
+    repeats an earlier changed chunk.
+    
+    Args:
+        db: Database session
+        plan: Re-ingest plan of the source
+        spans: New chunks with their line spans
+        hashes: Content hashes of the new chunks
+        signatures: MinHash signatures by new chunk index, filled in as needed
         
     Returns:
-        ID of the created chunk
+        Tuple of the stored duplicates by new chunk index, and the chunk
+        index analyzed for each remaining content hash
     """
-    # Check if code is incomplete
-    incomplete = is_incomplete_code(code, language)
+    if NEAR_DUPLICATE_THRESHOLD > 0:
+        for i in plan.changed:
+            if i not in signatures:
+                signatures[i] = dedupe.minhash_signature(spans[i].text)
+    
+    # Rows about to be rewritten or deleted can't be reused
+    updated = {i for _, i in plan.update}
+    exclude = [chunk_id for chunk_id, _ in plan.update] + plan.delete
+    duplicates = dedupe.find_duplicates(
+        db,
+        {i: hashes[i] for i in plan.changed},
+        {i: signatures.get(i) for i in plan.changed},
+        exclude
+    )
     
-    # Generate description
-    description = generate_description(code, language)
+    # Updated rows come first so copies among the new rows can link to them
+    leaders = {}
+    for i in sorted(plan.changed, key=lambda i: (i not in updated, i)):
+        if i not in duplicates:
+            leaders.setdefault(hashes[i], i)
+    return duplicates, leaders
+
+def save_source_chunks(name, language, spans, hashes, analyses, concurrency=None, signatures=None):
+    """
+    Bring the stored chunks of a source in line with its new chunks, in one
+    transaction.
     
-    # Generate embedding
-    embedding = generate_embedding(code)
+    The diff is planned again under a lock on the source, so concurrent
+    ingests of the same name don't interleave; chunks the earlier plan
+    didn't analyze are analyzed here. Duplicates are looked up again under
+    locks on their content hashes.
     
-    # Create database session
+    Args:
+        name: Name the source was ingested under
+        language: Programming language of the code
+        spans: New chunks with their line spans
+        hashes: Content hashes of the new chunks
+        analyses: LLM analyses by new chunk index
+        concurrency: Maximum concurrent LLM calls
+        signatures: MinHash signatures by new chunk index
+        
+    Returns:
+        Tuple of the chunk ids in chunk order, the applied plan and the
+        number of changed chunks that duplicate other code
+    """
+    signatures = {} if signatures is None else signatures
     db = SessionLocal()
     
     try:
-        # Create new chunk
-        chunk = CodeChunk(
-            language=language,
-            name=name,
-            description=description,
-            raw=code,
-            embedding=embedding,
-            incomplete=incomplete,
-            type="code"
-        )
+        db.execute(select(func.pg_advisory_xact_lock(func.hashtext(name))))
+        existing = load_source_chunks(db, name)
+        plan = plan_reingest(existing, hashes)
+        
+        # Rows about to be rewritten or deleted hand their duplicates over first
+        dedupe.lock_hashes(db, [hashes[i] for i in plan.changed])
+        dedupe.release_duplicates(db, [chunk_id for chunk_id, _ in plan.update] + plan.delete)
+        dedupe.unindex_signatures(db, [chunk_id for chunk_id, _ in plan.update])
+        duplicates, leaders = find_chunk_duplicates(db, plan, spans, hashes, signatures)
+        
+        missing = [i for i in leaders.values() if i not in analyses]
+        if missing:
+            analyses.update(zip(missing, analyze_chunks([spans[i].text for i in missing], language, concurrency)))
+        
+        # Duplicates reuse the analysis of the code they duplicate
+        stored = dedupe.load_analyses(db, [duplicate.chunk_id for duplicate in duplicates.values()])
+        for i in plan.changed:
+            if i in duplicates:
+                analysis = dict(stored[duplicates[i].chunk_id])
+                if duplicates[i].similarity < 1.0:
+                    # Near duplicates differ, so check their own code when possible
+                    incomplete = check_incomplete(spans[i].text, language)
+                    if incomplete is not None:
+                        analysis["incomplete"] = incomplete
+                analyses[i] = analysis
+            elif leaders[hashes[i]] != i:
+                analyses[i] = analyses[leaders[hashes[i]]]
+        
+        def chunk_name(i):
+            return f"{name}_chunk_{i+1}" if len(spans) > 1 else name
         
-        db.add(chunk)
-        db.commit()
-        db.refresh(chunk)
+        now = datetime.now(timezone.utc)
+        chunk_ids = [None] * len(spans)
+        stored = {row.id: row for row in existing}
         
-        return chunk.id
+        # Unchanged code: only touch rows whose name or span moved
+        moved = []
+        for chunk_id, i in plan.keep:
+            chunk_ids[i] = chunk_id
+            row = stored[chunk_id]
+            if (row.name, row.start_line, row.end_line) != (chunk_name(i), spans[i].start_line, spans[i].end_line):
+                moved.append({
+                    "id": chunk_id, "name": chunk_name(i), "source_name": name,
+                    "start_line": spans[i].start_line, "end_line": spans[i].end_line, "updated_at": now
+                })
+        if moved:
+            db.execute(update(CodeChunk), moved)
+        
+        def values(i):
+            return {
+                "language": language,
+                "name": chunk_name(i),
+                "description": analyses[i]["description"],
+                "raw": spans[i].text,
+                "content_hash": hashes[i],
+                "embedding": analyses[i]["embedding"],
+                "incomplete": analyses[i]["incomplete"],
+                "type": "code",
+                "source_name": name,
+                "start_line": spans[i].start_line,
+                "end_line": spans[i].end_line,
+                "minhash": signatures.get(i)
+            }
+        
+        # Changed code reuses existing rows so their ids stay stable
+        if plan.update:
+            for chunk_id, i in plan.update:
+                chunk_ids[i] = chunk_id
+            
+            def duplicate_of(i):
+                if i in duplicates:
+                    return duplicates[i].chunk_id
+                # Leaders among updated rows are written in this statement
+                return chunk_ids[leaders[hashes[i]]] if leaders[hashes[i]] != i else None
+            
+            db.execute(update(CodeChunk), [
+                {"id": chunk_id, **values(i), "duplicate_of": duplicate_of(i), "updated_at": now}
+                for chunk_id, i in plan.update
+            ])
+            dedupe.index_signatures(db, [
+                (chunk_id, signatures.get(i)) for chunk_id, i in plan.update if duplicate_of(i) is None
+            ])
+        
+        # Exact copies among new rows are linked by insert_chunks
+        inserted = plan.insert
+        if DUPLICATE_POLICY == "skip":
+            inserted = [i for i in plan.insert if i not in duplicates and leaders[hashes[i]] == i]
+        rows = []
+        for i in inserted:
+            rows.append(values(i))
+            if i in duplicates:
+                rows[-1]["duplicate_of"] = duplicates[i].chunk_id
+        for i, chunk_id in zip(inserted, insert_chunks(db, rows)):
+            chunk_ids[i] = chunk_id
+        
+        # Skipped duplicates resolve to the chunk they duplicate
+        for i in plan.insert:
+            if chunk_ids[i] is None:
+                chunk_ids[i] = duplicates[i].chunk_id if i in duplicates else chunk_ids[leaders[hashes[i]]]
+        
+        if plan.delete:
+            # Chunks used by templates are detached from the source instead
+            in_templates = set(db.execute(
+                select(template_chunks.c.chunk_id).where(template_chunks.c.chunk_id.in_(plan.delete))
+            ).scalars())
+            if in_templates:
+                db.execute(
+                    update(CodeChunk)
+                    .where(CodeChunk.id.in_(in_templates))
+                    .values(source_name=None, updated_at=now)
+                )
+            removed = [chunk_id for chunk_id in plan.delete if chunk_id not in in_templates]
+            if removed:
+                db.execute(delete(CodeChunk).where(CodeChunk.id.in_(removed)))
+        
+        with metrics.stage("commit"):
+            db.commit()
+        return chunk_ids, plan, sum(1 for i in plan.changed if i in duplicates or leaders[hashes[i]] != i)
     
     except Exception as e:
         db.rollback()
-        logger.error(f"Error saving chunk to database: {str(e)}")
+        logger.error(f"Error saving chunks to database: {str(e)}")
         raise
     
     finally:
         db.close()
 
+# Maximum number of per-file errors reported by an archive summary
+MAX_REPORTED_ERRORS = 100
+
+@celery_app.task(bind=True, name="app.ingest.expand_archive", time_limit=3600, soft_time_limit=3300)
+def expand_archive(self, name, blob_ref=None, path=None, max_tokens=1000, overlap=50):
+    """
+    Expand an archive or directory into one process_code task per code file.
+    
+    Files are fanned out as a chord, so this task's id ends up holding the
+    aggregate result from summarize_archive.
+    
+    Args:
+        name: Prefix for the names of the ingested files
+        blob_ref: Reference to an uploaded zip/tar archive in the blob store
+        path: Server-local directory or archive, used when blob_ref is None
+        max_tokens: Maximum tokens per chunk
+        overlap: Number of overlapping tokens between chunks
+        
+    Returns:
+        Dictionary with the aggregate results (through the chord)
+    """
+    logger.info(f"Expanding archive: {name}")
+    
+    scan = ArchiveScan()
+    tasks = []
+    try:
+        if blob_ref:
+            with blobstore.open_blob(blob_ref) as stream:
+                tasks = file_tasks(scan.iter_archive(stream), name, max_tokens, overlap)
+        else:
+            path = resolve_local_path(path)
+            if os.path.isdir(path):
+                tasks = file_tasks(scan.iter_directory(path), name, max_tokens, overlap)
+            else:
+                with open(path, "rb") as stream:
+                    tasks = file_tasks(scan.iter_archive(stream), name, max_tokens, overlap)
+    
+    except Exception as e:
+        logger.error(f"Error expanding archive: {str(e)}")
+        return {
+            "status": "error",
+            "message": f"Failed to expand archive: {str(e)}"
+        }
+    
+    finally:
+        if blob_ref:
+            blobstore.delete_blob(blob_ref)
+    
+    logger.info(f"Fanning out {len(tasks)} files, skipped {scan.skipped}")
+    if not tasks:
+        return summarize_archive([], name, scan.skipped, scan.truncated)
+    
+    try:
+        raise self.replace(chord(tasks, summarize_archive.s(name, scan.skipped, scan.truncated)))
+    except Ignore:
+        # The chord was queued and now stands in for this task
+        raise
+    except Exception:
+        # The files' blobs would be left behind with nothing to read them
+        delete_task_blobs(tasks)
+        raise
+
+def file_tasks(files, name, max_tokens, overlap):
+    """
+    Store each file in the blob store and build its process_code task.
+    
+    Args:
+        files: Iterator over ArchiveFile tuples
+        name: Prefix for the names of the ingested files
+        max_tokens: Maximum tokens per chunk
+        overlap: Number of overlapping tokens between chunks
+        
+    Returns:
+        List of process_code signatures
+    """
+    tasks = []
+    try:
+        for archive_file in files:
+            blob_ref = blobstore.write_blob(io.BytesIO(archive_file.data))[0]
+            tasks.append(process_code.s(
+                None, f"{name}/{archive_file.path}", archive_file.language, max_tokens, overlap,
+                blob_ref=blob_ref
+            ))
+    except Exception:
+        # Don't leave the blobs of files that will never be processed
+        delete_task_blobs(tasks)
+        raise
+    return tasks
+
+def delete_task_blobs(tasks):
+    """
+    Delete the blobs of process_code tasks that won't run.
+    
+    Args:
+        tasks: process_code signatures built by file_tasks
+    """
+    for task in tasks:
+        blobstore.delete_blob(task.kwargs["blob_ref"])
+
+@celery_app.task(name="app.ingest.summarize_archive")
+def summarize_archive(results, name, skipped, truncated):
+    """
+    Aggregate the results of the process_code tasks of an archive.
+    
+    Args:
+        results: process_code results, one per file
+        name: Name the archive was ingested under
+        skipped: Counts of skipped files by reason
+        truncated: Whether the file limit stopped the scan early
+        
+    Returns:
+        Dictionary with the aggregate results
+    """
+    failed = [result for result in results if result.get("status") != "success"]
+    chunk_count = sum(len(result.get("chunk_ids", [])) for result in results)
+    
+    return {
+        "status": "success" if not failed or len(failed) < len(results) else "error",
+        "message": f"Processed {len(results) - len(failed)} of {len(results)} files into {chunk_count} chunks",
+        "name": name,
+        "files": len(results),
+        "failed": len(failed),
+        "chunks": chunk_count,
+        "skipped": skipped,
+        "truncated": truncated,
+        "errors": [
+            {"name": result.get("name"), "message": result.get("message")}
+            for result in failed[:MAX_REPORTED_ERRORS]
+        ]
+    }
+
+def insert_chunks(db, rows):
+    """
+    Insert many chunks with a single multi-row INSERT ... RETURNING.
+    
+    Rows without a duplicate_of value are linked to the stored chunk with
+    the same code, or to the first row of the batch with it; copies are
+    inserted after the rows they point at. The caller owns the transaction,
+    so a batch either lands completely or not at all.
+    
+    Args:
+        db: Database session
+        rows: Column values for each chunk
+        
+    Returns:
+        IDs of the created chunks, in row order
+    """
+    if not rows:
+        return []
+    
+    for row in rows:
+        if "content_hash" not in row:
+            row["content_hash"] = content_hash(row["raw"])
+    
+    dedupe.lock_hashes(db, [row["content_hash"] for row in rows])
+    roots = dedupe.canonical_ids(db, [row["content_hash"] for row in rows if "duplicate_of" not in row])
+    
+    leaders = {}
+    copies = {}
+    for i, row in enumerate(rows):
+        if "duplicate_of" in row:
+            continue
+        chunk_hash = row["content_hash"]
+        if chunk_hash in roots:
+            row["duplicate_of"] = roots[chunk_hash]
+        elif chunk_hash in leaders:
+            copies[i] = leaders[chunk_hash]
+        else:
+            leaders[chunk_hash] = i
+            row["duplicate_of"] = None
+    
+    def insert_rows(indexes):
+        result = db.execute(
+            insert(CodeChunk).returning(CodeChunk.id, sort_by_parameter_order=True),
+            [rows[i] for i in indexes]
+        )
+        return list(result.scalars())
+    
+    chunk_ids = [None] * len(rows)
+    first = [i for i in range(len(rows)) if i not in copies]
+    for i, chunk_id in zip(first, insert_rows(first)):
+        chunk_ids[i] = chunk_id
+    if copies:
+        for i, leader in copies.items():
+            rows[i]["duplicate_of"] = chunk_ids[leader]
+        for i, chunk_id in zip(copies, insert_rows(list(copies))):
+            chunk_ids[i] = chunk_id
+    
+    dedupe.index_signatures(db, [
+        (chunk_id, row.get("minhash")) for chunk_id, row in zip(chunk_ids, rows) if row["duplicate_of"] is None
+    ])
+    return chunk_ids
+
+@celery_app.task(name="app.ingest.rebuild_vector_index")
+def rebuild_vector_index(index_type=None, m=None, ef_construction=None, lists=None):
+    """
+    Rebuild the vector index concurrently.
+    
+    Args:
+        index_type: "hnsw" or "ivfflat", defaults to VECTOR_INDEX_TYPE
+        m: HNSW connections per layer
+        ef_construction: HNSW candidate list size during build
+        lists: IVFFlat list count
+        
+    Returns:
+        Dictionary with the build result
+    """
+    try:
+        return vector_index.rebuild_vector_index(direct_engine, index_type, m, ef_construction, lists)
+    except Exception as e:
+        logger.error(f"Error rebuilding vector index: {str(e)}")
+        return {
+            "status": "error",
+            "message": f"Failed to rebuild vector index: {str(e)}"
+        }
+
+def schedule_index_maintenance():
+    """
+    Queue a vector index rebuild after a load if the index is missing,
+    invalid or was built for a much smaller table.
+    """
+    try:
+        reason = vector_index.rebuild_reason(vector_index.get_index_status(engine))
+        if reason:
+            logger.info(f"Scheduling vector index rebuild: {reason}")
+            rebuild_vector_index.delay()
+    except Exception as e:
+        logger.error(f"Error checking vector index: {str(e)}")
+
 if __name__ == "__main__":
     celery_app.start()
@@ -0,0 +1,269 @@
+from datetime import datetime
+from sqlalchemy import insert, select
+import logging
+
+from app import dedupe
+from app.database import SessionLocal
+from app.ingest import celery_app, analyze_chunks, insert_chunks
+from app.models import CodeChunk, ChunkRelation
+from app.templates import get_compiled_template, render_template
+from app.utils import generate_embedding, generate_description, complete_code, chunk_code
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chunk operations that call the LLM, run by the workers so API requests
+# only validate and enqueue them
+
+def _error(action, e):
+    logger.error(f"Error trying to {action}: {str(e)}")
+    return {
+        "status": "error",
+        "message": f"Failed to {action}: {str(e)}"
+    }
+
+@celery_app.task(name="app.jobs.split_chunk")
+def split_chunk(chunk_id, max_tokens=1000, overlap=50):
+    """
+    Split a chunk into smaller chunks related to it as children.
+
+    Args:
+        chunk_id: ID of the chunk to split
+        max_tokens: Maximum tokens per part
+        overlap: Number of overlapping tokens between parts
+
+    Returns:
+        Dictionary with the parent and child chunk IDs
+    """
+    db = SessionLocal()
+
+    try:
+        chunk = db.execute(
+            select(CodeChunk.name, CodeChunk.language, CodeChunk.raw).where(CodeChunk.id == chunk_id)
+        ).first()
+        if not chunk:
+            return {"status": "error", "message": "Chunk not found"}
+
+        # Split the code
+        code_chunks = chunk_code(chunk.raw, max_tokens, overlap, chunk.language)
+
+        if len(code_chunks) <= 1:
+            return {"status": "error", "message": "Chunk is too small to split"}
+
+        # Run the LLM calls for all parts concurrently
+        analyses = analyze_chunks(code_chunks, chunk.language)
+
+        # Create new chunks in one multi-row insert
+        new_chunk_ids = insert_chunks(db, [
+            {
+                "language": chunk.language,
+                "name": f"{chunk.name}_part_{i+1}",
+                "description": analysis["description"],
+                "raw": code,
+                "embedding": analysis["embedding"],
+                "incomplete": analysis["incomplete"],
+                "type": "code"
+            }
+            for i, (code, analysis) in enumerate(zip(code_chunks, analyses))
+        ])
+
+        # Create relations to parent
+        db.execute(
+            insert(ChunkRelation),
+            [{"parent_id": chunk_id, "child_id": child_id} for child_id in new_chunk_ids]
+        )
+
+        db.commit()
+
+        return {"status": "success", "parent_id": chunk_id, "child_ids": new_chunk_ids}
+
+    except Exception as e:
+        db.rollback()
+        return _error("split chunk", e)
+
+    finally:
+        db.close()
+
+@celery_app.task(name="app.jobs.merge_chunks")
+def merge_chunks(chunk_ids, name=None):
+    """
+    Merge chunks, in the given order, into a new chunk related to them.
+
+    Args:
+        chunk_ids: IDs of the chunks to merge
+        name: Name of the merged chunk, generated when None
+
+    Returns:
+        Dictionary with the merged chunk
+    """
+    db = SessionLocal()
+
+    try:
+        chunks = db.query(CodeChunk).filter(CodeChunk.id.in_(chunk_ids)).all()
+        if len(chunks) != len(set(chunk_ids)):
+            return {"status": "error", "message": "One or more chunks not found"}
+
+        # Sort chunks by ID (assuming ID order is meaningful)
+        chunks.sort(key=lambda x: chunk_ids.index(x.id))
+
+        # Merge code
+        merged_code = "\n\n".join(chunk.raw for chunk in chunks)
+
+        # Generate name if not provided
+        if not name:
+            name = f"merged_{'_'.join(str(id) for id in chunk_ids)}"
+
+        # Generate description
+        description = generate_description(merged_code, chunks[0].language)
+
+        # Generate embedding
+        embedding = generate_embedding(merged_code)
+
+        # Create new chunk
+        new_chunk = CodeChunk(
+            language=chunks[0].language,
+            name=name,
+            description=description,
+            raw=merged_code,
+            embedding=embedding,
+            incomplete=any(chunk.incomplete for chunk in chunks),
+            type="code"
+        )
+
+        # Links to an identical stored chunk and gets the ID without committing
+        dedupe.link_chunk(db, new_chunk)
+
+        # Create relations to parent chunks
+        db.execute(
+            insert(ChunkRelation),
+            [{"parent_id": parent_id, "child_id": new_chunk.id} for parent_id in chunk_ids]
+        )
+
+        db.commit()
+
+        return {
+            "status": "success",
+            "id": new_chunk.id,
+            "name": new_chunk.name,
+            "parent_ids": chunk_ids
+        }
+
+    except Exception as e:
+        db.rollback()
+        return _error("merge chunks", e)
+
+    finally:
+        db.close()
+
+@celery_app.task(name="app.jobs.complete_chunk")
+def complete_chunk(chunk_id):
+    """
+    Complete the code of an incomplete chunk with the LLM.
+
+    Args:
+        chunk_id: ID of the chunk to complete
+
+    Returns:
+        Dictionary with the completed chunk
+    """
+    db = SessionLocal()
+
+    try:
+        chunk = db.query(CodeChunk).filter(CodeChunk.id == chunk_id).first()
+        if not chunk:
+            return {"status": "error", "message": "Chunk not found"}
+
+        if chunk.incomplete:
+            # Complete the code
+            completed_code = complete_code(chunk.raw, chunk.language)
+
+            # Update the chunk
+            chunk.raw = completed_code
+            chunk.incomplete = False
+
+            # Update embedding and description
+            chunk.embedding = generate_embedding(completed_code)
+            chunk.description = generate_description(completed_code, chunk.language)
+
+            # The code changed, so its duplicates move to another chunk
+            dedupe.link_chunk(db, chunk)
+            db.commit()
+
+        return {
+            "status": "success",
+            "id": chunk.id,
+            "name": chunk.name,
+            "language": chunk.language,
+            "description": chunk.description,
+            "raw": chunk.raw,
+            "incomplete": chunk.incomplete
+        }
+
+    except Exception as e:
+        db.rollback()
+        return _error("complete chunk", e)
+
+    finally:
+        db.close()
+
+@celery_app.task(name="app.jobs.apply_template")
+def apply_template(template_id, parameters):
+    """
+    Render a template with parameter values into a new chunk.
+
+    Args:
+        template_id: ID of the template
+        parameters: Values for the template placeholders
+
+    Returns:
+        Dictionary with the new chunk
+    """
+    db = SessionLocal()
+
+    try:
+        loaded = get_compiled_template(db, template_id)
+        if not loaded:
+            return {"status": "error", "message": "Template not found"}
+        template, compiled, language = loaded
+
+        # Apply parameters to template
+        combined_code = render_template(compiled, parameters)
+
+        # Generate name
+        name = f"{template.name}_applied_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+        # Generate description
+        description = f"Generated from template: {template.name}"
+        if template.description:
+            description += f"\nTemplate description: {template.description}"
+
+        # Create new chunk
+        new_chunk = CodeChunk(
+            language=language or "unknown",
+            name=name,
+            description=description,
+            raw=combined_code,
+            embedding=generate_embedding(combined_code),
+            incomplete=False,
+            type="code"
+        )
+
+        dedupe.link_chunk(db, new_chunk)
+        db.commit()
+
+        return {
+            "status": "success",
+            "id": new_chunk.id,
+            "name": new_chunk.name,
+            "language": new_chunk.language,
+            "description": new_chunk.description,
+            "raw": new_chunk.raw
+        }
+
+    except Exception as e:
+        db.rollback()
+        return _error("apply template", e)
+
+    finally:
+        db.close()
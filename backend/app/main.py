@@ -1,30 +1,46 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Query, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Query, BackgroundTasks, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy import create_engine, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from typing import List, Optional, Dict, Any
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from typing import List, Optional, Dict, Any, Literal
 from celery import Celery
 from celery.result import AsyncResult
 import uvicorn
 import os
+import io
 import json
+import hashlib
+import redis
 from datetime import datetime
 
-from app.config import DATABASE_URL, CELERY_BROKER_URL, MAX_PAYLOAD_SIZE
-from app.models import Base, CodeChunk, ChunkRelation, Template
+from app import blobstore, cache, database, metrics, profiling, search, vector_index
+from app.config import (
+    CELERY_BROKER_URL, CELERY_RESULT_BACKEND, MAX_PAYLOAD_SIZE, ARCHIVE_MAX_SIZE,
+    ADMIN_TOKEN, PROFILE_MAX_TASKS, HNSW_EF_SEARCH, HYBRID_CANDIDATES, MAX_BULK_CHUNKS
+)
+from app.models import CodeChunk, Template, template_chunks
+from app.archive import archive_name, resolve_local_path
+from app.templates import compiled_for
 from app.utils import (
-    detect_language, is_code, generate_embedding, generate_description,
-    complete_code, chunk_code, is_incomplete_code
+    detect_language_async, is_code_async, get_query_embedding_async, query_embedding_cache,
+    LANGUAGE_SAMPLE_CHARS
 )
-from app.ingest import process_code_chunk
+
+class TimedJSONResponse(JSONResponse):
+    """JSON response whose rendering counts as serialization time."""
+
+    def render(self, content: Any) -> bytes:
+        with profiling.span("serialize"):
+            return super().render(content)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Code Indexer API",
     description="API for managing, searching, and manipulating code snippets",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=TimedJSONResponse
 )
 
 # Configure CORS
@@ -36,25 +52,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database setup
-engine = create_engine(DATABASE_URL)
-Base.metadata.create_all(bind=engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Latency per route template, so path parameters don't multiply the series,
+# and the request's time split into embedding, LLM, SQL and serialization.
+# Admins can profile a single request by sending X-Profile: 1.
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    breakdown = profiling.start_breakdown()
+    profiler = None
+    if request.headers.get("x-profile") and ADMIN_TOKEN and request.headers.get("x-admin-token") == ADMIN_TOKEN:
+        # Profiles the event loop thread, so concurrent requests show up too
+        profiler = profiling.start_profiler()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        if profiler is not None:
+            profiling.stop_profiler(profiler)
+        elapsed = breakdown.elapsed()
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            method=request.method, route=route, status=str(status)
+        ).observe(elapsed)
+        profiling.log_breakdown(breakdown, method=request.method, route=route, path=request.url.path, status=status)
+    
+    response.headers["Server-Timing"] = breakdown.server_timing()
+    if profiler is not None:
+        try:
+            response.headers["X-Profile-Id"] = await run_in_threadpool(
+                profiling.save_profile, profiler, "request", f"{request.method} {route}", elapsed
+            )
+        except redis.RedisError as e:
+            profiling.logger.warning(f"Failed to save request profile: {e}")
+    return response
+
+# Database setup: requests go through the async engine, the sync engine only
+# serves admin endpoints. Nothing connects until the first request; the
+# schema is set up beforehand by `python -m app.schema`.
+SessionLocal = async_sessionmaker(database.get_async_engine(), autoflush=False, expire_on_commit=False)
 
 # Celery setup
-celery_app = Celery("code_indexer", broker=CELERY_BROKER_URL)
+celery_app = Celery("code_indexer", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+
+async def enqueue(name: str, args: Optional[List[Any]] = None, kwargs: Optional[Dict[str, Any]] = None):
+    # Publishing waits on the broker; a slow one mustn't stall the event loop
+    return await run_in_threadpool(celery_app.send_task, name, args=args, kwargs=kwargs)
+
+# UTF-8 bytes needed to cover the characters language detection looks at
+LANGUAGE_SAMPLE_BYTES = LANGUAGE_SAMPLE_CHARS * 4
 
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# Dependency guarding admin endpoints
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin access required")
 
 # API endpoints
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to Code Indexer API"}
 
 @app.post("/ingest/")
@@ -65,55 +124,116 @@ async def ingest_code(
     name: Optional[str] = Form(None),
     language: Optional[str] = Form(None),
     max_tokens: Optional[int] = Form(1000),
-    overlap: Optional[int] = Form(50),
-    db: Session = Depends(get_db)
+    overlap: Optional[int] = Form(50)
 ):
     # Validate input
     if file is None and code is None:
         raise HTTPException(status_code=400, detail="Either file or code must be provided")
     
-    if file:
-        # Check file size
-        file_size = 0
-        content = b""
-        while True:
-            chunk = await file.read(1024)
-            if not chunk:
-                break
-            content += chunk
-            file_size += len(chunk)
-            if file_size > MAX_PAYLOAD_SIZE:
-                raise HTTPException(status_code=400, detail=f"File size exceeds maximum allowed ({MAX_PAYLOAD_SIZE} bytes)")
-        
-        code = content.decode("utf-8", errors="replace")
-        if not name:
-            name = file.filename
+    # The uploaded file name (or the given name) may carry an extension
+    filename = file.filename if file and file.filename else name
     
-    if not code:
-        raise HTTPException(status_code=400, detail="Empty code content")
-    
-    # Check if input is actually code
-    if not is_code(code):
-        raise HTTPException(status_code=400, detail="Input does not appear to be code")
+    # Stream the code into the blob store; only a reference goes through the
+    # broker. Detection needs just the beginning of it.
+    try:
+        with metrics.stage("write_blob"):
+            if file:
+                blob_ref, size, head = await run_in_threadpool(
+                    blobstore.write_blob, file.file, MAX_PAYLOAD_SIZE, LANGUAGE_SAMPLE_BYTES
+                )
+                if not name:
+                    name = file.filename
+            else:
+                data = code.encode("utf-8")
+                if len(data) > MAX_PAYLOAD_SIZE:
+                    raise blobstore.PayloadTooLarge()
+                blob_ref, size, head = await run_in_threadpool(
+                    blobstore.write_blob, io.BytesIO(data), None, LANGUAGE_SAMPLE_BYTES
+                )
+    except blobstore.PayloadTooLarge:
+        raise HTTPException(status_code=400, detail=f"File size exceeds maximum allowed ({MAX_PAYLOAD_SIZE} bytes)")
     
-    # Detect language if not provided
-    if not language:
-        language = detect_language(code)
-        if language == "unknown":
-            raise HTTPException(status_code=400, detail="Could not detect programming language")
+    try:
+        sample = head.decode("utf-8", errors="replace")
+        
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty code content")
+        
+        # Check if input is actually code
+        if not await is_code_async(sample):
+            raise HTTPException(status_code=400, detail="Input does not appear to be code")
+        
+        # Detect language if not provided
+        if not language:
+            language = await detect_language_async(sample, filename=filename, allow_llm=True)
+            if language == "unknown":
+                raise HTTPException(status_code=400, detail="Could not detect programming language")
+    except Exception:
+        await run_in_threadpool(blobstore.delete_blob, blob_ref)
+        raise
     
     # Generate a default name if not provided
     if not name:
         name = f"{language}_snippet_{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
-    # Process code in background
-    task = celery_app.send_task(
-        "app.ingest.process_code",
-        args=[code, name, language, max_tokens, overlap]
-    )
+    # Process code in background; the worker reads and deletes the blob
+    try:
+        task = await enqueue(
+            "app.ingest.process_code",
+            args=[None, name, language, max_tokens, overlap],
+            kwargs={"blob_ref": blob_ref}
+        )
+    except Exception:
+        # No worker will ever read it
+        await run_in_threadpool(blobstore.delete_blob, blob_ref)
+        raise
     
     return {"task_id": task.id, "status": "Processing code in background"}
 
+@app.post("/ingest/archive/")
+async def ingest_archive(
+    file: Optional[UploadFile] = File(None),
+    path: Optional[str] = Form(None),
+    name: Optional[str] = Form(None),
+    max_tokens: Optional[int] = Form(1000),
+    overlap: Optional[int] = Form(50)
+):
+    # Validate input
+    if (file is None) == (path is None):
+        raise HTTPException(status_code=400, detail="Either an archive file or a server path must be provided")
+    
+    if file:
+        # Stream the archive into the blob store; the worker expands it
+        try:
+            with metrics.stage("write_blob"):
+                blob_ref = (await run_in_threadpool(blobstore.write_blob, file.file, ARCHIVE_MAX_SIZE))[0]
+        except blobstore.PayloadTooLarge:
+            raise HTTPException(status_code=400, detail=f"Archive size exceeds maximum allowed ({ARCHIVE_MAX_SIZE} bytes)")
+        kwargs = {"blob_ref": blob_ref}
+        name = name or archive_name(file.filename or "archive")
+    else:
+        try:
+            path = resolve_local_path(path)
+        except ValueError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        kwargs = {"path": path}
+        name = name or archive_name(path)
+    
+    # One task id covers the expansion and every file it fans out to
+    try:
+        task = await enqueue(
+            "app.ingest.expand_archive",
+            args=[name],
+            kwargs={**kwargs, "max_tokens": max_tokens, "overlap": overlap}
+        )
+    except Exception:
+        # An uploaded archive would be left behind with no worker to read it
+        if file:
+            await run_in_threadpool(blobstore.delete_blob, blob_ref)
+        raise
+    
+    return {"task_id": task.id, "status": "Processing archive in background"}
+
 @app.get("/status/{task_id}")
 def get_task_status(task_id: str):
     task_result = AsyncResult(task_id, app=celery_app)
@@ -141,51 +261,265 @@ def get_task_status(task_id: str):
     
     return response
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    stats = cache.get_stats()
+    stats["query_embeddings"] = query_embedding_cache.stats()
+    return stats
+
+@app.get("/metrics")
+def get_metrics():
+    # API processes plus the broker queue depths; workers serve their own
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def get_profiles():
+    try:
+        return {"profiles": profiling.list_profiles(), "armed_tasks": profiling.armed_tasks()}
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Profile store unavailable: {str(e)}")
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(
+    profile_id: str,
+    format: Literal["pstats", "text"] = "pstats",
+    sort: Literal["cumulative", "tottime", "ncalls"] = "cumulative",
+    limit: int = Query(50, ge=1, le=1000)
+):
+    try:
+        data = profiling.load_profile(profile_id)
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Profile store unavailable: {str(e)}")
+    if data is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    if format == "text":
+        return PlainTextResponse(profiling.format_profile(data, sort, limit))
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'}
+    )
+
+@app.post("/admin/profiles/tasks", dependencies=[Depends(require_admin)])
+def profile_tasks(count: int = Form(1), task: Optional[str] = Form(None)):
+    if not 0 <= count <= PROFILE_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"count must be between 0 and {PROFILE_MAX_TASKS}")
+    
+    # Workers claim the slots as they start tasks; 0 disarms
+    try:
+        profiling.arm_tasks(count, task)
+        return profiling.armed_tasks()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Profile store unavailable: {str(e)}")
+
+@app.get("/admin/vector-index", dependencies=[Depends(require_admin)])
+def get_vector_index():
+    status = vector_index.get_index_status(database.engine)
+    status["rebuild_reason"] = vector_index.rebuild_reason(status)
+    return status
+
+@app.post("/admin/vector-index/rebuild", dependencies=[Depends(require_admin)])
+def rebuild_vector_index(
+    index_type: Optional[str] = Form(None),
+    m: Optional[int] = Form(None),
+    ef_construction: Optional[int] = Form(None),
+    lists: Optional[int] = Form(None)
+):
+    if index_type and index_type.lower() not in vector_index.INDEX_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported index type: {index_type}")
+    
+    # Building over millions of rows takes a while, so run it in a worker
+    task = celery_app.send_task(
+        "app.ingest.rebuild_vector_index",
+        args=[index_type, m, ef_construction, lists]
+    )
+    
+    return {"task_id": task.id, "status": "Rebuilding vector index in background"}
+
 @app.get("/search/")
-def search_code(
+async def search_code(
+    response: Response,
     query: str = Query(..., min_length=1),
     language: Optional[str] = None,
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    mode: Literal["vector", "lexical", "hybrid"] = "vector",
+    view: Literal["full", "compact"] = "full",
+    cursor: Optional[str] = None,
+    ef_search: Optional[int] = Query(None, ge=1, le=1000),
+    probes: Optional[int] = Query(None, ge=1, le=10000),
+    collapse_duplicates: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    # Generate embedding for the query
+    if cursor and mode != "vector":
+        raise HTTPException(status_code=400, detail="Cursor paging is only supported in vector mode")
     try:
-        query_embedding = generate_embedding(query)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate embedding: {str(e)}")
+        position = search.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Perform vector similarity search
-    base_query = db.query(CodeChunk)
+    compact = view == "compact"
+    next_cursor = None
     
-    if language:
-        base_query = base_query.filter(CodeChunk.language == language)
+    if mode == "lexical":
+        # Words and identifiers only: no embedding needed
+        with metrics.stage("search"):
+            results = await db.run_sync(search.lexical_search, query, language, limit, compact, collapse_duplicates)
+    else:
+        # Generate embedding for the query
+        try:
+            with metrics.stage("query_embedding"):
+                query_embedding = await get_query_embedding_async(query)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to generate embedding: {str(e)}")
+        
+        # A non-iterative HNSW scan only yields ef_search candidates, so
+        # deeper pages and hybrid candidate lists need more
+        wanted = position.seen + limit if position else limit
+        if mode == "hybrid":
+            wanted = max(wanted, HYBRID_CANDIDATES)
+        # A compact index also has to yield the candidates to re-rank
+        wanted = vector_index.rerank_candidates(wanted)
+        if wanted > (ef_search or HNSW_EF_SEARCH):
+            ef_search = min(wanted, 1000)
+        
+        def run_search(session):
+            # Recall/latency trade-off of the ANN index for this search
+            iterative = vector_index.apply_search_params(session, ef_search, probes)
+            if position and not iterative and wanted > (ef_search or HNSW_EF_SEARCH):
+                # The page would come back short and end paging unnoticed
+                raise HTTPException(
+                    status_code=400,
+                    detail="Cursor is past the deepest page this database can return; refine the query"
+                )
+            
+            if mode == "hybrid":
+                return search.hybrid_search(
+                    session, query, query_embedding, language, limit, compact, collapse=collapse_duplicates
+                )
+            # Perform vector similarity search
+            return search.vector_search(
+                session, query_embedding, language, limit, position, compact, collapse_duplicates
+            )
+        
+        # The search helpers take a sync Session; run_sync drives them over
+        # the async connection without blocking the event loop
+        with metrics.stage("search"):
+            results = await db.run_sync(run_search)
+        if mode == "vector" and len(results) == limit:
+            next_cursor = search.encode_cursor(search.next_cursor(results, position))
+    
+    if collapse_duplicates:
+        await db.run_sync(search.add_duplicate_counts, results)
+    
+    if compact:
+        return {"results": results, "next_cursor": next_cursor}
+    
+    # The full view keeps its list shape; the cursor travels in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
+
+# Fields GET /chunks/ can return; the id is always included
+CHUNK_FIELDS = {
+    "name": CodeChunk.name,
+    "language": CodeChunk.language,
+    "description": CodeChunk.description,
+    "raw": CodeChunk.raw,
+    "incomplete": CodeChunk.incomplete,
+    "type": CodeChunk.type,
+    "created_at": CodeChunk.created_at,
+    "updated_at": CodeChunk.updated_at
+}
+
+def chunks_etag(versions: List[Any], fields: List[str]) -> str:
+    """
+    Build a weak ETag for a set of chunks from their ids and update times.
     
-    # Use PostgreSQL's vector similarity search
-    results = (
-        base_query
-        .order_by(
-            CodeChunk.embedding.op("<=>")(query_embedding).asc()
-        )
-        .limit(limit)
-        .all()
-    )
+    Args:
+        versions: (id, updated_at) pairs in response order
+        fields: Fields included in the response
+        
+    Returns:
+        ETag header value
+    """
+    digest = hashlib.sha1(",".join(fields).encode("utf-8"))
+    for chunk_id, updated_at in versions:
+        digest.update(f"|{chunk_id}:{updated_at.isoformat() if updated_at else ''}".encode("utf-8"))
+    return f'W/"{digest.hexdigest()}"'
+
+@app.get("/chunks/")
+async def get_chunks(
+    response: Response,
+    ids: str = Query(..., description="Comma-separated chunk IDs"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        chunk_ids = list(dict.fromkeys(int(value) for value in ids.split(",") if value.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if not chunk_ids:
+        raise HTTPException(status_code=400, detail="At least one chunk ID is required")
+    if len(chunk_ids) > MAX_BULK_CHUNKS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_CHUNKS} chunks can be fetched at once")
+    
+    selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(CHUNK_FIELDS)
+    unknown = [field for field in selected if field not in CHUNK_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    selected = list(dict.fromkeys(selected))
+    
+    # Check the cheap versions first so unchanged chunks are never loaded
+    if if_none_match:
+        versions = (await db.execute(
+            select(CodeChunk.id, CodeChunk.updated_at).where(CodeChunk.id.in_(chunk_ids))
+        )).all()
+        order = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+        versions.sort(key=lambda row: order[row.id])
+        etag = chunks_etag(versions, selected)
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers={"ETag": etag})
+    
+    rows = (await db.execute(
+        select(CodeChunk.id, CodeChunk.updated_at.label("_version"), *(CHUNK_FIELDS[field] for field in selected))
+        .where(CodeChunk.id.in_(chunk_ids))
+    )).mappings().all()
+    by_id = {row["id"]: row for row in rows}
+    found = [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+    
+    response.headers["ETag"] = chunks_etag([(row["id"], row["_version"]) for row in found], selected)
     
-    return [
-        {
-            "id": chunk.id,
-            "name": chunk.name,
-            "language": chunk.language,
-            "description": chunk.description,
-            "raw": chunk.raw,
-            "incomplete": chunk.incomplete,
-            "created_at": chunk.created_at.isoformat() if chunk.created_at else None
-        }
-        for chunk in results
-    ]
+    chunks = []
+    for row in found:
+        chunk = {"id": row["id"]}
+        for field in selected:
+            value = row[field]
+            chunk[field] = value.isoformat() if isinstance(value, datetime) else value
+        chunks.append(chunk)
+    
+    return {
+        "chunks": chunks,
+        "missing": [chunk_id for chunk_id in chunk_ids if chunk_id not in by_id]
+    }
+
+@app.get("/chunks/{chunk_id}/raw", response_class=PlainTextResponse)
+async def get_chunk_raw(chunk_id: int, db: AsyncSession = Depends(get_db)):
+    raw = (await db.execute(select(CodeChunk.raw).where(CodeChunk.id == chunk_id))).scalar()
+    if raw is None:
+        raise HTTPException(status_code=404, detail="Chunk not found")
+    
+    return raw
 
 @app.get("/chunks/{chunk_id}")
-def get_chunk(chunk_id: int, db: Session = Depends(get_db)):
-    chunk = db.query(CodeChunk).filter(CodeChunk.id == chunk_id).first()
+async def get_chunk(chunk_id: int, db: AsyncSession = Depends(get_db)):
+    chunk = (await db.execute(
+        select(
+            CodeChunk.id, CodeChunk.name, CodeChunk.language, CodeChunk.description,
+            CodeChunk.raw, CodeChunk.incomplete, CodeChunk.created_at
+        ).where(CodeChunk.id == chunk_id)
+    )).first()
     if not chunk:
         raise HTTPException(status_code=404, detail="Chunk not found")
     
@@ -200,193 +534,101 @@ def get_chunk(chunk_id: int, db: Session = Depends(get_db)):
     }
 
 @app.post("/chunks/split/")
-def split_chunk(
+async def split_chunk(
     chunk_id: int = Form(...),
     max_tokens: int = Form(1000),
     overlap: int = Form(50),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Get the chunk to split
-    chunk = db.query(CodeChunk).filter(CodeChunk.id == chunk_id).first()
-    if not chunk:
+    if not await db.scalar(select(func.count()).where(CodeChunk.id == chunk_id)):
         raise HTTPException(status_code=404, detail="Chunk not found")
     
-    # Split the code
-    code_chunks = chunk_code(chunk.raw, max_tokens, overlap)
-    
-    if len(code_chunks) <= 1:
-        raise HTTPException(status_code=400, detail="Chunk is too small to split")
+    # Up to three LLM calls per part: run them in a worker
+    task = await enqueue("app.jobs.split_chunk", args=[chunk_id, max_tokens, overlap])
     
-    # Create new chunks
-    new_chunk_ids = []
-    for i, code in enumerate(code_chunks):
-        # Check if code is incomplete
-        incomplete = is_incomplete_code(code, chunk.language)
-        
-        # Generate description
-        description = generate_description(code, chunk.language)
-        
-        # Generate embedding
-        embedding = generate_embedding(code)
-        
-        # Create new chunk
-        new_chunk = CodeChunk(
-            language=chunk.language,
-            name=f"{chunk.name}_part_{i+1}",
-            description=description,
-            raw=code,
-            embedding=embedding,
-            incomplete=incomplete,
-            type="code"
-        )
-        
-        db.add(new_chunk)
-        db.flush()  # Get the ID without committing
-        
-        # Create relation to parent
-        relation = ChunkRelation(
-            parent_id=chunk_id,
-            child_id=new_chunk.id
-        )
-        
-        db.add(relation)
-        new_chunk_ids.append(new_chunk.id)
-    
-    db.commit()
-    
-    return {"parent_id": chunk_id, "child_ids": new_chunk_ids}
+    return {"task_id": task.id, "status": "Splitting chunk in background"}
 
 @app.post("/chunks/merge/")
-def merge_chunks(
+async def merge_chunks(
     chunk_ids: List[int] = Form(...),
     name: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     if len(chunk_ids) < 2:
         raise HTTPException(status_code=400, detail="At least two chunks are required for merging")
     
-    # Get all chunks to merge
-    chunks = db.query(CodeChunk).filter(CodeChunk.id.in_(chunk_ids)).all()
+    # Check the chunks exist and share a language before queueing
+    languages = (await db.execute(
+        select(CodeChunk.language).where(CodeChunk.id.in_(chunk_ids))
+    )).scalars().all()
     
-    if len(chunks) != len(chunk_ids):
+    if len(languages) != len(set(chunk_ids)):
         raise HTTPException(status_code=404, detail="One or more chunks not found")
     
-    # Check if all chunks have the same language
-    languages = set(chunk.language for chunk in chunks)
-    if len(languages) > 1:
+    if len(set(languages)) > 1:
         raise HTTPException(status_code=400, detail="All chunks must have the same language")
     
-    # Sort chunks by ID (assuming ID order is meaningful)
-    chunks.sort(key=lambda x: chunk_ids.index(x.id))
+    task = await enqueue("app.jobs.merge_chunks", args=[chunk_ids, name])
     
-    # Merge code
-    merged_code = "\n\n".join(chunk.raw for chunk in chunks)
-    
-    # Generate name if not provided
-    if not name:
-        name = f"merged_{'_'.join(str(id) for id in chunk_ids)}"
-    
-    # Generate description
-    description = generate_description(merged_code, chunks[0].language)
-    
-    # Generate embedding
-    embedding = generate_embedding(merged_code)
-    
-    # Create new chunk
-    new_chunk = CodeChunk(
-        language=chunks[0].language,
-        name=name,
-        description=description,
-        raw=merged_code,
-        embedding=embedding,
-        incomplete=any(chunk.incomplete for chunk in chunks),
-        type="code"
-    )
-    
-    db.add(new_chunk)
-    db.flush()  # Get the ID without committing
-    
-    # Create relations to parent chunks
-    for chunk_id in chunk_ids:
-        relation = ChunkRelation(
-            parent_id=chunk_id,
-            child_id=new_chunk.id
-        )
-        db.add(relation)
-    
-    db.commit()
-    
-    return {
-        "id": new_chunk.id,
-        "name": new_chunk.name,
-        "parent_ids": chunk_ids
-    }
+    return {"task_id": task.id, "status": "Merging chunks in background"}
 
 @app.post("/chunks/complete/")
-def complete_chunk(
+async def complete_chunk(
     chunk_id: int = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # Get the chunk to complete
-    chunk = db.query(CodeChunk).filter(CodeChunk.id == chunk_id).first()
-    if not chunk:
+    incomplete = (await db.execute(select(CodeChunk.incomplete).where(CodeChunk.id == chunk_id))).first()
+    if not incomplete:
         raise HTTPException(status_code=404, detail="Chunk not found")
     
-    if not chunk.incomplete:
-        return {"id": chunk.id, "message": "Chunk is already complete"}
-    
-    # Complete the code
-    completed_code = complete_code(chunk.raw, chunk.language)
-    
-    # Update the chunk
-    chunk.raw = completed_code
-    chunk.incomplete = False
+    if not incomplete[0]:
+        return {"id": chunk_id, "message": "Chunk is already complete"}
     
-    # Update embedding and description
-    chunk.embedding = generate_embedding(completed_code)
-    chunk.description = generate_description(completed_code, chunk.language)
+    task = await enqueue("app.jobs.complete_chunk", args=[chunk_id])
     
-    db.commit()
-    
-    return {
-        "id": chunk.id,
-        "name": chunk.name,
-        "language": chunk.language,
-        "description": chunk.description,
-        "raw": chunk.raw,
-        "incomplete": chunk.incomplete
-    }
+    return {"task_id": task.id, "status": "Completing chunk in background"}
 
 @app.get("/templates/")
-def list_templates(
+async def list_templates(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    templates = db.query(Template).offset(skip).limit(limit).all()
+    # Count chunks in the same query instead of loading them
+    chunk_count = func.count(template_chunks.c.chunk_id).label("chunk_count")
+    rows = (await db.execute(
+        select(Template.id, Template.name, Template.description, Template.created_at, chunk_count)
+        .outerjoin(template_chunks, template_chunks.c.template_id == Template.id)
+        .group_by(Template.id)
+        .order_by(Template.id)
+        .offset(skip)
+        .limit(limit)
+    )).all()
     
     return [
         {
-            "id": template.id,
-            "name": template.name,
-            "description": template.description,
-            "created_at": template.created_at.isoformat() if template.created_at else None,
-            "chunk_count": len(template.chunks)
+            "id": row.id,
+            "name": row.name,
+            "description": row.description,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "chunk_count": row.chunk_count
         }
-        for template in templates
+        for row in rows
     ]
 
 @app.post("/templates/")
-def create_template(
+async def create_template(
     name: str = Form(...),
     description: Optional[str] = Form(None),
     chunk_ids: List[int] = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Check if chunks exist
-    chunks = db.query(CodeChunk).filter(CodeChunk.id.in_(chunk_ids)).all()
-    if len(chunks) != len(chunk_ids):
+    found = await db.scalar(select(func.count()).where(CodeChunk.id.in_(chunk_ids)))
+    if found != len(set(chunk_ids)):
         raise HTTPException(status_code=404, detail="One or more chunks not found")
+    if found != len(chunk_ids):
+        raise HTTPException(status_code=400, detail="A chunk can only appear once in a template")
     
     # Create template
     template = Template(
@@ -395,16 +637,18 @@ def create_template(
     )
     
     db.add(template)
-    db.flush()  # Get the ID without committing
+    await db.flush()  # Get the ID without committing
     
     # Add chunks to template with positions
-    for i, chunk_id in enumerate(chunk_ids):
-        db.execute(
-            "INSERT INTO template_chunks (template_id, chunk_id, position) VALUES (:template_id, :chunk_id, :position)",
+    await db.execute(
+        insert(template_chunks),
+        [
             {"template_id": template.id, "chunk_id": chunk_id, "position": i}
-        )
+            for i, chunk_id in enumerate(chunk_ids)
+        ]
+    )
     
-    db.commit()
+    await db.commit()
     
     return {
         "id": template.id,
@@ -414,113 +658,66 @@ def create_template(
     }
 
 @app.get("/templates/{template_id}")
-def get_template(template_id: int, db: Session = Depends(get_db)):
-    template = db.query(Template).filter(Template.id == template_id).first()
-    if not template:
+async def get_template(template_id: int, db: AsyncSession = Depends(get_db)):
+    # Template and its chunks in position order, in one query
+    rows = (await db.execute(
+        select(
+            Template.id, Template.name, Template.description, Template.created_at,
+            CodeChunk.id.label("chunk_id"), CodeChunk.name.label("chunk_name"),
+            CodeChunk.language, CodeChunk.description.label("chunk_description"),
+            CodeChunk.updated_at, template_chunks.c.position
+        )
+        .outerjoin(template_chunks, template_chunks.c.template_id == Template.id)
+        .outerjoin(CodeChunk, CodeChunk.id == template_chunks.c.chunk_id)
+        .where(Template.id == template_id)
+        .order_by(template_chunks.c.position)
+    )).all()
+    if not rows:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    # Get chunks with their positions
-    chunks = []
-    for chunk in template.chunks:
-        position = db.execute(
-            "SELECT position FROM template_chunks WHERE template_id = :template_id AND chunk_id = :chunk_id",
-            {"template_id": template_id, "chunk_id": chunk.id}
-        ).scalar()
-        
-        chunks.append({
-            "id": chunk.id,
-            "name": chunk.name,
-            "language": chunk.language,
-            "description": chunk.description,
-            "position": position
-        })
-    
-    # Sort chunks by position
-    chunks.sort(key=lambda x: x["position"])
+    template = rows[0]
+    members = [row for row in rows if row.chunk_id is not None]
+    fingerprint = tuple((row.chunk_id, row.position, row.updated_at) for row in members)
+    compiled = await db.run_sync(compiled_for, template_id, fingerprint)
     
     return {
         "id": template.id,
         "name": template.name,
         "description": template.description,
         "created_at": template.created_at.isoformat() if template.created_at else None,
-        "chunks": chunks
+        "chunks": [
+            {
+                "id": row.chunk_id,
+                "name": row.chunk_name,
+                "language": row.language,
+                "description": row.chunk_description,
+                "position": row.position
+            }
+            for row in members
+        ],
+        "parameters": list(compiled.parameters)
     }
 
 @app.post("/templates/{template_id}/apply/")
-def apply_template(
+async def apply_template(
     template_id: int,
-    parameters: Dict[str, Any] = Form(...),
-    db: Session = Depends(get_db)
+    parameters: str = Form(..., description="JSON object of placeholder values"),
+    db: AsyncSession = Depends(get_db)
 ):
-    template = db.query(Template).filter(Template.id == template_id).first()
-    if not template:
-        raise HTTPException(status_code=404, detail="Template not found")
-    
-    # Get chunks with their positions
-    chunks = []
-    for chunk in template.chunks:
-        position = db.execute(
-            "SELECT position FROM template_chunks WHERE template_id = :template_id AND chunk_id = :chunk_id",
-            {"template_id": template_id, "chunk_id": chunk.id}
-        ).scalar()
-        
-        chunks.append({
-            "id": chunk.id,
-            "raw": chunk.raw,
-            "language": chunk.language,
-            "position": position
-        })
-    
-    # Sort chunks by position
-    chunks.sort(key=lambda x: x["position"])
-    
-    # Apply parameters to template
-    combined_code = ""
-    for chunk in chunks:
-        code = chunk["raw"]
-        
-        # Replace placeholders with parameters
-        for key, value in parameters.items():
-            placeholder = f"{{{{${key}}}}}"
-            code = code.replace(placeholder, str(value))
-        
-        combined_code += code + "\n\n"
-    
-    # Generate name
-    name = f"{template.name}_applied_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    
-    # Generate description
-    description = f"Generated from template: {template.name}"
-    if template.description:
-        description += f"\nTemplate description: {template.description}"
-    
-    # Detect language (use the language of the first chunk)
-    language = chunks[0]["language"] if chunks else "unknown"
-    
-    # Generate embedding
-    embedding = generate_embedding(combined_code)
+    try:
+        parameters = json.loads(parameters)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="parameters must be a JSON object")
+    if not isinstance(parameters, dict):
+        raise HTTPException(status_code=400, detail="parameters must be a JSON object")
     
-    # Create new chunk
-    new_chunk = CodeChunk(
-        language=language,
-        name=name,
-        description=description,
-        raw=combined_code,
-        embedding=embedding,
-        incomplete=False,
-        type="code"
-    )
+    if not await db.scalar(select(func.count()).where(Template.id == template_id)):
+        raise HTTPException(status_code=404, detail="Template not found")
     
-    db.add(new_chunk)
-    db.commit()
+    # The new chunk needs an embedding: create it in a worker
+    task = await enqueue("app.jobs.apply_template", args=[template_id, parameters])
     
-    return {
-        "id": new_chunk.id,
-        "name": new_chunk.name,
-        "language": new_chunk.language,
-        "description": new_chunk.description,
-        "raw": new_chunk.raw
-    }
+    return {"task_id": task.id, "status": "Applying template in background"}
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
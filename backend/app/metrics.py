@@ -0,0 +1,233 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import redis
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from app import profiling
+from app.config import CELERY_BROKER_URL, METRICS_QUEUES, WORKER_METRICS_PORT
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metrics are shared by the API and the workers. With PROMETHEUS_MULTIPROC_DIR
+# set, every process writes its samples there and a scrape aggregates them.
+
+NAMESPACE = "code_indexer"
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# From a cached lookup to a large file's whole ingest
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Time spent in a pipeline stage",
+    ["stage"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "API request latency by route",
+    ["method", "route", "status"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS
+)
+LLM_REQUESTS = Counter(
+    "llm_requests", "Requests sent to the LLM provider",
+    ["kind", "outcome"], namespace=NAMESPACE
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_seconds", "LLM provider request latency",
+    ["kind"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens", "Tokens billed by the LLM provider",
+    ["kind", "type"], namespace=NAMESPACE
+)
+TASK_SECONDS = Histogram(
+    "task_seconds", "Celery task run time",
+    ["task", "state"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests", "Cache lookups by result",
+    ["cache", "result"], namespace=NAMESPACE
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Database connections in use",
+    ["engine"], namespace=NAMESPACE, multiprocess_mode="livesum"
+)
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_capacity", "Database connections the pool may open",
+    ["engine"], namespace=NAMESPACE, multiprocess_mode="livesum"
+)
+
+def stage(name: str):
+    """
+    Time a pipeline stage.
+
+    Args:
+        name: Stage name, e.g. "chunk" or "llm_analysis"
+
+    Returns:
+        Context manager (or decorator) observing the elapsed time
+    """
+    return STAGE_SECONDS.labels(stage=name).time()
+
+@contextmanager
+def llm_request(kind: str) -> Iterator[None]:
+    """
+    Count and time one request to the LLM provider.
+
+    Args:
+        kind: Kind of call, e.g. "embedding" or "description"
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        elapsed = time.perf_counter() - start
+        LLM_REQUESTS.labels(kind=kind, outcome=outcome).inc()
+        LLM_REQUEST_SECONDS.labels(kind=kind).observe(elapsed)
+        profiling.add_time("embedding" if kind.endswith("embedding") else "llm", elapsed)
+
+def record_llm_usage(kind: str, usage: Optional[Any]) -> None:
+    """
+    Count the tokens reported in a provider response.
+
+    Args:
+        kind: Kind of call
+        usage: The response's usage object, if any
+    """
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    if prompt_tokens:
+        LLM_TOKENS.labels(kind=kind, type="prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(kind=kind, type="completion").inc(completion_tokens)
+
+def record_cache(cache: str, hits: int, misses: int) -> None:
+    """
+    Count cache lookups; hit ratios are computed from these at query time.
+
+    Args:
+        cache: Cache name
+        hits: Lookups served from the cache
+        misses: Lookups that weren't
+    """
+    if hits:
+        CACHE_REQUESTS.labels(cache=cache, result="hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache=cache, result="miss").inc(misses)
+
+def instrument_pool(engine, name: str, capacity: Optional[int] = None) -> None:
+    """
+    Track connections checked out of an engine's pool.
+
+    Args:
+        engine: Sync engine, or the sync_engine of an async one
+        name: Engine label
+        capacity: Most connections the pool opens, None when unbounded
+    """
+    from sqlalchemy import event
+
+    in_use = DB_POOL_CHECKED_OUT.labels(engine=name)
+    if capacity is not None:
+        # Set per connection rather than once: forked processes start with
+        # empty multiprocess values
+        limit = DB_POOL_CAPACITY.labels(engine=name)
+        event.listen(engine, "connect", lambda *args: limit.set(capacity))
+    event.listen(engine, "checkout", lambda *args: in_use.inc())
+    event.listen(engine, "checkin", lambda *args: in_use.dec())
+
+class QueueDepthCollector:
+    """Reports how many tasks wait in each broker queue, read at scrape time."""
+
+    def __init__(self, queues):
+        self.queues = queues
+        self._client = None
+
+    def collect(self):
+        depth = GaugeMetricFamily(
+            f"{NAMESPACE}_queue_depth", "Tasks waiting in the broker queue", labels=["queue"]
+        )
+        try:
+            if self._client is None:
+                self._client = redis.Redis.from_url(CELERY_BROKER_URL, socket_timeout=1, socket_connect_timeout=1)
+            pipe = self._client.pipeline()
+            for queue in self.queues:
+                pipe.llen(queue)
+            for queue, length in zip(self.queues, pipe.execute()):
+                depth.add_metric([queue], length)
+        except redis.RedisError as e:
+            logger.warning(f"Queue depth unavailable: {e}")
+        yield depth
+
+_queue_registry = CollectorRegistry(auto_describe=False)
+_queue_registry.register(QueueDepthCollector(METRICS_QUEUES))
+
+def _process_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def render(include_queues: bool = True) -> bytes:
+    """
+    Render all metrics in the Prometheus text format.
+
+    Args:
+        include_queues: Whether to read the broker queue depths
+
+    Returns:
+        Exposition body, served with CONTENT_TYPE_LATEST
+    """
+    output = generate_latest(_process_registry())
+    if include_queues:
+        output += generate_latest(_queue_registry)
+    return output
+
+_task_starts: Dict[str, float] = {}
+
+def instrument_celery() -> None:
+    """
+    Time Celery tasks and serve the worker's metrics on WORKER_METRICS_PORT.
+
+    The server runs in the worker's main process; prefork children report
+    through PROMETHEUS_MULTIPROC_DIR.
+    """
+    from celery import signals
+
+    @signals.task_prerun.connect(weak=False)
+    def on_task_prerun(task_id=None, **kwargs):
+        _task_starts[task_id] = time.perf_counter()
+
+    @signals.task_postrun.connect(weak=False)
+    def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+        start = _task_starts.pop(task_id, None)
+        if start is not None:
+            TASK_SECONDS.labels(task=task.name, state=state or "UNKNOWN").observe(time.perf_counter() - start)
+
+    @signals.worker_init.connect(weak=False)
+    def on_worker_init(**kwargs):
+        if MULTIPROCESS:
+            # Samples of an earlier run of this worker; the children fork later
+            directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+            for name in os.listdir(directory):
+                if name.endswith(".db"):
+                    os.remove(os.path.join(directory, name))
+        if WORKER_METRICS_PORT:
+            start_http_server(WORKER_METRICS_PORT, registry=_process_registry())
+            logger.info(f"Serving worker metrics on port {WORKER_METRICS_PORT}")
+
+    @signals.worker_process_shutdown.connect(weak=False)
+    def on_worker_process_shutdown(pid=None, **kwargs):
+        if MULTIPROCESS:
+            multiprocess.mark_process_dead(pid or os.getpid())
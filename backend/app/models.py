@@ -1,11 +1,22 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Table
+import hashlib
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Computed, ForeignKey, Index, Integer, LargeBinary, SmallInteger, String, Text,
+    DateTime, Table, event
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import HALFVEC, Vector
+
+from app.config import EMBEDDING_DIMENSION, EMBEDDING_STORAGE
 
 Base = declarative_base()
 
+# Text search configuration for code: no stemming or stop words
+SEARCH_TEXT_CONFIG = "simple"
+
 # Association table for many-to-many relationship between templates and chunks
 template_chunks = Table(
     'template_chunks',
@@ -23,10 +34,45 @@ class CodeChunk(Base):
     name = Column(String(255), nullable=False)
     description = Column(Text)
     raw = Column(Text, nullable=False)
-    embedding = Column(Vector(1536))  # OpenAI Ada embedding dimension
+    # Length depends on the embedding model; float16 with EMBEDDING_STORAGE=halfvec
+    embedding = Column(HALFVEC(EMBEDDING_DIMENSION) if EMBEDDING_STORAGE == "halfvec" else Vector(EMBEDDING_DIMENSION))
     incomplete = Column(Boolean, default=False, index=True)
     type = Column(String(50), default="code", index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # SHA-256 of raw, see content_hash()
+    content_hash = Column(String(64), index=True)
+    # Where the chunk came from: the ingested name and its line span in it
+    source_name = Column(String(1024), index=True)
+    start_line = Column(Integer)
+    end_line = Column(Integer)
+    # Canonical chunk this one duplicates exactly or nearly, NULL for
+    # canonical chunks; see app.dedupe
+    duplicate_of = Column(Integer, ForeignKey("code_chunks.id"), index=True)
+    # MinHash signature of raw, used to find near duplicates
+    minhash = Column(LargeBinary)
+    # Full-text document: name outranks description, description outranks code.
+    # Code is capped to stay below the 1 MB tsvector limit.
+    search_vector = Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(name, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(description, '')), 'B') || "
+        f"setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', left(raw, 200000)), 'C')",
+        persisted=True
+    ))
+
+    __table_args__ = (
+        Index("idx_code_chunks_search_vector", "search_vector", postgresql_using="gin"),
+        # Trigram index for identifier lookups by name
+        Index(
+            "idx_code_chunks_name_trgm", "name",
+            postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}
+        ),
+        # One canonical chunk per distinct code; copies point at it
+        Index(
+            "uq_code_chunks_canonical_hash", "content_hash",
+            unique=True, postgresql_where=duplicate_of.is_(None)
+        ),
+    )
 
     # Relationships
     children = relationship(
@@ -43,12 +89,31 @@ class CodeChunk(Base):
         back_populates="chunks"
     )
 
+def content_hash(raw: str) -> str:
+    """Hash chunk code the same way as the backfill in app.schema."""
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+@event.listens_for(CodeChunk, "before_insert")
+@event.listens_for(CodeChunk, "before_update")
+def _set_content_hash(mapper, connection, target):
+    # Core inserts set content_hash themselves, see app.ingest.insert_chunks
+    if target.raw is not None:
+        target.content_hash = content_hash(target.raw)
+
 class ChunkRelation(Base):
     __tablename__ = "chunk_relations"
 
     parent_id = Column(Integer, ForeignKey("code_chunks.id", ondelete="CASCADE"), primary_key=True)
     child_id = Column(Integer, ForeignKey("code_chunks.id", ondelete="CASCADE"), primary_key=True)
 
+class ChunkMinhashBand(Base):
+    """LSH band of a canonical chunk's MinHash signature."""
+    __tablename__ = "chunk_minhash_bands"
+
+    band = Column(SmallInteger, primary_key=True)
+    band_hash = Column(BigInteger, primary_key=True)
+    chunk_id = Column(Integer, ForeignKey("code_chunks.id", ondelete="CASCADE"), primary_key=True, index=True)
+
 class Template(Base):
     __tablename__ = "templates"
 
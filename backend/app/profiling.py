@@ -0,0 +1,348 @@
+import cProfile
+import contextvars
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import redis
+
+from app.config import PROFILE_STORE_URL, PROFILE_TTL
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-request (or per-task) time split into categories: embedding, llm, sql
+# and serialize. Times of calls running in parallel threads add up, so a
+# category can exceed the wall time.
+
+CATEGORIES = ("embedding", "llm", "sql", "serialize")
+
+_breakdown: contextvars.ContextVar[Optional["Breakdown"]] = contextvars.ContextVar("breakdown", default=None)
+
+class Breakdown:
+    """Seconds and call counts per category for one request or task."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = dict.fromkeys(CATEGORIES, 0.0)
+        self.calls = dict.fromkeys(CATEGORIES, 0)
+        self._lock = threading.Lock()
+
+    def add(self, category: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[category] = self.seconds.get(category, 0.0) + seconds
+            self.calls[category] = self.calls.get(category, 0) + 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Format as a Server-Timing header value, in milliseconds."""
+        entries = [
+            f'{category};dur={seconds * 1000:.1f};desc="{self.calls[category]} calls"'
+            for category, seconds in self.seconds.items() if self.calls[category]
+        ]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def record(self, **fields: Any) -> Dict[str, Any]:
+        """Build the structured log record, times in milliseconds."""
+        return {
+            **fields,
+            "total_ms": round(self.elapsed() * 1000, 1),
+            **{f"{category}_ms": round(seconds * 1000, 1) for category, seconds in self.seconds.items()},
+            **{f"{category}_calls": calls for category, calls in self.calls.items()}
+        }
+
+def start_breakdown() -> Breakdown:
+    """
+    Start collecting the time breakdown of the current request or task.
+
+    Returns:
+        The new breakdown, also visible to code called from this context
+    """
+    breakdown = Breakdown()
+    _breakdown.set(breakdown)
+    return breakdown
+
+def add_time(category: str, seconds: float) -> None:
+    """
+    Add time to a category of the current breakdown, if any.
+
+    Args:
+        category: One of CATEGORIES
+        seconds: Time spent
+    """
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add(category, seconds)
+
+@contextmanager
+def span(category: str) -> Iterator[None]:
+    """
+    Time a block into a category of the current breakdown.
+
+    Args:
+        category: One of CATEGORIES
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(category, time.perf_counter() - start)
+
+def log_breakdown(breakdown: Breakdown, **fields: Any) -> None:
+    """
+    Log the breakdown as one JSON record.
+
+    Args:
+        breakdown: Finished breakdown
+        **fields: Identifying fields, e.g. method, route and status
+    """
+    logger.info(json.dumps(breakdown.record(event="timing", **fields)))
+
+def instrument_sql(engine) -> None:
+    """
+    Add the time of every statement run on an engine to the "sql" category.
+
+    Args:
+        engine: Sync engine, or the sync_engine of an async one
+    """
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        add_time("sql", time.perf_counter() - conn.info["query_start"].pop())
+
+    def handle_error(exception_context):
+        # Failed statements don't reach after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            add_time("sql", time.perf_counter() - conn.info["query_start"].pop())
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+# Profiles are stored in Redis: the marshalled pstats data under
+# PROFILE_KEY_PREFIX<id>, and a summary of each in the PROFILE_INDEX_KEY
+# sorted set scored by capture time
+PROFILE_KEY_PREFIX = "profile:data:"
+PROFILE_INDEX_KEY = "profile:index"
+# Number of upcoming tasks to profile, and the task name they must have
+ARMED_TASKS_KEY = "profile:armed"
+ARMED_TASK_NAME_KEY = "profile:armed:task"
+
+# Claims one armed task slot: returns 1 if the caller should profile
+CLAIM_SCRIPT = """
+local remaining = tonumber(redis.call('GET', KEYS[1]) or '0')
+if remaining <= 0 then
+    return 0
+end
+local wanted = redis.call('GET', KEYS[2])
+if wanted and wanted ~= '' and wanted ~= ARGV[1] then
+    return 0
+end
+redis.call('DECR', KEYS[1])
+return 1
+"""
+
+_client = None
+
+def get_client() -> redis.Redis:
+    """
+    Get the Redis client of the profile store.
+
+    Returns:
+        Redis client instance
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(PROFILE_STORE_URL, socket_timeout=2, socket_connect_timeout=1)
+    return _client
+
+def save_profile(profiler: cProfile.Profile, kind: str, name: str, duration: float) -> str:
+    """
+    Store a finished profile.
+
+    Args:
+        profiler: Disabled profiler
+        kind: "request" or "task"
+        name: Route or task name
+        duration: Wall time of the profiled request or task in seconds
+
+    Returns:
+        Profile ID
+    """
+    profiler.create_stats()
+    profile_id = uuid.uuid4().hex
+    now = time.time()
+    summary = {
+        "id": profile_id,
+        "kind": kind,
+        "name": name,
+        "duration_ms": round(duration * 1000, 1),
+        "captured_at": now
+    }
+
+    pipe = get_client().pipeline()
+    pipe.set(PROFILE_KEY_PREFIX + profile_id, marshal.dumps(profiler.stats), ex=PROFILE_TTL)
+    pipe.zadd(PROFILE_INDEX_KEY, {json.dumps(summary): now})
+    pipe.zremrangebyscore(PROFILE_INDEX_KEY, "-inf", now - PROFILE_TTL)
+    pipe.execute()
+    return profile_id
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """
+    List the stored profiles, newest first.
+
+    Returns:
+        Profile summaries
+    """
+    client = get_client()
+    client.zremrangebyscore(PROFILE_INDEX_KEY, "-inf", time.time() - PROFILE_TTL)
+    return [json.loads(member) for member in client.zrevrange(PROFILE_INDEX_KEY, 0, -1)]
+
+def load_profile(profile_id: str) -> Optional[bytes]:
+    """
+    Load a stored profile in the pstats file format.
+
+    Args:
+        profile_id: Profile ID
+
+    Returns:
+        Profile data, loadable with pstats.Stats, or None if expired
+    """
+    return get_client().get(PROFILE_KEY_PREFIX + profile_id)
+
+def format_profile(data: bytes, sort: str = "cumulative", limit: int = 50) -> str:
+    """
+    Render profile data as a pstats text report.
+
+    Args:
+        data: Profile data from load_profile
+        sort: pstats sort key
+        limit: Number of functions to list
+
+    Returns:
+        Report text
+    """
+    with tempfile.NamedTemporaryFile(suffix=".prof", delete=False) as file:
+        file.write(data)
+    try:
+        output = io.StringIO()
+        pstats.Stats(file.name, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+    finally:
+        os.unlink(file.name)
+
+def arm_tasks(count: int, task_name: Optional[str] = None) -> None:
+    """
+    Profile the next count tasks run by any worker.
+
+    Args:
+        count: Number of tasks to profile, 0 disarms
+        task_name: Only profile tasks with this name
+    """
+    pipe = get_client().pipeline()
+    pipe.set(ARMED_TASKS_KEY, count, ex=PROFILE_TTL)
+    pipe.set(ARMED_TASK_NAME_KEY, task_name or "", ex=PROFILE_TTL)
+    pipe.execute()
+
+def armed_tasks() -> Dict[str, Any]:
+    """
+    Get how many upcoming tasks will still be profiled.
+
+    Returns:
+        Dictionary with the remaining count and the task name filter
+    """
+    remaining, task_name = get_client().mget(ARMED_TASKS_KEY, ARMED_TASK_NAME_KEY)
+    return {
+        "remaining": int(remaining or 0),
+        "task": task_name.decode() if task_name else None
+    }
+
+def _claim_task(task_name: str) -> bool:
+    try:
+        return bool(get_client().eval(CLAIM_SCRIPT, 2, ARMED_TASKS_KEY, ARMED_TASK_NAME_KEY, task_name))
+    except redis.RedisError as e:
+        logger.warning(f"Profile store unavailable: {e}")
+        return False
+
+# Only one profiler can be active per process at a time
+_profiler_lock = threading.Lock()
+
+def start_profiler() -> Optional[cProfile.Profile]:
+    """
+    Start profiling the current thread, unless a profile is being captured.
+
+    Returns:
+        The enabled profiler, or None when another one is active
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool (a debugger, coverage) is attached
+        _profiler_lock.release()
+        return None
+    return profiler
+
+def stop_profiler(profiler: cProfile.Profile) -> None:
+    """
+    Stop a profiler started by start_profiler.
+
+    Args:
+        profiler: The enabled profiler
+    """
+    profiler.disable()
+    _profiler_lock.release()
+
+_task_profiles: Dict[str, cProfile.Profile] = {}
+_task_breakdowns: Dict[str, Breakdown] = {}
+
+def instrument_celery() -> None:
+    """
+    Log the time breakdown of every task and profile the armed ones.
+
+    Only the task's own thread is profiled; calls it fans out to a thread
+    pool show up as time waiting on their futures.
+    """
+    from celery import signals
+
+    @signals.task_prerun.connect(weak=False)
+    def on_task_prerun(task_id=None, task=None, **kwargs):
+        _task_breakdowns[task_id] = start_breakdown()
+        if _claim_task(task.name):
+            profiler = start_profiler()
+            if profiler is not None:
+                _task_profiles[task_id] = profiler
+
+    @signals.task_postrun.connect(weak=False)
+    def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+        profiler = _task_profiles.pop(task_id, None)
+        breakdown = _task_breakdowns.pop(task_id, None)
+        _breakdown.set(None)
+        if profiler is not None:
+            stop_profiler(profiler)
+            try:
+                profile_id = save_profile(profiler, "task", task.name, breakdown.elapsed())
+                logger.info(f"Saved profile {profile_id} of task {task.name} ({task_id})")
+            except redis.RedisError as e:
+                logger.warning(f"Failed to save profile of task {task_id}: {e}")
+        if breakdown is not None:
+            log_breakdown(breakdown, task=task.name, task_id=task_id, state=state)
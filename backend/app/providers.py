@@ -0,0 +1,319 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.config import (
+    LLM_MODE, EMBEDDING_MODE, OPENAI_API_KEY, OPENAI_BASE_URL, LOCAL_LLM_BASE_URL, LOCAL_LLM_API_KEY,
+    LOCAL_EMBEDDING_BASE_URL, EMBEDDING_MODEL, COMPLETION_MODEL, EMBEDDING_DIMENSION,
+    EMBEDDING_REQUEST_DIMENSIONS, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY, OPENAI_TIMEOUT, OPENAI_CONNECT_TIMEOUT, OPENAI_MAX_RETRIES
+)
+
+# The OpenAI SDK is only imported when the first client is created
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+# Embedding and completion providers, selected by EMBEDDING_MODE and
+# LLM_MODE: "OPENAI" (the OpenAI API, or OPENAI_BASE_URL), "LOCAL" (a
+# self-hosted OpenAI-compatible server such as vLLM, llama.cpp or Ollama)
+# and, for embeddings only, "HASHING" (offline feature hashing).
+
+class EmbeddingResult(NamedTuple):
+    vectors: List[List[float]]
+    # The response's usage object (prompt_tokens), None when not reported
+    usage: Optional[Any] = None
+
+class CompletionResult(NamedTuple):
+    content: str
+    usage: Optional[Any] = None
+
+class Provider:
+    """
+    Interface of the embedding and completion backends.
+
+    embed takes a batch of texts; the caller sizes batches (see
+    iter_embedding_batches). The chat API has no batch form, so complete
+    runs one conversation and callers issue completions concurrently.
+    """
+
+    def embedding_id(self) -> str:
+        """Identifies the vectors embed produces; part of the cache keys."""
+        raise NotImplementedError
+
+    def completion_id(self) -> str:
+        """Identifies the model complete runs; part of the cache keys."""
+        raise NotImplementedError
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> EmbeddingResult:
+        return await asyncio.to_thread(self.embed, texts)
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> CompletionResult:
+        raise NotImplementedError
+
+    async def acomplete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> CompletionResult:
+        return await asyncio.to_thread(self.complete, messages, max_tokens, temperature)
+
+def _check_dimensions(vectors: List[List[float]], model: str) -> None:
+    for vector in vectors:
+        if len(vector) != EMBEDDING_DIMENSION:
+            raise ValueError(
+                f"Embedding model {model} returned {len(vector)} dimensions, "
+                f"EMBEDDING_DIMENSION is {EMBEDDING_DIMENSION}"
+            )
+
+def _http_limits():
+    import httpx
+    return {
+        "limits": httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        ),
+        "timeout": httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    }
+
+# Clients inherited across fork are kept referenced but never used or closed:
+# closing them would shut down TLS sessions the parent still owns
+_inherited_clients = []
+
+class OpenAICompatibleProvider(Provider):
+    """
+    The OpenAI API or any server implementing its embeddings and chat
+    completions endpoints.
+
+    Clients are created on first use and reuse pooled keep-alive
+    connections across calls and threads. Forked processes (Celery prefork
+    workers) build their own clients on first use.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str],
+        api_key: str,
+        embedding_model: str = EMBEDDING_MODEL,
+        completion_model: str = COMPLETION_MODEL,
+        request_dimensions: bool = EMBEDDING_REQUEST_DIMENSIONS
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.embedding_model = embedding_model
+        self.completion_model = completion_model
+        self.request_dimensions = request_dimensions
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _after_fork(self) -> None:
+        for client in (self._client, self._async_client):
+            if client is not None:
+                _inherited_clients.append(client)
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> "OpenAI":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+                    self._client = OpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        max_retries=OPENAI_MAX_RETRIES,
+                        http_client=httpx.Client(**_http_limits())
+                    )
+        return self._client
+
+    @property
+    def async_client(self) -> "AsyncOpenAI":
+        # Only used from the API's event loop thread
+        if self._async_client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.AsyncClient(**_http_limits())
+            )
+        return self._async_client
+
+    def _where(self) -> str:
+        # The default endpoint keeps the bare model name, so existing cache
+        # entries stay valid
+        return f"@{self.base_url}" if self.base_url else ""
+
+    def embedding_id(self) -> str:
+        suffix = f"/{EMBEDDING_DIMENSION}" if self.request_dimensions else ""
+        return f"{self.embedding_model}{suffix}{self._where()}"
+
+    def completion_id(self) -> str:
+        return f"{self.completion_model}{self._where()}"
+
+    def _embedding_options(self) -> Dict[str, Any]:
+        # Only models trained for shortening (text-embedding-3-*) accept this
+        return {"dimensions": EMBEDDING_DIMENSION} if self.request_dimensions else {}
+
+    def _embedding_result(self, response) -> EmbeddingResult:
+        # Results carry their input index; don't rely on response order
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        _check_dimensions(vectors, self.embedding_model)
+        return EmbeddingResult(vectors, response.usage)
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        response = self.client.embeddings.create(model=self.embedding_model, input=texts, **self._embedding_options())
+        return self._embedding_result(response)
+
+    async def aembed(self, texts: List[str]) -> EmbeddingResult:
+        response = await self.async_client.embeddings.create(
+            model=self.embedding_model, input=texts, **self._embedding_options()
+        )
+        return self._embedding_result(response)
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> CompletionResult:
+        response = self.client.chat.completions.create(
+            model=self.completion_model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return CompletionResult(response.choices[0].message.content.strip(), response.usage)
+
+    async def acomplete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> CompletionResult:
+        response = await self.async_client.chat.completions.create(
+            model=self.completion_model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return CompletionResult(response.choices[0].message.content.strip(), response.usage)
+
+# Identifiers, numbers and single symbols
+_TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]")
+# Boundaries inside camelCase and snake_case identifiers
+_SUBWORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+class HashingProvider(Provider):
+    """
+    Offline embeddings by feature hashing: tokens, identifier parts and
+    token pairs are hashed into signed buckets.
+
+    Deterministic and free, for tests and air-gapped setups. Texts sharing
+    identifiers land close together, but there is no semantic similarity.
+    Completions aren't supported.
+    """
+
+    VERSION = 1
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def embedding_id(self) -> str:
+        return f"hashing-v{self.VERSION}/{self.dimension}"
+
+    def completion_id(self) -> str:
+        return "hashing"
+
+    def features(self, text: str) -> Counter:
+        tokens = _TOKEN_PATTERN.findall(text)
+        features = Counter(token.lower() for token in tokens)
+        for token in tokens:
+            parts = _SUBWORD_PATTERN.findall(token)
+            if len(parts) > 1:
+                features.update(f"#{part.lower()}" for part in parts)
+        features.update(f"{a.lower()} {b.lower()}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for feature, count in self.features(text).items():
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            # Sublinear term frequency, sign from the top bit
+            weight = 1.0 + math.log(count)
+            vector[digest % self.dimension] += -weight if digest >> 63 else weight
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed(self, texts: List[str]) -> EmbeddingResult:
+        return EmbeddingResult([self.vector(text) for text in texts])
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> CompletionResult:
+        raise NotImplementedError("The hashing provider only computes embeddings; use it as EMBEDDING_MODE with another LLM_MODE")
+
+def create_provider(mode: str, embedding: bool = False) -> Provider:
+    """
+    Create a provider for a mode.
+
+    Args:
+        mode: "OPENAI", "LOCAL" or, for embeddings, "HASHING"
+        embedding: Whether the provider serves embeddings, which may have
+            an endpoint of their own in LOCAL mode
+
+    Returns:
+        New provider
+    """
+    mode = mode.upper()
+    if mode == "OPENAI":
+        return OpenAICompatibleProvider(OPENAI_BASE_URL, OPENAI_API_KEY)
+    if mode == "LOCAL":
+        base_url = LOCAL_EMBEDDING_BASE_URL if embedding else LOCAL_LLM_BASE_URL
+        return OpenAICompatibleProvider(base_url, LOCAL_LLM_API_KEY)
+    if mode == "HASHING":
+        if not embedding:
+            raise ValueError("The hashing provider only computes embeddings; it can't serve completions")
+        return HashingProvider()
+    raise ValueError(f"Unsupported LLM mode: {mode}")
+
+# Shared providers, created lazily once per process. Embeddings and
+# completions share a provider, and its connection pool, when they use
+# the same endpoint.
+_providers: Dict[Tuple[str, bool], Provider] = {}
+_providers_lock = threading.Lock()
+
+def _provider(mode: str, embedding: bool) -> Provider:
+    mode = mode.upper()
+    key = (mode, embedding and mode == "LOCAL" and LOCAL_EMBEDDING_BASE_URL != LOCAL_LLM_BASE_URL)
+    provider = _providers.get(key)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(key)
+            if provider is None:
+                provider = _providers[key] = create_provider(mode, embedding)
+    return provider
+
+def get_embedding_provider() -> Provider:
+    """
+    Get the process-wide embedding provider, selected by EMBEDDING_MODE.
+
+    Returns:
+        Shared provider instance
+    """
+    return _provider(EMBEDDING_MODE, True)
+
+def get_completion_provider() -> Provider:
+    """
+    Get the process-wide completion provider, selected by LLM_MODE.
+
+    Returns:
+        Shared provider instance
+    """
+    return _provider(LLM_MODE, False)
+
+def _reset_after_fork():
+    global _providers_lock
+    for provider in _providers.values():
+        if isinstance(provider, OpenAICompatibleProvider):
+            provider._after_fork()
+    _providers_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,62 @@
+from collections import defaultdict, deque
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+class ExistingChunk(NamedTuple):
+    id: int
+    content_hash: str
+    start_line: int
+
+class ReingestPlan(NamedTuple):
+    # (existing chunk id, new chunk index) pairs whose code is unchanged
+    keep: List[Tuple[int, int]]
+    # (existing chunk id, new chunk index) pairs to overwrite with new code
+    update: List[Tuple[int, int]]
+    # New chunk indexes without an existing chunk to reuse
+    insert: List[int]
+    # Existing chunk ids no longer present
+    delete: List[int]
+
+    @property
+    def changed(self) -> List[int]:
+        """New chunk indexes whose code needs analyzing, in order."""
+        return sorted([index for _, index in self.update] + self.insert)
+
+def plan_reingest(existing: Sequence[ExistingChunk], hashes: Sequence[str]) -> ReingestPlan:
+    """
+    Diff the chunks stored for a source against its freshly chunked code.
+
+    Chunks with identical code are kept whatever their position. Remaining
+    existing chunks are reused, in line order, for the remaining new ones
+    so chunk ids stay stable; the rest are inserted or deleted.
+
+    Args:
+        existing: Chunks currently stored for the source
+        hashes: Content hashes of the new chunks, in order
+
+    Returns:
+        The plan
+    """
+    ordered = sorted(existing, key=lambda chunk: (chunk.start_line or 0, chunk.id))
+
+    by_hash: Dict[str, deque] = defaultdict(deque)
+    for chunk in ordered:
+        by_hash[chunk.content_hash].append(chunk.id)
+
+    keep = []
+    changed = []
+    for index, chunk_hash in enumerate(hashes):
+        if by_hash[chunk_hash]:
+            keep.append((by_hash[chunk_hash].popleft(), index))
+        else:
+            changed.append(index)
+
+    kept_ids = {chunk_id for chunk_id, _ in keep}
+    leftover = [chunk.id for chunk in ordered if chunk.id not in kept_ids]
+    update = list(zip(leftover, changed))
+
+    return ReingestPlan(
+        keep=keep,
+        update=update,
+        insert=changed[len(update):],
+        delete=leftover[len(update):]
+    )
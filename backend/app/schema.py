@@ -0,0 +1,150 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+from app.config import EMBEDDING_DIMENSION, EMBEDDING_STORAGE, VECTOR_INDEX_PRECISION
+from app.models import Base
+from app.vector_index import INDEX_NAME, STORAGE_TYPES, ensure_vector_index, pgvector_version
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = ("vector", "pg_trgm")
+
+# Data fixes for rows written before a column existed; each must be cheap
+# to run again once there is nothing left to fix
+BACKFILLS = (
+    "UPDATE code_chunks SET content_hash = encode(sha256(convert_to(raw, 'UTF8')), 'hex') "
+    "WHERE content_hash IS NULL",
+    # Link copies stored before deduplication to the oldest chunk with the
+    # same code; only needed until the canonical hash index exists
+    "UPDATE code_chunks c SET duplicate_of = d.canonical_id "
+    "FROM (SELECT content_hash, min(id) AS canonical_id FROM code_chunks "
+    "GROUP BY content_hash HAVING count(*) > 1) d "
+    "WHERE c.content_hash = d.content_hash AND c.id <> d.canonical_id AND c.duplicate_of IS NULL "
+    "AND NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_code_chunks_canonical_hash')",
+)
+
+# Advisory lock key serializing schema setup between concurrent migration runs
+SCHEMA_LOCK_KEY = 7_340_000
+
+def add_missing_columns(conn: Connection) -> None:
+    """
+    Add model columns that existing tables don't have yet.
+
+    create_all only creates missing tables, so columns added to the models
+    later are added here. Such columns must be nullable, have a server
+    default or be computed.
+
+    Args:
+        conn: Connection inside a transaction
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                logger.info(f"Adding column {table.name}.{column.name}")
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {ddl}"))
+
+def check_vector_features(conn: Connection) -> None:
+    """
+    Update pgvector to the installed library's version, which iterative
+    index scans (0.8) and halfvec or binary quantization (0.7) need.
+
+    Args:
+        conn: Connection inside a transaction
+
+    Raises:
+        RuntimeError: If compact vectors are configured and the installed
+            pgvector is older than 0.7
+    """
+    conn.execute(text("ALTER EXTENSION vector UPDATE"))
+    version = pgvector_version(conn)
+    if version < (0, 8):
+        logger.warning("pgvector is older than 0.8: filtered and deep vector searches may return short pages")
+    if EMBEDDING_STORAGE == "vector" and VECTOR_INDEX_PRECISION == "full":
+        return
+    if version < (0, 7):
+        raise RuntimeError(
+            f"EMBEDDING_STORAGE={EMBEDDING_STORAGE} and VECTOR_INDEX_PRECISION={VECTOR_INDEX_PRECISION} "
+            f"need pgvector 0.7 or later, the database has {'.'.join(map(str, version))}"
+        )
+
+def align_embedding_column(conn: Connection) -> None:
+    """
+    Give code_chunks.embedding the EMBEDDING_STORAGE type and
+    EMBEDDING_DIMENSION length.
+
+    The storage type converts in place; the old vector index is dropped
+    and rebuilt afterwards. The length can only change while no embeddings
+    are stored: vectors of one model can't be converted to another's.
+
+    Args:
+        conn: Connection inside a transaction
+
+    Raises:
+        RuntimeError: If embeddings of another length are stored
+    """
+    if EMBEDDING_STORAGE not in STORAGE_TYPES:
+        raise ValueError(f"Unsupported embedding storage: {EMBEDDING_STORAGE}")
+    # pgvector keeps the dimension in the column's type modifier
+    column = conn.execute(text(
+        "SELECT t.typname AS storage, a.atttypmod AS dimension FROM pg_attribute a "
+        "JOIN pg_type t ON t.oid = a.atttypid "
+        "WHERE a.attrelid = 'code_chunks'::regclass AND a.attname = 'embedding'"
+    )).mappings().first()
+    if column is None or (column["storage"], column["dimension"]) == (EMBEDDING_STORAGE, EMBEDDING_DIMENSION):
+        return
+    if column["dimension"] != EMBEDDING_DIMENSION and conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM code_chunks WHERE embedding IS NOT NULL)")
+    ).scalar():
+        raise RuntimeError(
+            f"Stored embeddings have {column['dimension']} dimensions but EMBEDDING_DIMENSION is "
+            f"{EMBEDDING_DIMENSION}; keep EMBEDDING_DIMENSION={column['dimension']} or ingest into a new database"
+        )
+    target = f"{EMBEDDING_STORAGE}({EMBEDDING_DIMENSION})"
+    logger.info(f"Converting code_chunks.embedding from {column['storage']}({column['dimension']}) to {target}")
+    # The index's operator class only fits the old type
+    conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+    conn.execute(text(f"ALTER TABLE code_chunks ALTER COLUMN embedding TYPE {target} USING embedding::{target}"))
+
+def ensure_schema(engine: Engine) -> None:
+    """
+    Create the extensions, tables and columns the models define, convert
+    the embedding column, backfill new columns, create the indexes, then
+    build the vector index.
+
+    Args:
+        engine: Database engine
+    """
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        for extension in EXTENSIONS:
+            conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {extension}"))
+        Base.metadata.create_all(bind=conn)
+        check_vector_features(conn)
+        add_missing_columns(conn)
+        align_embedding_column(conn)
+        # Backfills run first so new unique indexes hold for old rows
+        for backfill in BACKFILLS:
+            conn.execute(text(backfill))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+    try:
+        ensure_vector_index(engine)
+    except Exception as e:
+        # Search still works without the index, just slower
+        logger.error(f"Error ensuring vector index: {str(e)}")
+
+if __name__ == "__main__":
+    # Migration step: run once per deploy, before the API and workers start
+    from app.database import direct_engine
+    ensure_schema(direct_engine)
+    logger.info("Schema is up to date")
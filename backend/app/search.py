@@ -0,0 +1,345 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pgvector.sqlalchemy import BIT, HALFVEC
+from sqlalchemy import Float, and_, cast, func, literal, or_, select
+from sqlalchemy.orm import Session
+
+from app.config import (
+    SEARCH_SNIPPET_CHARS, HYBRID_CANDIDATES, RRF_K, VECTOR_INDEX_PRECISION, EMBEDDING_DIMENSION
+)
+from app.models import CodeChunk, SEARCH_TEXT_CONFIG
+from app.vector_index import rerank_candidates, reranks
+
+# Keyset position after the last result of a page
+class SearchCursor(NamedTuple):
+    # Distance of the last result
+    distance: float
+    # IDs already returned at exactly that distance (duplicates tie)
+    tied_ids: List[int]
+    # Number of results returned so far
+    seen: int
+
+def encode_cursor(cursor: SearchCursor) -> str:
+    """
+    Encode a search cursor as an opaque URL-safe string.
+
+    Args:
+        cursor: Cursor to encode
+
+    Returns:
+        Encoded cursor
+    """
+    payload = json.dumps({"d": cursor.distance, "ids": cursor.tied_ids, "n": cursor.seen})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(value: str) -> SearchCursor:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        value: Encoded cursor
+
+    Returns:
+        Decoded cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+        return SearchCursor(float(payload["d"]), [int(i) for i in payload["ids"]], int(payload["n"]))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def next_cursor(results: List[Dict[str, Any]], cursor: Optional[SearchCursor]) -> SearchCursor:
+    """
+    Build the cursor that continues after a page of results.
+
+    Args:
+        results: Page of results, each with "id" and "distance"
+        cursor: Cursor the page was fetched with
+
+    Returns:
+        Cursor for the next page
+    """
+    last = results[-1]["distance"]
+    tied_ids = [result["id"] for result in results if result["distance"] == last]
+    if cursor and cursor.distance == last:
+        tied_ids = cursor.tied_ids + tied_ids
+    return SearchCursor(last, tied_ids, (cursor.seen if cursor else 0) + len(results))
+
+def result_columns(compact: bool = False) -> List[Any]:
+    """
+    Columns returned for each search result.
+
+    Args:
+        compact: Return a snippet of the code instead of all of it
+
+    Returns:
+        List of column expressions
+    """
+    columns = [
+        CodeChunk.id, CodeChunk.name, CodeChunk.language, CodeChunk.description,
+        CodeChunk.incomplete, CodeChunk.created_at
+    ]
+    if compact:
+        columns += [
+            func.left(CodeChunk.raw, SEARCH_SNIPPET_CHARS).label("snippet"),
+            (func.char_length(CodeChunk.raw) > SEARCH_SNIPPET_CHARS).label("truncated")
+        ]
+    else:
+        columns.append(CodeChunk.raw)
+    return columns
+
+def _filters(language: Optional[str], collapse: bool) -> List[Any]:
+    filters = [CodeChunk.language == language] if language else []
+    if collapse:
+        # Canonical chunks stand in for their duplicates
+        filters.append(CodeChunk.duplicate_of.is_(None))
+    return filters
+
+def add_duplicate_counts(db: Session, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Add the number of chunks collapsed into each result.
+
+    Args:
+        db: Database session
+        results: Results of a collapsed search
+
+    Returns:
+        The results, each with a "duplicates" count
+    """
+    counts = {}
+    if results:
+        counts = dict(db.execute(
+            select(CodeChunk.duplicate_of, func.count())
+            .where(CodeChunk.duplicate_of.in_([result["id"] for result in results]))
+            .group_by(CodeChunk.duplicate_of)
+        ).all())
+    for result in results:
+        result["duplicates"] = counts.get(result["id"], 0)
+    return results
+
+def _to_result(row) -> Dict[str, Any]:
+    return {
+        **row,
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None
+    }
+
+def exact_distance(query_embedding: List[float]) -> Any:
+    """Cosine distance between the stored embeddings and a query embedding."""
+    return CodeChunk.embedding.op("<=>", return_type=Float)(query_embedding)
+
+def index_distance(query_embedding: List[float]) -> Any:
+    """
+    Distance the vector index orders by: the exact distance, or the one
+    between compact forms matching the index expression (see
+    vector_index.index_key).
+
+    Args:
+        query_embedding: Embedding of the search query
+
+    Returns:
+        Distance expression
+    """
+    if not reranks():
+        return exact_distance(query_embedding)
+    query = cast(literal(query_embedding, CodeChunk.embedding.type), CodeChunk.embedding.type)
+    if VECTOR_INDEX_PRECISION == "binary":
+        return cast(func.binary_quantize(CodeChunk.embedding), BIT(EMBEDDING_DIMENSION)).op(
+            "<~>", return_type=Float
+        )(func.binary_quantize(query))
+    half = HALFVEC(EMBEDDING_DIMENSION)
+    return cast(CodeChunk.embedding, half).op("<=>", return_type=Float)(cast(query, half))
+
+def nearest_ids(query_embedding: List[float], filters: List[Any], wanted: int) -> Any:
+    """
+    Subquery of the IDs of chunks that may be among the wanted nearest.
+
+    With an exact index these are the wanted nearest; with a compact one,
+    RERANK_FACTOR times as many by the compact distance, for the caller to
+    order by exact_distance.
+
+    Args:
+        query_embedding: Embedding of the search query
+        filters: Conditions chunks must meet
+        wanted: Number of results needed
+
+    Returns:
+        Subquery with an id column
+    """
+    return (
+        select(CodeChunk.id)
+        .where(*filters)
+        .order_by(index_distance(query_embedding).asc())
+        .limit(rerank_candidates(wanted))
+        .subquery()
+    )
+
+def vector_search(
+    db: Session,
+    query_embedding: List[float],
+    language: Optional[str] = None,
+    limit: int = 10,
+    cursor: Optional[SearchCursor] = None,
+    compact: bool = False,
+    collapse: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Find the chunks nearest to a query embedding, one page at a time.
+
+    Only the needed columns are selected; the compact view returns the
+    first SEARCH_SNIPPET_CHARS characters of the code instead of all of it.
+    Results are ordered by distance alone so the ANN index can serve them;
+    the cursor skips what earlier pages already returned. A compact index
+    (VECTOR_INDEX_PRECISION) only preselects candidates, which are then
+    ordered by their exact distance.
+
+    Args:
+        db: Database session
+        query_embedding: Embedding of the search query
+        language: Only return chunks in this language
+        limit: Page size
+        cursor: Position after the previous page
+        compact: Return snippets instead of full code
+        collapse: Return only canonical chunks, not their duplicates
+
+    Returns:
+        List of result dictionaries including the cosine distance
+    """
+    distance = exact_distance(query_embedding)
+    filters = _filters(language, collapse)
+
+    statement = select(*result_columns(compact), distance.label("distance"))
+    if reranks():
+        # Candidates for this page and all before it, so pages stay consistent
+        candidates = nearest_ids(query_embedding, filters, (cursor.seen if cursor else 0) + limit)
+        statement = statement.join(candidates, CodeChunk.id == candidates.c.id)
+    else:
+        statement = statement.where(*filters)
+    if cursor:
+        after = distance > cursor.distance
+        if cursor.tied_ids:
+            after = or_(after, and_(distance == cursor.distance, CodeChunk.id.notin_(cursor.tied_ids)))
+        statement = statement.where(after)
+
+    rows = db.execute(statement.order_by(distance.asc()).limit(limit)).mappings()
+    # IVFFlat's iterative scan returns rows in relaxed order
+    return [_to_result(row) for row in sorted(rows, key=lambda row: row["distance"])]
+
+def _lexical_terms(query: str) -> Tuple[Any, Any]:
+    # Full-text match over name/description/code, or the query as a word
+    # within the name (trigram); both can use their GIN index
+    ts_query = func.websearch_to_tsquery(SEARCH_TEXT_CONFIG, query)
+    match = or_(
+        CodeChunk.search_vector.op("@@")(ts_query),
+        literal(query).op("<%")(CodeChunk.name)
+    )
+    score = func.ts_rank_cd(CodeChunk.search_vector, ts_query) + func.word_similarity(query, CodeChunk.name)
+    return match, score
+
+def lexical_search(
+    db: Session,
+    query: str,
+    language: Optional[str] = None,
+    limit: int = 10,
+    compact: bool = False,
+    collapse: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Find chunks by their words and identifiers, without an embedding.
+
+    Matches the full-text document (name, description and code) or a
+    trigram match of the query within the name, both served by GIN indexes.
+
+    Args:
+        db: Database session
+        query: The search query, in web search syntax
+        language: Only return chunks in this language
+        limit: Maximum number of results
+        compact: Return snippets instead of full code
+        collapse: Return only canonical chunks, not their duplicates
+
+    Returns:
+        List of result dictionaries including the lexical score
+    """
+    match, score = _lexical_terms(query)
+
+    statement = select(*result_columns(compact), score.label("score")).where(match, *_filters(language, collapse))
+
+    rows = db.execute(statement.order_by(score.desc(), CodeChunk.id).limit(limit)).mappings()
+    return [_to_result(row) for row in rows]
+
+def hybrid_search(
+    db: Session,
+    query: str,
+    query_embedding: List[float],
+    language: Optional[str] = None,
+    limit: int = 10,
+    compact: bool = False,
+    candidates: int = HYBRID_CANDIDATES,
+    collapse: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Combine lexical and vector results with reciprocal rank fusion.
+
+    Both searches fetch only IDs for their top candidates; the columns are
+    loaded once for the fused page.
+
+    Args:
+        db: Database session
+        query: The search query
+        query_embedding: Embedding of the search query
+        language: Only return chunks in this language
+        limit: Maximum number of results
+        compact: Return snippets instead of full code
+        candidates: Candidates taken from each search
+        collapse: Return only canonical chunks, not their duplicates
+
+    Returns:
+        List of result dictionaries including the fused score and, for
+        vector matches, the distance
+    """
+    candidates = max(candidates, limit)
+    language_filter = _filters(language, collapse)
+
+    distance = exact_distance(query_embedding)
+    statement = select(CodeChunk.id, distance.label("distance"))
+    if reranks():
+        nearest = nearest_ids(query_embedding, language_filter, candidates)
+        statement = statement.join(nearest, CodeChunk.id == nearest.c.id)
+    else:
+        statement = statement.where(*language_filter)
+    vector_rows = sorted(
+        db.execute(statement.order_by(distance.asc()).limit(candidates)).all(), key=lambda row: row.distance
+    )
+
+    match, score = _lexical_terms(query)
+    lexical_ids = db.execute(
+        select(CodeChunk.id)
+        .where(match, *language_filter)
+        .order_by(score.desc(), CodeChunk.id)
+        .limit(candidates)
+    ).scalars().all()
+
+    fused: Dict[int, float] = {}
+    for ranking in ([row.id for row in vector_rows], lexical_ids):
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+
+    page = sorted(fused, key=lambda chunk_id: (-fused[chunk_id], chunk_id))[:limit]
+    if not page:
+        return []
+
+    distances = {row.id: row.distance for row in vector_rows}
+    rows = db.execute(select(*result_columns(compact)).where(CodeChunk.id.in_(page))).mappings()
+    results = {row["id"]: _to_result(row) for row in rows}
+
+    return [
+        {**results[chunk_id], "score": fused[chunk_id], "distance": distances.get(chunk_id)}
+        for chunk_id in page
+        if chunk_id in results
+    ]
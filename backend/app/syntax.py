@@ -0,0 +1,303 @@
+import ast
+import io
+import re
+import tokenize
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+# Lexical rules used to find brackets outside strings and comments
+class LanguageRules(NamedTuple):
+    line_comments: Tuple[str, ...] = ()
+    block_comments: Tuple[Tuple[str, str], ...] = ()
+    # String delimiters that end at a newline, and ones that may span lines
+    strings: Tuple[str, ...] = ('"', "'")
+    multiline_strings: Tuple[str, ...] = ()
+    # Delimiters whose contents have no backslash escapes
+    raw_strings: Tuple[str, ...] = ()
+    # Whether balanced brackets are enough to call the code complete
+    # (False for languages that close blocks with keywords)
+    brackets_define_blocks: bool = True
+    # Token that ends a statement, for languages where complete code ends with one
+    statement_terminator: Optional[str] = None
+
+_C_COMMENTS = dict(line_comments=("//",), block_comments=(("/*", "*/"),))
+
+LANGUAGE_RULES: Dict[str, LanguageRules] = {
+    "c": LanguageRules(**_C_COMMENTS),
+    "cpp": LanguageRules(**_C_COMMENTS),
+    "java": LanguageRules(**_C_COMMENTS, multiline_strings=('"""',)),
+    "csharp": LanguageRules(**_C_COMMENTS),
+    "javascript": LanguageRules(**_C_COMMENTS, multiline_strings=("`",)),
+    "typescript": LanguageRules(**_C_COMMENTS, multiline_strings=("`",)),
+    "go": LanguageRules(**_C_COMMENTS, multiline_strings=("`",), raw_strings=("`",)),
+    # Single quotes also start lifetimes in Rust, so only double quotes are strings
+    "rust": LanguageRules(**_C_COMMENTS, strings=('"',)),
+    "swift": LanguageRules(**_C_COMMENTS, multiline_strings=('"""',)),
+    "kotlin": LanguageRules(**_C_COMMENTS, multiline_strings=('"""',), raw_strings=('"""',)),
+    "scala": LanguageRules(**_C_COMMENTS, multiline_strings=('"""',), raw_strings=('"""',)),
+    "php": LanguageRules(line_comments=("//", "#"), block_comments=(("/*", "*/"),)),
+    "css": LanguageRules(block_comments=(("/*", "*/"),)),
+    # Balanced SQL can still stop mid-statement, only a final ";" ends it
+    "sql": LanguageRules(
+        line_comments=("--",), block_comments=(("/*", "*/"),),
+        brackets_define_blocks=False, statement_terminator=";"
+    ),
+    "powershell": LanguageRules(line_comments=("#",), block_comments=(("<#", "#>"),)),
+    "json": LanguageRules(strings=('"',)),
+    "yaml": LanguageRules(line_comments=("#",)),
+    "ruby": LanguageRules(line_comments=("#",), block_comments=(("=begin", "=end"),), brackets_define_blocks=False),
+    "bash": LanguageRules(line_comments=("#",), brackets_define_blocks=False)
+}
+
+# Used for languages without specific rules
+DEFAULT_RULES = LanguageRules(**_C_COMMENTS, brackets_define_blocks=False)
+
+BRACKETS = {"(": ")", "[": "]", "{": "}"}
+CLOSING_BRACKETS = {closer: opener for opener, closer in BRACKETS.items()}
+
+# Special tokens yielded by scan_brackets
+UNTERMINATED = "unterminated"
+BROKEN_STRING = "broken_string"
+
+_scanner_cache: Dict[LanguageRules, Tuple] = {}
+
+def _compile_scanner(rules: LanguageRules) -> Tuple:
+    """Compile the regexes used to scan code written with the given rules."""
+    if rules in _scanner_cache:
+        return _scanner_cache[rules]
+
+    openers = (
+        [start for start, _ in rules.block_comments]
+        + list(rules.line_comments)
+        + list(rules.multiline_strings)
+        + list(rules.strings)
+    )
+    # Longest first, so '"""' wins over '"' and "<#" over "#"
+    openers.sort(key=len, reverse=True)
+    if rules.statement_terminator:
+        openers.append(rules.statement_terminator)
+    token_re = re.compile("|".join(re.escape(token) for token in openers) + r"|[\[\](){}]")
+
+    string_end_res = {}
+    for delimiter in set(rules.strings) | set(rules.multiline_strings):
+        end = re.escape(delimiter)
+        if delimiter not in rules.multiline_strings:
+            end += r"|\n"
+        if delimiter not in rules.raw_strings:
+            end = r"\\.|" + end
+        string_end_res[delimiter] = re.compile(end, re.DOTALL)
+
+    scanner = (token_re, dict(rules.block_comments), set(rules.line_comments), string_end_res)
+    _scanner_cache[rules] = scanner
+    return scanner
+
+def scan_brackets(code: str, language: str) -> Iterator[Tuple[int, str]]:
+    """
+    Scan code once and yield the brackets that are outside strings and comments.
+
+    Besides (offset, bracket) pairs this yields (offset, UNTERMINATED) when
+    the code ends inside a string or block comment (scanning stops there),
+    and (offset, BROKEN_STRING) when a single-line string runs into a newline.
+    The language's statement terminator, if any, is yielded like a bracket.
+
+    Args:
+        code: The code to scan
+        language: The programming language of the code
+
+    Returns:
+        Iterator over (offset, token) pairs in source order
+    """
+    rules = LANGUAGE_RULES.get(language, DEFAULT_RULES)
+    token_re, block_comments, line_comments, string_end_res = _compile_scanner(rules)
+
+    pos = 0
+    length = len(code)
+    while pos < length:
+        match = token_re.search(code, pos)
+        if not match:
+            return
+        token = match.group()
+        start = match.start()
+        pos = match.end()
+
+        if token in BRACKETS or token in CLOSING_BRACKETS or token == rules.statement_terminator:
+            yield start, token
+        elif token in block_comments:
+            end = code.find(block_comments[token], pos)
+            if end < 0:
+                yield start, UNTERMINATED
+                return
+            pos = end + len(block_comments[token])
+        elif token in line_comments:
+            end = code.find("\n", pos)
+            pos = length if end < 0 else end + 1
+        else:
+            end_re = string_end_res[token]
+            while True:
+                end = end_re.search(code, pos)
+                if not end:
+                    yield start, UNTERMINATED
+                    return
+                pos = end.end()
+                if end.group() == token:
+                    break
+                if end.group() == "\n":
+                    yield start, BROKEN_STRING
+                    break
+
+def _only_comments(code: str, rules: LanguageRules) -> bool:
+    # Whether code outside any string or comment holds nothing but comments
+    block_comments = dict(rules.block_comments)
+    pos = 0
+    while True:
+        while pos < len(code) and code[pos].isspace():
+            pos += 1
+        if pos == len(code):
+            return True
+        for start, end in block_comments.items():
+            if code.startswith(start, pos):
+                close = code.find(end, pos + len(start))
+                pos = len(code) if close < 0 else close + len(end)
+                break
+        else:
+            if not code.startswith(rules.line_comments, pos):
+                return False
+            close = code.find("\n", pos)
+            pos = len(code) if close < 0 else close + 1
+
+def _python_incomplete(code: str) -> Optional[bool]:
+    try:
+        ast.parse(code)
+        return False
+    except IndentationError:
+        # Unexpected indent or a block with no body: the code was cut
+        # inside or right after a block header
+        return True
+    except (SyntaxError, ValueError) as e:
+        error = e
+
+    # The tokenizer fails on open brackets and strings at end of input
+    try:
+        for _ in tokenize.generate_tokens(io.StringIO(code).readline):
+            pass
+    except tokenize.TokenError:
+        return True
+    except (SyntaxError, ValueError):
+        pass
+
+    message = str(getattr(error, "msg", error)).lower()
+    if any(hint in message for hint in ("never closed", "unexpected eof", "unterminated", "unmatched")):
+        return True
+
+    # An error on the last line usually means the code stops mid-statement
+    last_line = code.rstrip().count("\n") + 1
+    if getattr(error, "lineno", None) and error.lineno >= last_line:
+        return True
+
+    # A genuine syntax error (or not Python 3 at all): can't tell
+    return None
+
+_VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr", "!doctype"
+}
+# HTML elements whose end tag may be omitted
+_OPTIONAL_END_ELEMENTS = {
+    "p", "li", "dt", "dd", "tr", "td", "th", "thead", "tbody", "tfoot",
+    "option", "optgroup", "colgroup", "caption", "rt", "rp", "html", "head", "body"
+}
+_MARKUP_RE = re.compile(r"<!--|<!\[CDATA\[|<\?|<(/?)([A-Za-z!][\w:.-]*)[^<>]*?(/?)>")
+_MARKUP_BLOCK_ENDS = {"<!--": "-->", "<![CDATA[": "]]>", "<?": "?>"}
+
+def _markup_incomplete(code: str, html: bool) -> bool:
+    lowered = code.lower() if html else code
+    stack = []
+    pos = 0
+    while True:
+        match = _MARKUP_RE.search(code, pos)
+        if not match:
+            break
+        token = match.group()
+        if token in _MARKUP_BLOCK_ENDS:
+            end = code.find(_MARKUP_BLOCK_ENDS[token], match.end())
+            if end < 0:
+                return True
+            pos = end + len(_MARKUP_BLOCK_ENDS[token])
+            continue
+
+        pos = match.end()
+        closing, name, self_closing = match.group(1), match.group(2), match.group(3)
+        if html:
+            name = name.lower()
+            if name in _VOID_ELEMENTS or name in _OPTIONAL_END_ELEMENTS:
+                continue
+            if name in ("script", "style") and not closing and not self_closing:
+                # Raw text elements: skip straight to the end tag
+                end = lowered.find(f"</{name}", pos)
+                if end < 0:
+                    return True
+                pos = end
+                continue
+        if self_closing or name.startswith("!"):
+            continue
+        if not closing:
+            stack.append(name)
+        elif name in stack:
+            # Pop implicitly closed elements as browsers do
+            while stack.pop() != name:
+                pass
+        else:
+            return True
+
+    # A tag cut off at the end of the text
+    if code.rfind("<") > code.rfind(">"):
+        return True
+    return bool(stack)
+
+def check_incomplete(code: str, language: str) -> Optional[bool]:
+    """
+    Decide whether code is incomplete without calling an LLM.
+
+    Python is checked with ast/tokenize, markup by tag balance and
+    everything else by a single lexer pass that balances brackets outside
+    strings and comments. Languages with a statement terminator (SQL) are
+    only complete when it is the last token.
+
+    Args:
+        code: The code to check
+        language: The programming language of the code
+
+    Returns:
+        True or False when certain, None when the result is ambiguous
+    """
+    if language == "python":
+        return _python_incomplete(code)
+    if language in ("html", "xml"):
+        return _markup_incomplete(code, html=language == "html")
+
+    rules = LANGUAGE_RULES.get(language, DEFAULT_RULES)
+    stack = []
+    broken = False
+    terminated_at = None
+    for offset, token in scan_brackets(code, language):
+        if token == rules.statement_terminator:
+            terminated_at = offset + len(token)
+            continue
+        if token == UNTERMINATED:
+            return True
+        if token == BROKEN_STRING:
+            broken = True
+        elif token in BRACKETS:
+            stack.append(token)
+        elif not stack or stack.pop() != CLOSING_BRACKETS[token]:
+            return True
+
+    if stack:
+        return True
+    if broken:
+        return None
+
+    if rules.statement_terminator:
+        if terminated_at is not None and _only_comments(code[terminated_at:], rules):
+            return False
+        return None
+    return False if rules.brackets_define_blocks else None
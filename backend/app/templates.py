@@ -0,0 +1,113 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import cache
+from app.config import TEMPLATE_CACHE_SIZE, TEMPLATE_CACHE_TTL
+from app.models import CodeChunk, Template, template_chunks
+
+# Placeholders look like {{$name}}
+PLACEHOLDER_RE = re.compile(r"\{\{\$([A-Za-z0-9_]+)\}\}")
+
+# Chunks are joined with a blank line after each of them
+CHUNK_SEPARATOR = "\n\n"
+
+class CompiledTemplate(NamedTuple):
+    # Literal text at even indexes, placeholder names at odd indexes
+    parts: Tuple[str, ...]
+    # Placeholder names in order of first appearance
+    parameters: Tuple[str, ...]
+
+def compile_template(raws: List[str]) -> CompiledTemplate:
+    """
+    Split the template code into literal text and placeholders once.
+
+    Args:
+        raws: Code of the template chunks, in position order
+
+    Returns:
+        Compiled template
+    """
+    parts = tuple(PLACEHOLDER_RE.split("".join(raw + CHUNK_SEPARATOR for raw in raws)))
+    return CompiledTemplate(parts, tuple(dict.fromkeys(parts[1::2])))
+
+def render_template(template: CompiledTemplate, parameters: Dict[str, Any]) -> str:
+    """
+    Substitute parameters into a compiled template in a single pass.
+
+    Placeholders without a parameter are left as they are, and substituted
+    values are never scanned for placeholders again.
+
+    Args:
+        template: Compiled template
+        parameters: Values by placeholder name
+
+    Returns:
+        Rendered code
+    """
+    parts = list(template.parts)
+    for i in range(1, len(parts), 2):
+        name = parts[i]
+        parts[i] = str(parameters[name]) if name in parameters else f"{{{{${name}}}}}"
+    return "".join(parts)
+
+# Compiled templates by id, with the chunk versions they were compiled from
+_compiled_templates = cache.LocalCache(TEMPLATE_CACHE_SIZE, TEMPLATE_CACHE_TTL, "compiled_templates")
+
+def compiled_for(db: Session, template_id: int, fingerprint: Tuple) -> CompiledTemplate:
+    """
+    Get the compiled code of a template, compiling it only when its chunks
+    changed since it was last compiled.
+
+    Args:
+        db: Database session
+        template_id: ID of the template
+        fingerprint: (chunk_id, position, updated_at) of each template chunk,
+            in position order
+
+    Returns:
+        Compiled template
+    """
+    cached = _compiled_templates.get(str(template_id))
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    raws = db.execute(
+        select(CodeChunk.raw)
+        .join(template_chunks, template_chunks.c.chunk_id == CodeChunk.id)
+        .where(template_chunks.c.template_id == template_id)
+        .order_by(template_chunks.c.position)
+    ).scalars().all()
+    compiled = compile_template(raws)
+    _compiled_templates.set(str(template_id), (fingerprint, compiled))
+    return compiled
+
+def get_compiled_template(db: Session, template_id: int) -> Optional[Tuple[Template, CompiledTemplate, Optional[str]]]:
+    """
+    Load a template with its compiled code.
+
+    Args:
+        db: Database session
+        template_id: ID of the template
+
+    Returns:
+        Tuple of the template, the compiled template and the language of its
+        first chunk, or None if the template doesn't exist
+    """
+    rows = db.execute(
+        select(Template, template_chunks.c.chunk_id, template_chunks.c.position, CodeChunk.updated_at, CodeChunk.language)
+        .outerjoin(template_chunks, template_chunks.c.template_id == Template.id)
+        .outerjoin(CodeChunk, CodeChunk.id == template_chunks.c.chunk_id)
+        .where(Template.id == template_id)
+        .order_by(template_chunks.c.position)
+    ).all()
+    if not rows:
+        return None
+
+    members = [row for row in rows if row.chunk_id is not None]
+    fingerprint = tuple((row.chunk_id, row.position, row.updated_at) for row in members)
+    language = members[0].language if members else None
+
+    return rows[0].Template, compiled_for(db, template_id, fingerprint), language
@@ -1,93 +1,396 @@
+import asyncio
 import os
 import re
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 
-from openai import OpenAI
-from fastapi import HTTPException
 
-from app.config import OPENAI_API_KEY, EMBEDDING_MODEL, COMPLETION_MODEL, SUPPORTED_LANGUAGES
-
-# OpenAI client will be instantiated in each function that needs it
+from app import cache, metrics
+from app.providers import get_completion_provider, get_embedding_provider
+from app.chunking import estimate_tokens, iter_chunks
+from app.syntax import check_incomplete
+from app.config import (
+    SUPPORTED_LANGUAGES, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS, INCOMPLETE_LLM_CONFIRM,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def detect_language(code: str) -> str:
+def _chat_completion(
+    kind: str,
+    language: Optional[str],
+    text: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float
+) -> str:
+    """
+    Run a chat completion, serving repeated prompts from the LLM cache.
+    
+    Args:
+        kind: Kind of prompt, part of the cache key
+        language: Programming language of the text, part of the cache key
+        text: The text the prompt is built from, part of the cache key
+        messages: Chat messages to send
+        max_tokens: Maximum tokens in the response
+        temperature: Sampling temperature
+        
+    Returns:
+        Response content
+    """
+    provider = get_completion_provider()
+    key = cache.make_key(provider.completion_id(), kind, language, text)
+    cached = cache.lookup(kind, key)
+    if cached is not None:
+        return cached.decode("utf-8")
+    
+    with metrics.llm_request(kind):
+        content, usage = provider.complete(messages, max_tokens, temperature)
+    metrics.record_llm_usage(kind, usage)
+    
+    # Only successful responses are cached; failures fall through to the caller
+    cache.store(key, content.encode("utf-8"))
+    return content
+
+async def _chat_completion_async(
+    kind: str,
+    language: Optional[str],
+    text: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float
+) -> str:
+    """
+    Run a chat completion without blocking the event loop.
+    
+    Same arguments and caching as _chat_completion.
+    
+    Returns:
+        Response content
+    """
+    provider = get_completion_provider()
+    key = cache.make_key(provider.completion_id(), kind, language, text)
+    cached = await asyncio.to_thread(cache.lookup, kind, key)
+    if cached is not None:
+        return cached.decode("utf-8")
+    
+    with metrics.llm_request(kind):
+        content, usage = await provider.acomplete(messages, max_tokens, temperature)
+    metrics.record_llm_usage(kind, usage)
+    
+    await asyncio.to_thread(cache.store, key, content.encode("utf-8"))
+    return content
+
+# File extensions that identify a language on their own
+EXTENSION_LANGUAGES = {
+    ".py": "python", ".pyw": "python", ".pyi": "python",
+    ".js": "javascript", ".mjs": "javascript", ".cjs": "javascript", ".jsx": "javascript",
+    ".ts": "typescript", ".tsx": "typescript", ".mts": "typescript", ".cts": "typescript",
+    ".java": "java",
+    ".c": "c", ".h": "c",
+    ".cpp": "cpp", ".cc": "cpp", ".cxx": "cpp", ".hpp": "cpp", ".hh": "cpp", ".hxx": "cpp",
+    ".cs": "csharp",
+    ".go": "go",
+    ".rs": "rust",
+    ".php": "php",
+    ".rb": "ruby", ".rake": "ruby",
+    ".swift": "swift",
+    ".kt": "kotlin", ".kts": "kotlin",
+    ".scala": "scala", ".sc": "scala",
+    ".sql": "sql",
+    ".html": "html", ".htm": "html",
+    ".css": "css",
+    ".sh": "bash", ".bash": "bash", ".zsh": "bash",
+    ".ps1": "powershell", ".psm1": "powershell", ".psd1": "powershell",
+    ".yaml": "yaml", ".yml": "yaml",
+    ".json": "json",
+    ".xml": "xml", ".xsd": "xml", ".xsl": "xml", ".svg": "xml"
+}
+
+# Interpreters named on a shebang line
+SHEBANG_LANGUAGES = {
+    "python": "python", "pypy": "python",
+    "node": "javascript", "nodejs": "javascript", "deno": "typescript",
+    "bash": "bash", "sh": "bash", "zsh": "bash", "dash": "bash", "ksh": "bash",
+    "ruby": "ruby", "php": "php", "pwsh": "powershell", "powershell": "powershell"
+}
+
+_SHEBANG_RE = re.compile(r"#!\s*(?:\S*/)?(?:env\s+(?:-\S+\s+)*)?([A-Za-z]+)")
+
+# Content patterns and the languages they count as evidence for, grouped by
+# where they may start. Patterns must only use non-capturing groups and
+# should start with a literal character where possible, which lets the
+# regex engine skip non-matching alternatives without trying them.
+
+# Matched at the start of a line, after any indentation
+_LINE_EVIDENCE = [
+    # Python
+    (r"def[ \t]+\w+[ \t]*\(.*\)[ \t]*(?:->[^:\n]+)?:[ \t]*$", {"python": 3}),
+    (r"class[ \t]+\w+[ \t]*(?:\(.*\))?[ \t]*:[ \t]*$", {"python": 3}),
+    (r"from[ \t]+[\w.]+[ \t]+import[ \t]", {"python": 3}),
+    (r"import[ \t]+[\w.]+(?:[ \t]+as[ \t]+\w+)?[ \t]*$", {"python": 2}),
+    (r"(?:elif|except|try|finally|else)\b[^\n{;]*:[ \t]*$", {"python": 2}),
+    # JavaScript / TypeScript
+    (r"import[ \t]+.*[ \t]from[ \t]+['\"].*['\"]", {"javascript": 2, "typescript": 2}),
+    (r"export[ \t]+(?:default|const|function|class)\b", {"javascript": 2, "typescript": 2}),
+    (r"(?:export[ \t]+)?interface[ \t]+\w+[^\n;]*\{", {"typescript": 3, "java": 1}),
+    (r"(?:export[ \t]+)?type[ \t]+\w+(?:<[^>\n]*>)?[ \t]*=", {"typescript": 3}),
+    # Java / C#
+    (r"package[ \t]+[\w.]+;", {"java": 3}),
+    (r"import[ \t]+(?:static[ \t]+)?[\w.]+(?:\.\*)?;", {"java": 3}),
+    (r"using[ \t]+[\w.]+;", {"csharp": 3}),
+    (r"namespace[ \t]+[\w.]+[ \t]*;?[ \t]*$", {"csharp": 2}),
+    # C / C++
+    (r"#[ \t]*include[ \t]*[<\"]", {"c": 2, "cpp": 2}),
+    (r"namespace[ \t]+\w+[ \t]*\{", {"cpp": 3}),
+    (r"(?:static[ \t]+)?(?:int|void|char|float|double|long|unsigned)[ \t]+\**\w+[ \t]*\([^)\n]*\)[ \t]*\{?[ \t]*$", {"c": 2, "cpp": 1}),
+    # Go
+    (r"package[ \t]+\w+[ \t]*$", {"go": 3, "kotlin": 1, "scala": 1}),
+    (r"func[ \t]+(?:\(\w+[ \t]+\*?\w+\)[ \t]*)?\w+[ \t]*\(", {"go": 3, "swift": 2}),
+    (r"import[ \t]+\([ \t]*$", {"go": 2}),
+    # Rust
+    (r"use[ \t]+\w+(?:::[\w{}*, ]+)+;", {"rust": 3}),
+    # Ruby
+    (r"def[ \t]+[\w.]+[?!]?[ \t]*(?:\([^)\n]*\))?[ \t]*$", {"ruby": 2}),
+    (r"end[ \t]*$", {"ruby": 2}),
+    (r"require(?:_relative)?[ \t]+['\"][\w/.-]+['\"]", {"ruby": 3}),
+    (r"class[ \t]+\w+[ \t]*<[ \t]*[\w:]+", {"ruby": 3}),
+    # Swift
+    (r"import[ \t]+(?:UIKit|Foundation|SwiftUI|Combine)\b", {"swift": 5}),
+    # CSS
+    (r"[.#][\w-]+[^{;()\n]*\{", {"css": 2}),
+    (r"[a-z-]+[ \t]*:[ \t]*[^;{}\n]+;[ \t]*$", {"css": 1}),
+    # Shell
+    (r"(?:fi|done|esac)[ \t]*$", {"bash": 3}),
+    (r"export[ \t]+\w+=", {"bash": 3}),
+    (r"echo[ \t]", {"bash": 2, "php": 1}),
+    (r"function[ \t]+\w+-[\w-]+", {"powershell": 4}),
+    # YAML
+    (r"---[ \t]*$", {"yaml": 3}),
+    (r"-[ \t]+[\w-]+:[ \t]", {"yaml": 2}),
+    (r"[\w-]+:[ \t]*$", {"yaml": 1})
+]
+
+# Matched at the start of a word
+_WORD_EVIDENCE = [
+    (r"self\.\w+", {"python": 1}),
+    (r"__name__[ \t]*==[ \t]*['\"]__main__['\"]", {"python": 5}),
+    (r"(?:const|let|var)[ \t]+\w+[ \t]*=", {"javascript": 1, "typescript": 1}),
+    (r"function\b[ \t]*\w*[ \t]*\(", {"javascript": 1, "typescript": 1, "php": 1}),
+    (r"console\.\w+\(", {"javascript": 2, "typescript": 2}),
+    (r"require\(['\"]", {"javascript": 2}),
+    (r"module\.exports\b", {"javascript": 2}),
+    (r"(?:document|window)\.\w+", {"javascript": 1}),
+    (r"implements[ \t]+\w+", {"typescript": 1, "java": 1, "php": 1}),
+    (r"public[ \t]+(?:static[ \t]+)?(?:final[ \t]+|abstract[ \t]+)?(?:class|interface|enum)\b", {"java": 2, "csharp": 2}),
+    (r"(?:private|protected|public)[ \t]+(?:static[ \t]+)?(?:final[ \t]+)?[\w<>\[\],]+[ \t]+\w+[ \t]*[(;=]", {"java": 1, "csharp": 1}),
+    (r"System\.out\.print", {"java": 4}),
+    (r"Console\.Write|async[ \t]+Task\b", {"csharp": 4}),
+    (r"std::", {"cpp": 3}),
+    (r"template[ \t]*<|using[ \t]+namespace\b", {"cpp": 3}),
+    (r"(?:cout|cin|cerr|endl)\b", {"cpp": 2}),
+    (r"(?:printf|malloc|free|sizeof)[ \t]*\(", {"c": 2, "cpp": 1}),
+    (r"int[ \t]+main[ \t]*\(", {"c": 2, "cpp": 2}),
+    (r"fmt\.\w+\(", {"go": 4}),
+    (r"fn[ \t]+\w+[ \t]*(?:<[^>\n]*>)?[ \t]*\(", {"rust": 3}),
+    (r"let[ \t]+mut\b", {"rust": 4}),
+    (r"impl\b|pub[ \t]+(?:fn|struct|enum|mod|trait)\b|println!\(", {"rust": 3}),
+    (r"puts[ \t]|attr_(?:accessor|reader|writer)\b", {"ruby": 3}),
+    (r"(?:guard|if)[ \t]+let\b", {"swift": 4}),
+    (r"func[ \t]+\w+[ \t]*\([^)\n]*\)[ \t]*->", {"swift": 3}),
+    (r"fun[ \t]+(?:<[^>\n]*>[ \t]*)?[\w.]+[ \t]*\(", {"kotlin": 4}),
+    (r"data[ \t]+class\b", {"kotlin": 4}),
+    (r"val[ \t]+\w+[ \t]*[:=]", {"kotlin": 2, "scala": 2}),
+    (r"def[ \t]+\w+[ \t]*(?:\[[^\]\n]*\])?[ \t]*(?:\([^)\n]*\))?[ \t]*:[ \t]*[\w\[\]]+[ \t]*=", {"scala": 4}),
+    (r"case[ \t]+class\b|object[ \t]+\w+[ \t]+extends\b", {"scala": 4}),
+    (r"(?i:SELECT\s+.*\s+FROM\s)", {"sql": 3}),
+    (r"(?i:INSERT\s+INTO\b|(?:CREATE|ALTER|DROP)\s+(?:TABLE|(?:UNIQUE\s+)?INDEX|VIEW)\b)", {"sql": 3}),
+    (r"if[ \t]+\[\[?[ \t]", {"bash": 3}),
+    (r"(?i:param[ \t]*\()", {"powershell": 3}),
+    (r"(?i:(?:Write-Host|Write-Output|Get-\w+|Set-\w+|New-Object)\b)", {"powershell": 4}),
+    (r"xmlns(?::\w+)?=", {"xml": 5})
+]
+
+# Matched anywhere
+_OTHER_EVIDENCE = [
+    (r"===|!==", {"javascript": 1, "typescript": 1, "php": 1}),
+    (r":[ \t]*(?:string|number|boolean|any|void|unknown)\b", {"typescript": 2}),
+    (r"@Override\b", {"java": 2}),
+    (r"\{[ \t]*get;[ \t]*(?:(?:private[ \t]+)?set;[ \t]*)?\}", {"csharp": 4}),
+    (r":=", {"go": 2}),
+    (r"\.each[ \t]+do[ \t]*\|", {"ruby": 3}),
+    (r"<\?php", {"php": 10}),
+    (r"\$this->", {"php": 4}),
+    (r"\$\w+[ \t]*=", {"php": 1, "powershell": 1}),
+    (r"<!(?i:DOCTYPE\s+html)", {"html": 10}),
+    (r"<(?i:(?:html|head|body|div|span|script|meta|link|form|table)\b)", {"html": 2}),
+    (r"<\?xml\b", {"xml": 10}),
+    (r"</[\w:.-]+>", {"html": 0.5, "xml": 0.5}),
+    (r"@media\b|@import[ \t]+(?:url|['\"])|@keyframes\b|@font-face\b", {"css": 4}),
+    (r"-(?:eq|ne|gt|lt|like|match)[ \t]", {"powershell": 2, "bash": 1}),
+    (r"\"[\w-]+\"[ \t]*:[ \t]*[{\"\[\dtfn-]", {"json": 2})
+]
+
+# One regex finds every piece of evidence in a single scan; its three groups
+# tell which list the match came from
+_LANGUAGE_PATTERN = re.compile(
+    r"^[ \t]*+(" + "|".join(pattern for pattern, _ in _LINE_EVIDENCE) + ")"
+    r"|\b(" + "|".join(pattern for pattern, _ in _WORD_EVIDENCE) + ")"
+    r"|(" + "|".join(pattern for pattern, _ in _OTHER_EVIDENCE) + ")",
+    re.MULTILINE
+)
+# Per-group patterns, tried in order at a match position to find which
+# alternative the combined regex picked
+_LANGUAGE_GROUPS = [
+    [(re.compile(pattern, re.MULTILINE), tuple(weights.items())) for pattern, weights in evidence]
+    for evidence in (_LINE_EVIDENCE, _WORD_EVIDENCE, _OTHER_EVIDENCE)
+]
+
+# Only the head of large files is scored, which is plenty of evidence
+LANGUAGE_SAMPLE_CHARS = 16 * 1024
+# Minimum score for a content-based detection to be trusted
+LANGUAGE_MIN_SCORE = 2
+
+def score_languages(code: str) -> Dict[str, float]:
+    """
+    Score every language against the code in a single pass.
+    
+    Args:
+        code: The code snippet to analyze
+        
+    Returns:
+        Mapping of language to evidence score, without zero scores
+    """
+    sample = code[:LANGUAGE_SAMPLE_CHARS]
+    scores = {}
+    
+    for match in _LANGUAGE_PATTERN.finditer(sample):
+        group = match.lastindex
+        start = match.start(group)
+        for pattern, weights in _LANGUAGE_GROUPS[group - 1]:
+            if pattern.match(sample, start):
+                for lang, weight in weights:
+                    scores[lang] = scores.get(lang, 0) + weight
+                break
+    
+    return scores
+
+def language_from_filename(filename: Optional[str], code: str = "") -> Optional[str]:
+    """
+    Infer the language from the file extension or the shebang line alone.
+    
+    Args:
+        filename: File name, if known
+        code: The code, or at least its first line
+        
+    Returns:
+        Language or None if neither gives an answer
+    """
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in EXTENSION_LANGUAGES:
+            return EXTENSION_LANGUAGES[extension]
+    
+    if code.startswith("#!"):
+        match = _SHEBANG_RE.match(code)
+        if match and match.group(1) in SHEBANG_LANGUAGES:
+            return SHEBANG_LANGUAGES[match.group(1)]
+    
+    return None
+
+def _detect_language_locally(code: str, filename: Optional[str]) -> Optional[str]:
+    # File extension and shebang first, then the content scores
+    language = language_from_filename(filename, code)
+    if language:
+        return language
+    
+    scores = score_languages(code)
+    if scores:
+        # Ties go to the language listed first in SUPPORTED_LANGUAGES
+        best = max(SUPPORTED_LANGUAGES, key=lambda lang: scores.get(lang, 0))
+        if scores.get(best, 0) >= LANGUAGE_MIN_SCORE:
+            return best
+    
+    return None
+
+def _language_prompt(sample: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You are a programming language detector. Respond with only the language name."},
+        {"role": "user", "content": f"What programming language is this code written in? Respond with only the language name.\n\n{sample}"}
+    ]
+
+def _supported_language(detected: str) -> str:
+    # Check if detected language is in our supported list
+    for lang in SUPPORTED_LANGUAGES:
+        if lang in detected:
+            return lang
+    return "unknown"
+
+def detect_language(code: str, filename: Optional[str] = None, allow_llm: bool = False) -> str:
     """
     Detect programming language from code snippet.
     
+    The file extension and shebang line are checked first, then all
+    languages are scored against the code. The LLM is only consulted
+    when allowed and nothing else gave an answer.
+    
     Args:
         code: The code snippet to analyze
+        filename: Original file name, if known
+        allow_llm: Whether to fall back to the LLM
         
     Returns:
         Detected language or "unknown"
     """
-    # Simple language detection based on file extensions and patterns
-    patterns = {
-        "python": [r"import\s+[a-zA-Z0-9_]+", r"from\s+[a-zA-Z0-9_\.]+\s+import", r"def\s+[a-zA-Z0-9_]+\s*\(", r"class\s+[a-zA-Z0-9_]+\s*:"],
-        "javascript": [r"const\s+[a-zA-Z0-9_]+\s*=", r"let\s+[a-zA-Z0-9_]+\s*=", r"function\s+[a-zA-Z0-9_]+\s*\(", r"import\s+.*\s+from\s+['\"].*['\"]"],
-        "typescript": [r"interface\s+[a-zA-Z0-9_]+", r"type\s+[a-zA-Z0-9_]+\s*=", r"class\s+[a-zA-Z0-9_]+\s*implements"],
-        "java": [r"public\s+class", r"private\s+[a-zA-Z0-9_<>]+\s+[a-zA-Z0-9_]+", r"package\s+[a-zA-Z0-9_\.]+;"],
-        "c": [r"#include\s+<[a-zA-Z0-9_\.]+>", r"void\s+[a-zA-Z0-9_]+\s*\(", r"int\s+main\s*\("],
-        "cpp": [r"#include\s+<[a-zA-Z0-9_\.]+>", r"std::", r"namespace\s+[a-zA-Z0-9_]+"],
-        "csharp": [r"using\s+[a-zA-Z0-9_\.]+;", r"namespace\s+[a-zA-Z0-9_\.]+", r"public\s+class"],
-        "go": [r"package\s+[a-zA-Z0-9_]+", r"func\s+[a-zA-Z0-9_]+\s*\(", r"import\s+\("],
-        "rust": [r"fn\s+[a-zA-Z0-9_]+", r"let\s+mut", r"use\s+[a-zA-Z0-9_:]+"],
-        "php": [r"<\?php", r"\$[a-zA-Z0-9_]+\s*=", r"function\s+[a-zA-Z0-9_]+\s*\("],
-        "ruby": [r"def\s+[a-zA-Z0-9_]+", r"require\s+['\"][a-zA-Z0-9_]+['\"]", r"class\s+[a-zA-Z0-9_]+\s*<"],
-        "html": [r"<!DOCTYPE\s+html>", r"<html", r"<head", r"<body"],
-        "css": [r"[a-zA-Z0-9_\-\.#]+\s*\{", r"@media", r"@import"],
-        "sql": [r"SELECT\s+.*\s+FROM", r"INSERT\s+INTO", r"CREATE\s+TABLE", r"ALTER\s+TABLE"],
-        "bash": [r"#!/bin/bash", r"#!/usr/bin/env\s+bash", r"if\s+\[\["],
-        "powershell": [r"param\s*\(", r"\$[a-zA-Z0-9_]+\s*=", r"function\s+[a-zA-Z0-9_\-]+"],
-        "yaml": [r"^---", r"key:\s+value"],
-        "json": [r"^\s*\{", r"\"[a-zA-Z0-9_]+\":\s*[{\"\[\d]"],
-        "xml": [r"<\?xml", r"<[a-zA-Z0-9_]+>.*</[a-zA-Z0-9_]+>"]
-    }
-    
-    for lang, pattern_list in patterns.items():
-        for pattern in pattern_list:
-            if re.search(pattern, code, re.IGNORECASE | re.MULTILINE):
-                return lang
-    
-    # If no patterns match, try to use LLM to detect language
-    try:
-        # Create a client instance for the new OpenAI API (v1.0.0+)
-        client = OpenAI(api_key=OPENAI_API_KEY)
+    with metrics.stage("detect_language"):
+        language = _detect_language_locally(code, filename)
+        if language or not allow_llm:
+            return language or "unknown"
         
-        response = client.chat.completions.create(
-            model=COMPLETION_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a programming language detector. Respond with only the language name."},
-                {"role": "user", "content": f"What programming language is this code written in? Respond with only the language name.\n\n{code[:1000]}"}
-            ],
-            max_tokens=20,
-            temperature=0.1
-        )
-        detected = response.choices[0].message.content.strip().lower()
+        # If no patterns match, try to use LLM to detect language
+        try:
+            sample = code[:1000]
+            detected = _chat_completion(
+                "language", None, sample, _language_prompt(sample), max_tokens=20, temperature=0.1
+            ).lower()
+            return _supported_language(detected)
+        except Exception as e:
+            logger.error(f"Error detecting language with LLM: {e}")
         
-        # Check if detected language is in our supported list
-        for lang in SUPPORTED_LANGUAGES:
-            if lang in detected:
-                return lang
-                
-    except Exception as e:
-        logger.error(f"Error detecting language with LLM: {e}")
-    
-    return "unknown"
+        return "unknown"
 
-def is_code(text: str) -> bool:
+async def detect_language_async(code: str, filename: Optional[str] = None, allow_llm: bool = False) -> str:
     """
-    Determine if the given text is likely code rather than plain text.
+    Detect programming language like detect_language, awaiting the LLM
+    fallback instead of blocking on it.
     
     Args:
-        text: The text to analyze
+        code: The code snippet to analyze
+        filename: Original file name, if known
+        allow_llm: Whether to fall back to the LLM
         
     Returns:
-        True if the text is likely code, False otherwise
+        Detected language or "unknown"
     """
+    with metrics.stage("detect_language"):
+        language = _detect_language_locally(code, filename)
+        if language or not allow_llm:
+            return language or "unknown"
+        
+        try:
+            sample = code[:1000]
+            detected = (await _chat_completion_async(
+                "language", None, sample, _language_prompt(sample), max_tokens=20, temperature=0.1
+            )).lower()
+            return _supported_language(detected)
+        except Exception as e:
+            logger.error(f"Error detecting language with LLM: {e}")
+        
+        return "unknown"
+
+def _looks_like_code(text: str) -> bool:
     # Check for common code indicators
     code_indicators = [
         # Brackets, parentheses, and braces
@@ -119,34 +422,151 @@ def is_code(text: str) -> bool:
         return True
     
     # If language detection returns a known language, it's code
-    language = detect_language(text)
-    if language != "unknown":
+    return detect_language(text) != "unknown"
+
+def _is_code_prompt(sample: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You are a code detector. Respond with only 'yes' or 'no'."},
+        {"role": "user", "content": f"Is the following text a code snippet? Respond with only 'yes' or 'no'.\n\n{sample}"}
+    ]
+
+def is_code(text: str) -> bool:
+    """
+    Determine if the given text is likely code rather than plain text.
+    
+    Args:
+        text: The text to analyze
+        
+    Returns:
+        True if the text is likely code, False otherwise
+    """
+    if _looks_like_code(text):
         return True
     
     # If all else fails, use LLM to determine if it's code
     try:
-        # Create a client instance for the new OpenAI API (v1.0.0+)
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        sample = text[:1000]
+        result = _chat_completion(
+            "is_code", None, sample, _is_code_prompt(sample), max_tokens=10, temperature=0.1
+        ).lower()
+        return "yes" in result
+    except Exception as e:
+        logger.error(f"Error determining if text is code with LLM: {e}")
         
-        response = client.chat.completions.create(
-            model=COMPLETION_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a code detector. Respond with only 'yes' or 'no'."},
-                {"role": "user", "content": f"Is the following text a code snippet? Respond with only 'yes' or 'no'.\n\n{text[:1000]}"}
-            ],
-            max_tokens=10,
-            temperature=0.1
-        )
-        result = response.choices[0].message.content.strip().lower()
+    return False
+
+async def is_code_async(text: str) -> bool:
+    """
+    Determine if the text is likely code like is_code, awaiting the LLM
+    fallback instead of blocking on it.
+    
+    Args:
+        text: The text to analyze
+        
+    Returns:
+        True if the text is likely code, False otherwise
+    """
+    if _looks_like_code(text):
+        return True
+    
+    try:
+        sample = text[:1000]
+        result = (await _chat_completion_async(
+            "is_code", None, sample, _is_code_prompt(sample), max_tokens=10, temperature=0.1
+        )).lower()
         return "yes" in result
     except Exception as e:
         logger.error(f"Error determining if text is code with LLM: {e}")
         
     return False
 
+def iter_embedding_batches(
+    texts: Iterable[str],
+    max_items: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS
+) -> Iterator[List[str]]:
+    """
+    Group texts into batches that respect per-request item and token limits.
+    
+    Args:
+        texts: The texts to group
+        max_items: Maximum number of inputs per request
+        max_tokens: Maximum estimated tokens per request
+        
+    Returns:
+        Iterator over lists of texts, in input order
+    """
+    batch = []
+    batch_tokens = 0
+    
+    for text in texts:
+        tokens = estimate_tokens(text)
+        
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        
+        batch.append(text)
+        batch_tokens += tokens
+    
+    if batch:
+        yield batch
+
+def generate_embeddings(
+    texts: Iterable[str],
+    max_items: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    cache_ttl: Optional[int] = None
+) -> List[List[float]]:
+    """
+    Generate embedding vectors for many texts using batched provider requests.
+    
+    Args:
+        texts: The texts to generate embeddings for
+        max_items: Maximum number of inputs per request
+        max_tokens: Maximum estimated tokens per request
+        cache_ttl: Seconds to cache new embeddings for, None until evicted
+        
+    Returns:
+        Embedding vectors in the same order as the input texts
+    """
+    texts = list(texts)
+    provider = get_embedding_provider()
+    keys = [cache.make_key(provider.embedding_id(), "embedding", None, text) for text in texts]
+    embeddings = [
+        cache.decode_embedding(value) if value is not None else None
+        for value in cache.lookup_many("embedding", keys)
+    ]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    
+    if not missing:
+        return embeddings
+    
+    try:
+        # Only texts that missed the cache go to the provider
+        pending = iter(missing)
+        for batch in iter_embedding_batches((texts[i] for i in missing), max_items, max_tokens):
+            with metrics.llm_request("embedding"):
+                vectors, usage = provider.embed(batch)
+            metrics.record_llm_usage("embedding", usage)
+            fresh = {}
+            for vector in vectors:
+                i = next(pending)
+                embeddings[i] = vector
+                fresh[keys[i]] = cache.encode_embedding(vector)
+            cache.store_many(fresh, cache_ttl)
+    except Exception as e:
+        logger.error(f"Error generating embeddings: {e}")
+        # Imported here so workers don't load FastAPI at startup
+        from fastapi import HTTPException
+        raise HTTPException(status_code=500, detail=f"Failed to generate embeddings: {str(e)}")
+    
+    return embeddings
+
 def generate_embedding(text: str) -> List[float]:
     """
-    Generate embedding vector for the given text using OpenAI API.
+    Generate embedding vector for the given text.
     
     Args:
         text: The text to generate embedding for
@@ -154,23 +574,78 @@ def generate_embedding(text: str) -> List[float]:
     Returns:
         Embedding vector as a list of floats
     """
-    try:
-        # Create a client instance for the new OpenAI API (v1.0.0+)
-        client = OpenAI(api_key=OPENAI_API_KEY)
+    return generate_embeddings([text])[0]
+
+# Hot search queries, kept in process in front of the shared Redis cache
+query_embedding_cache = cache.LocalCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, "query_embeddings")
+
+def get_query_embedding(query: str) -> List[float]:
+    """
+    Get the embedding for a search query.
+    
+    Checks the in-process cache, then Redis, and only then calls the
+    provider. Concurrent calls for the same query share one lookup.
+    
+    Args:
+        query: The search query
         
-        # Use the new API format for creating embeddings
-        response = client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate embedding: {str(e)}")
+    Returns:
+        Embedding vector as a list of floats
+    """
+    # Queries differing only in whitespace share an embedding
+    text = " ".join(query.split())
+    key = cache.make_key(get_embedding_provider().embedding_id(), "embedding", None, text)
+    
+    embedding = query_embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+    
+    def compute():
+        embedding = generate_embeddings([text], cache_ttl=QUERY_CACHE_TTL)[0]
+        query_embedding_cache.set(key, embedding)
+        return embedding
+    
+    return cache.single_flight(key, compute)
+
+async def get_query_embedding_async(query: str) -> List[float]:
+    """
+    Get the embedding for a search query without blocking the event loop.
+    
+    Same caching as get_query_embedding; the provider is called through
+    the provider's async interface.
+    
+    Args:
+        query: The search query
+        
+    Returns:
+        Embedding vector as a list of floats
+    """
+    text = " ".join(query.split())
+    provider = get_embedding_provider()
+    key = cache.make_key(provider.embedding_id(), "embedding", None, text)
+    
+    embedding = query_embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+    
+    async def compute():
+        cached = await asyncio.to_thread(cache.lookup, "embedding", key)
+        if cached is not None:
+            embedding = cache.decode_embedding(cached)
+        else:
+            with metrics.llm_request("query_embedding"):
+                vectors, usage = await provider.aembed([text])
+            metrics.record_llm_usage("query_embedding", usage)
+            embedding = vectors[0]
+            await asyncio.to_thread(cache.store_many, {key: cache.encode_embedding(embedding)}, QUERY_CACHE_TTL)
+        query_embedding_cache.set(key, embedding)
+        return embedding
+    
+    return await cache.async_single_flight(key, compute)
 
 def generate_description(code: str, language: str) -> str:
     """
-    Generate a description for the given code snippet using OpenAI API.
+    Generate a description for the given code snippet using the LLM.
     
     Args:
         code: The code snippet to describe
@@ -195,11 +670,10 @@ def generate_description(code: str, language: str) -> str:
         ```
         """
         
-        # Create a client instance for the new OpenAI API (v1.0.0+)
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        response = client.chat.completions.create(
-            model=COMPLETION_MODEL,
+        return _chat_completion(
+            "description",
+            language,
+            code,
             messages=[
                 {"role": "system", "content": "You are a code analysis expert. Provide clear, concise, and accurate descriptions of code snippets."},
                 {"role": "user", "content": prompt}
@@ -207,15 +681,14 @@ def generate_description(code: str, language: str) -> str:
             max_tokens=500,
             temperature=0.5
         )
-        return response.choices[0].message.content.strip()
     except Exception as e:
         logger.error(f"Error generating description: {e}")
-        # Return a basic description if OpenAI API fails
+        # Return a basic description if the LLM call fails
         return f"Code snippet in {language}. (Description generation failed)"
 
 def complete_code(code: str, language: str) -> str:
     """
-    Complete incomplete code snippet using OpenAI API.
+    Complete incomplete code snippet using the LLM.
     
     Args:
         code: The incomplete code snippet
@@ -243,11 +716,10 @@ def complete_code(code: str, language: str) -> str:
         ```{language}
         """
         
-        # Create a client instance for the new OpenAI API (v1.0.0+)
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        response = client.chat.completions.create(
-            model=COMPLETION_MODEL,
+        completed_code = _chat_completion(
+            "completion",
+            language,
+            code,
             messages=[
                 {"role": "system", "content": f"You are an expert {language} programmer. Complete the given code snippet."},
                 {"role": "user", "content": prompt}
@@ -256,8 +728,6 @@ def complete_code(code: str, language: str) -> str:
             temperature=0.2
         )
         
-        completed_code = response.choices[0].message.content.strip()
-        
         # Extract code from markdown code block if present
         if "```" in completed_code:
             match = re.search(r"```(?:[a-zA-Z0-9_]*\n)?(.*?)```", completed_code, re.DOTALL)
@@ -267,10 +737,10 @@ def complete_code(code: str, language: str) -> str:
         return completed_code
     except Exception as e:
         logger.error(f"Error completing code: {e}")
-        # Return the original code if OpenAI API fails
+        # Return the original code if the LLM call fails
         return code
 
-def chunk_code(code: str, max_tokens: int = 1000, overlap: int = 50) -> List[str]:
+def chunk_code(code: str, max_tokens: int = 1000, overlap: int = 50, language: Optional[str] = None) -> List[str]:
     """
     Split code into chunks of specified maximum token size with overlap.
     
@@ -278,111 +748,49 @@ def chunk_code(code: str, max_tokens: int = 1000, overlap: int = 50) -> List[str
         code: The code to chunk
         max_tokens: Maximum tokens per chunk
         overlap: Number of overlapping tokens between chunks
+        language: Programming language, enables cutting at top-level definitions
         
     Returns:
         List of code chunks
     """
-    # Simple approximation: 1 token ≈ 4 characters for code
-    char_per_token = 4
-    max_chars = max_tokens * char_per_token
-    overlap_chars = overlap * char_per_token
-    
-    # Split by lines to avoid breaking in the middle of a line
-    lines = code.split('\n')
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for line in lines:
-        line_length = len(line) + 1  # +1 for newline
-        
-        if current_length + line_length > max_chars and current_chunk:
-            # Add current chunk to chunks
-            chunks.append('\n'.join(current_chunk))
-            
-            # Start new chunk with overlap
-            overlap_lines = []
-            overlap_size = 0
-            for prev_line in reversed(current_chunk):
-                if overlap_size + len(prev_line) + 1 > overlap_chars:
-                    break
-                overlap_lines.insert(0, prev_line)
-                overlap_size += len(prev_line) + 1
-            
-            current_chunk = overlap_lines
-            current_length = overlap_size
-        
-        current_chunk.append(line)
-        current_length += line_length
-    
-    # Add the last chunk if not empty
-    if current_chunk:
-        chunks.append('\n'.join(current_chunk))
-    
-    return chunks
+    with metrics.stage("chunk"):
+        return [span.text for span in iter_chunks(code, max_tokens, overlap, language)]
 
-def is_incomplete_code(code: str, language: str) -> bool:
+def is_incomplete_code(code: str, language: str, confirm_with_llm: bool = INCOMPLETE_LLM_CONFIRM) -> bool:
     """
     Check if code is incomplete (missing brackets, etc.)
     
+    A lexer-based check answers almost every case on its own; the LLM is
+    only asked about ambiguous results, and only when confirm_with_llm is set.
+    
     Args:
         code: The code to check
         language: The programming language of the code
+        confirm_with_llm: Whether to ask the LLM when the check is ambiguous
         
     Returns:
         True if code is incomplete, False otherwise
     """
-    # Simple bracket matching
-    brackets = {
-        '{': '}',
-        '[': ']',
-        '(': ')'
-    }
-    
-    # Remove strings and comments to avoid false positives
-    # This is a simplified approach and might not work for all cases
-    code_no_strings = re.sub(r'".*?"', '""', code)
-    code_no_strings = re.sub(r"'.*?'", "''", code_no_strings)
-    code_no_comments = re.sub(r'//.*?$', '', code_no_strings, flags=re.MULTILINE)
-    code_no_comments = re.sub(r'/\*.*?\*/', '', code_no_comments, flags=re.DOTALL)
-    
-    # Check bracket balance
-    stack = []
-    for char in code_no_comments:
-        if char in brackets:
-            stack.append(char)
-        elif char in brackets.values():
-            if not stack or brackets[stack.pop()] != char:
-                return True
-    
-    if stack:
-        return True
+    result = check_incomplete(code, language)
+    if result is not None:
+        return result
     
-    # Language-specific checks
-    if language == "python":
-        # Check for incomplete indentation blocks
-        lines = code.split('\n')
-        for i, line in enumerate(lines):
-            if line.strip().endswith(':') and i == len(lines) - 1:
-                return True
-            if line.strip().endswith(':') and i < len(lines) - 1 and not lines[i+1].startswith(' '):
-                return True
+    if not confirm_with_llm:
+        return False
     
     # Use LLM to check if code is incomplete
     try:
-        # Create a client instance for the new OpenAI API (v1.0.0+)
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        response = client.chat.completions.create(
-            model=COMPLETION_MODEL,
+        result = _chat_completion(
+            "incomplete",
+            language,
+            code,
             messages=[
                 {"role": "system", "content": "You are a code analyzer. Respond with only 'yes' or 'no'."},
                 {"role": "user", "content": f"Is the following {language} code incomplete or missing closing brackets/braces? Respond with only 'yes' or 'no'.\n\n{code}"}
             ],
             max_tokens=10,
             temperature=0.1
-        )
-        result = response.choices[0].message.content.strip().lower()
+        ).lower()
         return "yes" in result
     except Exception as e:
         logger.error(f"Error checking if code is incomplete with LLM: {e}")
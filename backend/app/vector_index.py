@@ -0,0 +1,320 @@
+import json
+import logging
+import math
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.config import (
+    VECTOR_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    IVFFLAT_LISTS, IVFFLAT_PROBES, IVFFLAT_MIN_ROWS, IVFFLAT_REBUILD_GROWTH,
+    VECTOR_INDEX_MAINTENANCE_WORK_MEM, VECTOR_INDEX_PRECISION, EMBEDDING_STORAGE,
+    EMBEDDING_DIMENSION, RERANK_FACTOR
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "idx_code_chunks_embedding"
+# A rebuild creates the new index under this name, then swaps it in
+BUILD_INDEX_NAME = f"{INDEX_NAME}_new"
+INDEX_TYPES = ("hnsw", "ivfflat")
+PRECISIONS = ("full", "half", "binary")
+STORAGE_TYPES = ("vector", "halfvec")
+
+# Advisory lock key so only one process rebuilds at a time
+REBUILD_LOCK_KEY = 7_340_001
+
+def auto_ivfflat_lists(row_count: int) -> int:
+    """
+    Pick the IVFFlat list count recommended by pgvector for a table size.
+
+    Args:
+        row_count: Number of rows the index is built over
+
+    Returns:
+        Number of lists
+    """
+    if row_count <= 1_000_000:
+        return max(row_count // 1000, 10)
+    return int(math.sqrt(row_count))
+
+def index_key(precision: str = VECTOR_INDEX_PRECISION) -> Tuple[str, str]:
+    """
+    Expression the vector index is built over, and its operator class.
+
+    Searches must order by the same expression for the index to serve them
+    (see app.search).
+
+    Args:
+        precision: "full", "half" or "binary"
+
+    Returns:
+        Tuple of the SQL expression and the operator class
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported vector index precision: {precision}")
+    if precision == "binary":
+        return f"(binary_quantize(embedding)::bit({EMBEDDING_DIMENSION}))", "bit_hamming_ops"
+    if precision == "half" and EMBEDDING_STORAGE != "halfvec":
+        return f"(embedding::halfvec({EMBEDDING_DIMENSION}))", "halfvec_cosine_ops"
+    return "embedding", f"{EMBEDDING_STORAGE}_cosine_ops"
+
+def reranks(precision: str = VECTOR_INDEX_PRECISION) -> bool:
+    """Whether searches re-rank what the index finds by exact distance."""
+    return index_key(precision)[0] != "embedding"
+
+def rerank_candidates(wanted: int) -> int:
+    """
+    Number of index candidates to fetch for wanted results.
+
+    Args:
+        wanted: Results needed after re-ranking
+
+    Returns:
+        Candidate count, wanted itself when the index is exact
+    """
+    return wanted * max(RERANK_FACTOR, 1) if reranks() else wanted
+
+def resolve_build_params(
+    index_type: str,
+    row_count: int,
+    m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    lists: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Combine explicit build parameters with the configured defaults.
+
+    Args:
+        index_type: "hnsw" or "ivfflat"
+        row_count: Number of rows the index is built over
+        m: HNSW connections per layer
+        ef_construction: HNSW candidate list size during build
+        lists: IVFFlat list count
+
+    Returns:
+        Build parameters for the index WITH clause
+    """
+    if index_type == "hnsw":
+        return {"m": m or HNSW_M, "ef_construction": ef_construction or HNSW_EF_CONSTRUCTION}
+
+    if lists is None:
+        lists = auto_ivfflat_lists(row_count) if IVFFLAT_LISTS == "auto" else int(IVFFLAT_LISTS)
+    return {"lists": lists}
+
+def get_index_status(engine: Engine) -> Dict[str, Any]:
+    """
+    Describe the current vector index.
+
+    Args:
+        engine: Database engine
+
+    Returns:
+        Dictionary with the index state, its build metadata and the
+        configured defaults
+    """
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("""
+                SELECT ix.indisvalid AS valid, am.amname AS method,
+                       pg_get_indexdef(i.oid) AS definition,
+                       pg_relation_size(i.oid) AS size_bytes,
+                       obj_description(i.oid, 'pg_class') AS build_info
+                FROM pg_class i
+                JOIN pg_index ix ON ix.indexrelid = i.oid
+                JOIN pg_am am ON am.oid = i.relam
+                WHERE i.relname = :name
+            """),
+            {"name": INDEX_NAME}
+        ).mappings().first()
+        estimated_rows = conn.execute(
+            text("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = 'code_chunks'")
+        ).scalar() or 0
+
+    status = {
+        "name": INDEX_NAME,
+        "exists": row is not None,
+        "estimated_rows": estimated_rows,
+        "configured": {
+            "index_type": VECTOR_INDEX_TYPE,
+            "precision": VECTOR_INDEX_PRECISION,
+            "storage": EMBEDDING_STORAGE,
+            "rerank_factor": RERANK_FACTOR if reranks() else None,
+            "build_params": resolve_build_params(VECTOR_INDEX_TYPE, estimated_rows),
+            "ef_search": HNSW_EF_SEARCH,
+            "probes": IVFFLAT_PROBES
+        }
+    }
+    if row is not None:
+        status.update({
+            "valid": row["valid"],
+            "index_type": row["method"],
+            "definition": row["definition"],
+            "size_bytes": row["size_bytes"],
+            "build_info": json.loads(row["build_info"]) if row["build_info"] else None
+        })
+    return status
+
+def rebuild_reason(status: Dict[str, Any]) -> Optional[str]:
+    """
+    Decide whether the vector index should be (re)built.
+
+    Args:
+        status: Index status from get_index_status
+
+    Returns:
+        Reason for a rebuild, or None if the index is fine
+    """
+    rows = status["estimated_rows"]
+    eligible = VECTOR_INDEX_TYPE == "hnsw" or rows >= IVFFLAT_MIN_ROWS
+
+    if not status["exists"]:
+        return "missing" if eligible else None
+    if not status["valid"]:
+        return "invalid"
+    if status["index_type"] != VECTOR_INDEX_TYPE:
+        return "index type changed"
+    # Indexes built before precision was configurable hold the full embeddings
+    if (status.get("build_info") or {}).get("key", "embedding") != index_key()[0]:
+        return "index precision changed"
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        built_rows = (status.get("build_info") or {}).get("rows", 0)
+        if rows >= IVFFLAT_MIN_ROWS and rows > max(built_rows, 1) * IVFFLAT_REBUILD_GROWTH:
+            return "table grew since last build"
+    return None
+
+def rebuild_vector_index(
+    engine: Engine,
+    index_type: Optional[str] = None,
+    m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    lists: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Build the vector index concurrently and swap it in for the current one.
+
+    Reads and writes continue while the new index builds; the old index is
+    only dropped once the new one is ready. The index holds the embeddings
+    at VECTOR_INDEX_PRECISION.
+
+    Args:
+        engine: Database engine
+        index_type: "hnsw" or "ivfflat", defaults to VECTOR_INDEX_TYPE
+        m: HNSW connections per layer
+        ef_construction: HNSW candidate list size during build
+        lists: IVFFlat list count
+
+    Returns:
+        Dictionary with the build result
+    """
+    index_type = (index_type or VECTOR_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported vector index type: {index_type}")
+
+    # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": REBUILD_LOCK_KEY}).scalar():
+            return {"status": "skipped", "message": "Another vector index rebuild is running"}
+
+        try:
+            started = time.time()
+            rows = conn.execute(text("SELECT count(*) FROM code_chunks")).scalar()
+            params = resolve_build_params(index_type, rows, m, ef_construction, lists)
+            options = ", ".join(f"{key} = {int(value)}" for key, value in params.items())
+            key, opclass = index_key()
+
+            if re.fullmatch(r"\d+\s*(kB|MB|GB)", VECTOR_INDEX_MAINTENANCE_WORK_MEM):
+                conn.execute(text(f"SET maintenance_work_mem = '{VECTOR_INDEX_MAINTENANCE_WORK_MEM}'"))
+
+            logger.info(f"Building {index_type} vector index on {key} over {rows} rows with {params}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {BUILD_INDEX_NAME}"))
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY {BUILD_INDEX_NAME} ON code_chunks "
+                f"USING {index_type} ({key} {opclass}) WITH ({options})"
+            ))
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}"))
+            conn.execute(text(f"ALTER INDEX {BUILD_INDEX_NAME} RENAME TO {INDEX_NAME}"))
+
+            # Build metadata lives in the index comment so it travels with the index
+            build_info = {
+                "index_type": index_type, "precision": VECTOR_INDEX_PRECISION, "key": key,
+                "params": params, "rows": rows, "built_at": int(time.time())
+            }
+            comment = json.dumps(build_info).replace("'", "''")
+            conn.execute(text(f"COMMENT ON INDEX {INDEX_NAME} IS '{comment}'"))
+
+            seconds = round(time.time() - started, 3)
+            logger.info(f"Vector index built in {seconds}s")
+            return {"status": "success", **build_info, "seconds": seconds}
+
+        except Exception as e:
+            logger.error(f"Error building vector index: {str(e)}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {BUILD_INDEX_NAME}"))
+            raise
+
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REBUILD_LOCK_KEY})
+
+def ensure_vector_index(engine: Engine) -> None:
+    """
+    Build the vector index if it is missing and the table is ready for it.
+
+    Args:
+        engine: Database engine
+    """
+    status = get_index_status(engine)
+    if not status["exists"] and rebuild_reason(status):
+        rebuild_vector_index(engine)
+
+def pgvector_version(conn) -> Tuple[int, int]:
+    """
+    Major and minor version of the installed vector extension.
+
+    Args:
+        conn: Connection or session
+
+    Returns:
+        Version tuple, (0, 0) when the extension isn't installed
+    """
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(part) for part in re.findall(r"\d+", version or "")[:2]) or (0, 0)
+
+# Whether the extension can continue index scans until enough rows pass the
+# filters (pgvector 0.8+); looked up once per process
+_iterative_scan: Optional[bool] = None
+
+def apply_search_params(db: Session, ef_search: Optional[int] = None, probes: Optional[int] = None) -> bool:
+    """
+    Set the ANN recall knobs for the current transaction.
+
+    Where supported, index scans are iterative: rows removed by the
+    language and duplicate filters, or skipped by a cursor, no longer cut
+    a page short. HNSW keeps strict distance order; IVFFlat only offers
+    relaxed order, which the searches sort again.
+
+    Args:
+        db: Database session the search runs in
+        ef_search: HNSW candidate list size, defaults to HNSW_EF_SEARCH
+        probes: IVFFlat lists to probe, defaults to IVFFLAT_PROBES
+
+    Returns:
+        Whether scans go on past ef_search candidates
+    """
+    global _iterative_scan
+    if _iterative_scan is None:
+        _iterative_scan = pgvector_version(db) >= (0, 8)
+
+    query = "SELECT set_config('hnsw.ef_search', :ef_search, true), set_config('ivfflat.probes', :probes, true)"
+    if _iterative_scan:
+        query += (
+            ", set_config('hnsw.iterative_scan', 'strict_order', true)"
+            ", set_config('ivfflat.iterative_scan', 'relaxed_order', true)"
+        )
+    db.execute(text(query), {"ef_search": str(ef_search or HNSW_EF_SEARCH), "probes": str(probes or IVFFLAT_PROBES)})
+    return _iterative_scan
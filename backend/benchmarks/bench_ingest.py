@@ -0,0 +1,131 @@
+"""
+Ingest throughput: runs process_code over a synthetic corpus against the
+fake OpenAI API, the way a Celery worker would, and reports files, chunks
+and bytes per second.
+
+Writes to a database of its own on the POSTGRES_* server (--database or
+BENCH_POSTGRES_DB, see benchmarks.database). The schema is created if
+missing. --reset empties the chunk tables first.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ingest --database code_index_bench --files 60 --workers 4 --latency-ms 200
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks import database, fake_openai
+from benchmarks.corpus import LANGUAGES, generate_corpus
+from benchmarks.results import summarize, write_results
+
+def _prepare_backend():
+    from app import ingest
+
+    # Index rebuilds queued by process_code run in place, as no worker is listening
+    ingest.celery_app.conf.task_always_eager = True
+
+def _init_worker():
+    from app.database import engine
+
+    _prepare_backend()
+    # Connections inherited from the parent (with fork) can't be shared with it
+    engine.dispose(close=False)
+
+def ingest_file(source, name, max_tokens, concurrency):
+    """
+    Ingest one file in the calling process.
+
+    Returns:
+        Duration in seconds, and the process_code result
+    """
+    from app.ingest import process_code
+
+    start = time.perf_counter()
+    result = process_code(source.code, name, source.language, max_tokens, 50, concurrency)
+    return time.perf_counter() - start, result
+
+def run_pass(corpus, prefix, workers, max_tokens, concurrency):
+    names = [prefix + source.filename for source in corpus]
+    start = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            outcomes = list(pool.map(
+                ingest_file, corpus, names, [max_tokens] * len(corpus), [concurrency] * len(corpus)
+            ))
+    else:
+        outcomes = [ingest_file(source, name, max_tokens, concurrency) for source, name in zip(corpus, names)]
+    elapsed = time.perf_counter() - start
+
+    results = [result for _, result in outcomes]
+    errors = [result["message"] for result in results if result["status"] != "success"]
+    chunks = sum(len(result.get("chunk_ids") or []) for result in results)
+    size = sum(len(source.code.encode("utf-8")) for source in corpus)
+    return {
+        "seconds": round(elapsed, 3),
+        "files": len(corpus),
+        "chunks": chunks,
+        "bytes": size,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "files_per_s": round(len(corpus) / elapsed, 3),
+        "chunks_per_s": round(chunks / elapsed, 3),
+        "bytes_per_s": round(size / elapsed, 1),
+        "file_latency": summarize([seconds for seconds, _ in outcomes])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=60, help="files in the corpus")
+    parser.add_argument("--functions", type=int, default=8, help="functions per file")
+    parser.add_argument("--languages", default=",".join(LANGUAGES), help="comma-separated languages")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="share of functions repeated across files")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes ingesting files in parallel")
+    parser.add_argument("--concurrency", type=int, help="LLM calls per file, defaults to INGEST_CONCURRENCY")
+    parser.add_argument("--max-tokens", type=int, default=1000, help="maximum tokens per chunk")
+    parser.add_argument("--reingest", action="store_true", help="ingest the unchanged corpus a second time")
+    parser.add_argument("--reset", action="store_true", help="empty the chunk tables before the run")
+    parser.add_argument("--output", help="result file, defaults to benchmarks/results/")
+    database.add_arguments(parser)
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+    database.use_database(parser, args.database)
+
+    server = fake_openai.start_server(**fake_openai.options_from_args(args))
+    fake_openai.configure_backend(server)
+
+    from sqlalchemy import text
+    from app.database import direct_engine
+    from app.schema import ensure_schema
+
+    _prepare_backend()
+    ensure_schema(direct_engine)
+    if args.reset:
+        with direct_engine.begin() as conn:
+            conn.execute(text("TRUNCATE code_chunks RESTART IDENTITY CASCADE"))
+
+    corpus = generate_corpus(
+        args.files, args.functions, args.languages.split(","), args.duplicate_ratio, args.seed
+    )
+    # A fresh prefix keeps earlier runs from turning this one into a re-ingest
+    prefix = f"bench-{int(time.time())}/"
+
+    passes = {}
+    for name in (["initial", "reingest"] if args.reingest else ["initial"]):
+        before = fake_openai.server_stats(server)
+        result = run_pass(corpus, prefix, args.workers, args.max_tokens, args.concurrency)
+        after = fake_openai.server_stats(server)
+        result["api"] = {key: after[key] - before[key] for key in after}
+        passes[name] = result
+        print(
+            f"{name:<9} {result['files']} files, {result['chunks']} chunks in {result['seconds']}s: "
+            f"{result['files_per_s']} files/s, {result['chunks_per_s']} chunks/s, "
+            f"p50 {result['file_latency'].get('p50_ms')} ms/file, {result['errors']} errors"
+        )
+    server.shutdown()
+
+    params = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results("ingest", params, [{"case": f"ingest/{name}", **result} for name, result in passes.items()], args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Micro-benchmarks of the CPU-bound helpers on the ingest path: chunk_code,
+detect_language and is_incomplete_code. No database or LLM is used.
+
+Run from the backend directory:
+    python -m benchmarks.bench_micro [--repeat 5] [--output run.json]
+"""
+import argparse
+import timeit
+
+from app.utils import chunk_code, detect_language, is_incomplete_code
+from benchmarks.corpus import EXTENSIONS, LANGUAGES, generate_corpus
+from benchmarks.results import summarize, write_results
+
+# Source sizes, in functions per file
+SIZES = {"small": 4, "medium": 40, "large": 400}
+
+def measure(fn, repeat):
+    """
+    Time fn, with a loop count calibrated so each repeat takes about 0.2s.
+
+    Returns:
+        Per-call latency summary over the repeats
+    """
+    timer = timeit.Timer(fn)
+    number = timer.autorange()[0]
+    return {**summarize([total / number for total in timer.repeat(repeat, number)]), "calls_per_repeat": number}
+
+def run(repeat):
+    results = []
+
+    for size, functions in SIZES.items():
+        for source in generate_corpus(len(LANGUAGES), functions_per_file=functions, seed=7):
+            language, code = source.language, source.code
+            params = {"language": language, "size": size, "bytes": len(code.encode("utf-8"))}
+
+            results.append({
+                "case": f"chunk_code/{language}/{size}", "name": "chunk_code", **params,
+                "chunks": len(chunk_code(code, 1000, 50, language)),
+                **measure(lambda: chunk_code(code, 1000, 50, language), repeat)
+            })
+            results.append({
+                "case": f"detect_language.content/{language}/{size}", "name": "detect_language.content", **params,
+                "detected": detect_language(code),
+                **measure(lambda: detect_language(code), repeat)
+            })
+            filename = "source" + EXTENSIONS[language]
+            results.append({
+                "case": f"detect_language.extension/{language}/{size}", "name": "detect_language.extension", **params,
+                **measure(lambda: detect_language(code, filename=filename), repeat)
+            })
+            # Complete code, then the same code cut off mid-way
+            results.append({
+                "case": f"is_incomplete_code.complete/{language}/{size}", "name": "is_incomplete_code.complete", **params,
+                "incomplete": is_incomplete_code(code, language, confirm_with_llm=False),
+                **measure(lambda: is_incomplete_code(code, language, confirm_with_llm=False), repeat)
+            })
+            truncated = code[:len(code) * 2 // 3]
+            results.append({
+                "case": f"is_incomplete_code.truncated/{language}/{size}", "name": "is_incomplete_code.truncated", **params,
+                "incomplete": is_incomplete_code(truncated, language, confirm_with_llm=False),
+                **measure(lambda: is_incomplete_code(truncated, language, confirm_with_llm=False), repeat)
+            })
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="timed repeats per case")
+    parser.add_argument("--output", help="result file, defaults to benchmarks/results/")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    for result in results:
+        print(f"{result['case']:<45} {result['p50_ms'] * 1000:10.1f} us")
+    write_results("micro", {"repeat": args.repeat, "sizes": SIZES}, results, args.output)
+
+if __name__ == "__main__":
+    main()
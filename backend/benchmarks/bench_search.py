@@ -0,0 +1,194 @@
+"""
+/search/ latency against corpus size.
+
+Loads synthetic chunks in steps up to each size, with embeddings from the
+fake OpenAI API's generator, rebuilds the vector index, then sends queries
+through the ASGI app in-process and reports p50/p99 per search mode.
+
+Writes to a database of its own on the POSTGRES_* server (--database or
+BENCH_POSTGRES_DB, see benchmarks.database). Its code_chunks table is
+emptied first, which is why --reset must be given.
+
+Run from the backend directory:
+    python -m benchmarks.bench_search --database code_index_bench --reset --sizes 1000,10000,50000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+from benchmarks import database, fake_openai
+from benchmarks.corpus import QUERIES, generate_corpus
+from benchmarks.results import summarize, write_results
+
+MODES = ("vector", "lexical", "hybrid")
+
+def iter_rows(seed, max_tokens):
+    """
+    Yield code_chunks rows built from an endless synthetic corpus.
+
+    Repeated code is skipped: only one canonical chunk may hold it.
+    """
+    from app.chunking import iter_chunks
+    from app.config import EMBEDDING_DIMENSION
+    from app.models import content_hash
+
+    seen = set()
+    for batch in itertools.count():
+        for source in generate_corpus(100, functions_per_file=8, seed=seed + batch):
+            name = f"bench/{batch}/{source.filename}"
+            for i, span in enumerate(iter_chunks(source.code, max_tokens, 0, source.language)):
+                chunk_hash = content_hash(span.text)
+                if chunk_hash in seen:
+                    continue
+                seen.add(chunk_hash)
+                yield {
+                    "language": source.language,
+                    "name": f"{name}_chunk_{i+1}",
+                    "description": "Synthetic description: " + " ".join(span.text.split()[:40]),
+                    "raw": span.text,
+                    "embedding": fake_openai.fake_embedding(span.text, EMBEDDING_DIMENSION),
+                    "incomplete": False,
+                    "type": "code",
+                    "content_hash": chunk_hash,
+                    "source_name": name,
+                    "start_line": span.start_line,
+                    "end_line": span.end_line
+                }
+
+def load_rows(engine, rows, count, batch_size=1000):
+    """
+    Insert count rows, in batches.
+
+    Returns:
+        Seconds spent
+    """
+    from sqlalchemy import insert
+    from app.models import CodeChunk
+
+    start = time.perf_counter()
+    while count > 0:
+        batch = list(itertools.islice(rows, min(batch_size, count)))
+        with engine.begin() as conn:
+            conn.execute(insert(CodeChunk), batch)
+        count -= len(batch)
+    return time.perf_counter() - start
+
+async def measure_mode(client, mode, queries, concurrency, limit, warmup):
+    """
+    Send queries in one search mode, at most concurrency at a time.
+
+    Returns:
+        Latency summary, throughput and error count
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def search(query, record=True):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get("/search/", params={"query": query, "mode": mode, "limit": limit})
+            elapsed = time.perf_counter() - start
+        if not record:
+            return
+        if response.status_code == 200:
+            latencies.append(elapsed)
+        else:
+            errors += 1
+
+    await asyncio.gather(*(search(query, False) for query in itertools.islice(itertools.cycle(QUERIES), warmup)))
+    start = time.perf_counter()
+    await asyncio.gather(*(search(query) for query in itertools.islice(itertools.cycle(QUERIES), queries)))
+    elapsed = time.perf_counter() - start
+    return {**summarize(latencies), "errors": errors, "queries_per_s": round(queries / elapsed, 2)}
+
+async def run(sizes, modes, args):
+    """
+    Grow the corpus to each size and measure every mode at it.
+
+    One event loop serves all sizes, as the app's async engine keeps its
+    connections on the loop that opened them.
+    """
+    import httpx
+    from sqlalchemy import text
+    from app import vector_index
+    from app.database import direct_engine
+    from app.main import app
+
+    rows = iter_rows(args.seed, args.max_tokens)
+    loaded = 0
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for size in sizes:
+            load_seconds = load_rows(direct_engine, rows, size - loaded)
+            loaded = size
+            index = vector_index.rebuild_vector_index(direct_engine)
+            with direct_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("ANALYZE code_chunks"))
+                table_bytes = conn.execute(text("SELECT pg_total_relation_size('code_chunks')")).scalar()
+            index_bytes = vector_index.get_index_status(direct_engine).get("size_bytes")
+
+            for mode in modes:
+                result = await measure_mode(client, mode, args.queries, args.concurrency, args.limit, args.warmup)
+                results.append({
+                    "case": f"search/{mode}/{size}", "mode": mode, "corpus_size": size,
+                    "precision": index.get("precision"), "load_seconds": round(load_seconds, 3),
+                    "index_seconds": index.get("seconds"), "index_bytes": index_bytes, "table_bytes": table_bytes,
+                    **result
+                })
+                print(
+                    f"{size:>8} chunks {mode:<8} p50 {result.get('p50_ms')} ms, p99 {result.get('p99_ms')} ms, "
+                    f"{result['queries_per_s']} q/s, {result['errors']} errors"
+                )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000", help="comma-separated corpus sizes, in chunks")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated search modes")
+    parser.add_argument("--queries", type=int, default=200, help="timed queries per size and mode")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed queries before each measurement")
+    parser.add_argument("--concurrency", type=int, default=4, help="queries in flight")
+    parser.add_argument("--limit", type=int, default=10, help="results per query")
+    parser.add_argument("--max-tokens", type=int, default=200, help="maximum tokens per chunk")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--query-cache", action="store_true", help="keep the query embedding cache on")
+    parser.add_argument("--reset", action="store_true", help="confirm emptying the code_chunks table")
+    parser.add_argument("--output", help="result file, defaults to benchmarks/results/")
+    database.add_arguments(parser)
+    fake_openai.add_arguments(parser)
+    # Search latency is the subject here, not the embedding API's
+    parser.set_defaults(latency_ms=0.0)
+    args = parser.parse_args()
+    database.use_database(parser, args.database)
+    if not args.reset:
+        parser.error("this benchmark empties code_chunks; pass --reset to confirm")
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    modes = args.modes.split(",")
+
+    server = fake_openai.start_server(**fake_openai.options_from_args(args))
+    fake_openai.configure_backend(server)
+    if not args.query_cache:
+        os.environ["QUERY_CACHE_SIZE"] = "0"
+
+    from sqlalchemy import text
+    from app.database import direct_engine
+    from app.schema import ensure_schema
+
+    ensure_schema(direct_engine)
+    with direct_engine.begin() as conn:
+        conn.execute(text("TRUNCATE code_chunks RESTART IDENTITY CASCADE"))
+
+    results = asyncio.run(run(sizes, modes, args))
+    server.shutdown()
+
+    params = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results("search", params, results, args.output)
+
+if __name__ == "__main__":
+    main()
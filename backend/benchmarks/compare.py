@@ -0,0 +1,90 @@
+"""
+Compare two result files of the same benchmark, case by case.
+
+Prints each metric of the new run next to the old one with the relative
+change; times going down and rates going up are improvements.
+
+    python -m benchmarks.compare old.json new.json [--threshold 5]
+"""
+import argparse
+import json
+import sys
+
+# Metrics compared, and whether a higher value is better
+METRICS = {
+    "p50_ms": False,
+    "p90_ms": False,
+    "p99_ms": False,
+    "mean_ms": False,
+    "files_per_s": True,
+    "chunks_per_s": True,
+    "bytes_per_s": True,
+    "queries_per_s": True,
+    "index_bytes": False,
+    "table_bytes": False,
+    "errors": False
+}
+
+def flatten(result, prefix=""):
+    """Flatten nested summaries, e.g. file_latency.p50_ms."""
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif key in METRICS and isinstance(value, (int, float)):
+            values[prefix + key] = value
+    return values
+
+def compare(old, new, threshold):
+    """
+    Compare the results of two runs.
+
+    Args:
+        old: Baseline result document
+        new: Result document to check
+        threshold: Changes below this percentage are not flagged
+
+    Returns:
+        Rows of (case, metric, old value, new value, change in %, flag)
+    """
+    old_cases = {result["case"]: flatten(result) for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        before = old_cases.get(result["case"])
+        if before is None:
+            continue
+        for metric, value in flatten(result).items():
+            if metric not in before:
+                continue
+            previous = before[metric]
+            change = (value - previous) / previous * 100 if previous else 0.0
+            flag = ""
+            if abs(change) >= threshold:
+                better = (change > 0) == METRICS[metric.rsplit(".", 1)[-1]]
+                flag = "better" if better else "WORSE"
+            rows.append((result["case"], metric, previous, value, change, flag))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", help="baseline result file")
+    parser.add_argument("new", help="result file to check")
+    parser.add_argument("--threshold", type=float, default=5.0, help="flag changes of at least this many percent")
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    if old["benchmark"] != new["benchmark"]:
+        sys.exit(f"Different benchmarks: {old['benchmark']} and {new['benchmark']}")
+
+    print(f"{old['benchmark']}: {old.get('git_commit')} -> {new.get('git_commit')}")
+    rows = compare(old, new, args.threshold)
+    for case, metric, previous, value, change, flag in rows:
+        print(f"{case:<45} {metric:<22} {previous:>12} {value:>12} {change:+8.1f}% {flag}")
+    if any(flag == "WORSE" for *_, flag in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Synthetic multi-language source files for the benchmarks.
+
+Files are built from per-language templates with seeded random names, so
+a given seed always yields the same corpus. A share of the functions can
+be repeated across files to exercise duplicate detection.
+"""
+import random
+from typing import Dict, List, NamedTuple, Optional
+
+LANGUAGES = ("python", "javascript", "typescript", "java", "go", "sql")
+
+EXTENSIONS = {
+    "python": ".py",
+    "javascript": ".js",
+    "typescript": ".ts",
+    "java": ".java",
+    "go": ".go",
+    "sql": ".sql"
+}
+
+VERBS = ("load", "parse", "build", "fetch", "store", "merge", "split", "index", "render", "validate", "resolve", "compute")
+NOUNS = ("user", "order", "invoice", "chunk", "template", "session", "token", "report", "record", "payload", "config", "event")
+FIELDS = ("id", "name", "total", "created_at", "status", "owner", "amount", "tags", "source", "count")
+
+FUNCTIONS = {
+    "python": '''def {name}({arg}, limit=10):
+    """{verb_title} {noun} records up to the given limit."""
+    results = []
+    for item in {arg}[:limit]:
+        if item.get("{field}") is not None:
+            results.append({{"{field}": item["{field}"], "{other}": item.get("{other}")}})
+    return results
+''',
+    "javascript": '''function {name}({arg}, limit = 10) {{
+  // {verb_title} {noun} records up to the given limit
+  const results = [];
+  for (const item of {arg}.slice(0, limit)) {{
+    if (item.{field} !== undefined) {{
+      results.push({{ {field}: item.{field}, {other}: item.{other} }});
+    }}
+  }}
+  return results;
+}}
+''',
+    "typescript": '''export function {name}({arg}: Array<Record<string, unknown>>, limit: number = 10): unknown[] {{
+  // {verb_title} {noun} records up to the given limit
+  const results: unknown[] = [];
+  for (const item of {arg}.slice(0, limit)) {{
+    if (item["{field}"] !== undefined) {{
+      results.push({{ {field}: item["{field}"], {other}: item["{other}"] }});
+    }}
+  }}
+  return results;
+}}
+''',
+    "java": '''    public List<Map<String, Object>> {name}(List<Map<String, Object>> {arg}, int limit) {{
+        // {verb_title} {noun} records up to the given limit
+        List<Map<String, Object>> results = new ArrayList<>();
+        for (Map<String, Object> item : {arg}.subList(0, Math.min(limit, {arg}.size()))) {{
+            if (item.get("{field}") != null) {{
+                results.add(Map.of("{field}", item.get("{field}"), "{other}", item.get("{other}")));
+            }}
+        }}
+        return results;
+    }}
+''',
+    "go": '''func {name}({arg} []map[string]interface{{}}, limit int) []map[string]interface{{}} {{
+	// {verb_title} {noun} records up to the given limit
+	results := []map[string]interface{{}}{{}}
+	for i, item := range {arg} {{
+		if i >= limit {{
+			break
+		}}
+		if value, ok := item["{field}"]; ok {{
+			results = append(results, map[string]interface{{}}{{"{field}": value, "{other}": item["{other}"]}})
+		}}
+	}}
+	return results
+}}
+''',
+    "sql": '''CREATE OR REPLACE VIEW {name} AS
+SELECT {field}, {other}, COUNT(*) AS total_count
+FROM {noun}s
+WHERE {field} IS NOT NULL
+GROUP BY {field}, {other}
+ORDER BY total_count DESC;
+'''
+}
+
+HEADERS = {
+    "python": "import os\nfrom typing import List\n\n",
+    "javascript": "'use strict';\n\nconst path = require('path');\n\n",
+    "typescript": "import {{ readFileSync }} from 'fs';\n\n",
+    "java": "package com.example.{noun};\n\nimport java.util.*;\n\npublic class {class_name} {{\n\n",
+    "go": "package {noun}\n\nimport (\n\t\"fmt\"\n)\n\nvar _ = fmt.Sprintf\n\n",
+    "sql": "-- {verb_title} {noun} views\n\n"
+}
+
+FOOTERS = {"java": "}\n"}
+
+class SourceFile(NamedTuple):
+    filename: str
+    language: str
+    code: str
+
+def _function(rng: random.Random, language: str) -> str:
+    verb, noun = rng.choice(VERBS), rng.choice(NOUNS)
+    field, other = rng.sample(FIELDS, 2)
+    suffix = rng.randrange(100000)
+    if language in ("python", "sql", "go"):
+        name = f"{verb}_{noun}_{suffix}"
+    else:
+        name = f"{verb}{noun.title()}{suffix}"
+    return FUNCTIONS[language].format(
+        name=name, arg=f"{noun}s", verb_title=verb.title(), noun=noun, field=field, other=other
+    )
+
+def generate_corpus(
+    files: int,
+    functions_per_file: int = 8,
+    languages: Optional[List[str]] = None,
+    duplicate_ratio: float = 0.0,
+    seed: int = 42
+) -> List[SourceFile]:
+    """
+    Generate synthetic source files.
+
+    Args:
+        files: Number of files
+        functions_per_file: Functions (or views, for SQL) in each file
+        languages: Languages to cycle through, defaults to LANGUAGES
+        duplicate_ratio: Share of functions copied from an earlier file
+        seed: Random seed
+
+    Returns:
+        Source files with names, languages and code
+    """
+    rng = random.Random(seed)
+    languages = list(languages or LANGUAGES)
+    seen: Dict[str, List[str]] = {language: [] for language in languages}
+    corpus = []
+
+    for index in range(files):
+        language = languages[index % len(languages)]
+        verb, noun = rng.choice(VERBS), rng.choice(NOUNS)
+        parts = [HEADERS[language].format(
+            noun=noun, verb_title=verb.title(), class_name=f"{noun.title()}{verb.title()}{index}"
+        )]
+        for _ in range(functions_per_file):
+            if seen[language] and rng.random() < duplicate_ratio:
+                function = rng.choice(seen[language])
+            else:
+                function = _function(rng, language)
+                seen[language].append(function)
+            parts.append(function + "\n")
+        parts.append(FOOTERS.get(language, ""))
+        corpus.append(SourceFile(f"{noun}_{verb}_{index}{EXTENSIONS[language]}", language, "".join(parts)))
+
+    return corpus
+
+# Queries for the search benchmark, phrased like real searches
+QUERIES = [
+    f"{verb} {noun} {field}"
+    for verb in VERBS[:6] for noun in NOUNS[:5] for field in FIELDS[:2]
+]
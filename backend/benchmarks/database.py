@@ -0,0 +1,38 @@
+"""
+Database selection for the benchmarks that write to PostgreSQL.
+
+They never run against the app's database: the server and credentials come
+from POSTGRES_*, the database name from --database or BENCH_POSTGRES_DB,
+and it has to differ from POSTGRES_DB. Create it beforehand, e.g.
+`createdb code_index_bench`; the schema is set up on first use.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+# The same .env the app reads, so POSTGRES_DB is the app's database
+load_dotenv()
+
+APP_DATABASE = os.getenv("POSTGRES_DB") or "code_index"
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the database option to a benchmark's argument parser."""
+    parser.add_argument(
+        "--database", default=os.getenv("BENCH_POSTGRES_DB"),
+        help="database for benchmark data, defaults to BENCH_POSTGRES_DB; must not be POSTGRES_DB"
+    )
+
+def use_database(parser: argparse.ArgumentParser, name: str) -> None:
+    """
+    Point the backend at the benchmark database. Call before importing app.
+
+    Args:
+        parser: Parser that reports a missing or unsafe database
+        name: Benchmark database name
+    """
+    if not name:
+        parser.error("pass --database or set BENCH_POSTGRES_DB to a database of the benchmark's own")
+    if name == APP_DATABASE:
+        parser.error(f"{name} is the app's database (POSTGRES_DB); benchmark data would overwrite it")
+    os.environ["POSTGRES_DB"] = name
@@ -0,0 +1,312 @@
+"""
+Local stand-in for the OpenAI API, so benchmarks cost nothing and don't
+depend on the provider's latency.
+
+Serves /v1/embeddings and /v1/chat/completions with configurable latency,
+a requests-per-second limit and a concurrency limit (both answered with
+429 like the real API), and an error rate. Embeddings are derived from the
+input text, so the same corpus always gets the same vectors.
+
+Run it on its own and point the backend at it with OPENAI_BASE_URL:
+    python -m benchmarks.fake_openai --port 8089 --latency-ms 200 --rps 50
+    OPENAI_BASE_URL=http://localhost:8089/v1 ...
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+DEFAULT_DIMENSIONS = 1536
+
+def fake_embedding(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> List[float]:
+    """
+    Deterministic unit vector for a text.
+
+    Texts sharing words get similar vectors: each word adds a pseudo-random
+    direction, so searches over a synthetic corpus return related chunks.
+
+    Args:
+        text: Input text
+        dimensions: Vector length
+
+    Returns:
+        Embedding as a list of floats
+    """
+    vector = [0.0] * dimensions
+    for word in set(text.lower().split()):
+        seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        rng = random.Random(seed)
+        for _ in range(8):
+            vector[rng.randrange(dimensions)] += rng.uniform(-1.0, 1.0)
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class RateLimiter:
+    """Token bucket of `rps` requests per second; 0 means unlimited."""
+
+    def __init__(self, rps: float):
+        self.rps = rps
+        self.tokens = rps
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        if self.rps <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rps, self.tokens + (now - self.updated) * self.rps)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, jitter_ms=0.0, per_item_ms=0.0, rps=0.0,
+                 max_concurrency=0, error_rate=0.0, dimensions=DEFAULT_DIMENSIONS, seed=0):
+        super().__init__(address, Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_item_ms = per_item_ms
+        self.limiter = RateLimiter(rps)
+        self.max_concurrency = max_concurrency
+        self.error_rate = error_rate
+        self.dimensions = dimensions
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.stats: Dict[str, int] = {
+            "requests": 0, "embedding_requests": 0, "embedding_inputs": 0,
+            "chat_requests": 0, "rate_limited": 0, "errors": 0
+        }
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[name] += amount
+
+    def delay(self, items: int = 1) -> float:
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter + self.per_item_ms * items) / 1000
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+class Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, error_type: str, headers=None) -> None:
+        self._send(status, {"error": {"message": message, "type": error_type, "code": None}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send(200, server_stats(self.server))
+        else:
+            self._error(404, "Not found", "invalid_request_error")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        server.count("requests")
+
+        if not server.limiter.acquire():
+            server.count("rate_limited")
+            return self._error(429, "Rate limit reached", "requests", {"retry-after-ms": "100"})
+
+        with server.lock:
+            busy = server.max_concurrency and server.active >= server.max_concurrency
+            if not busy:
+                server.active += 1
+        if busy:
+            server.count("rate_limited")
+            return self._error(429, "Too many concurrent requests", "requests", {"retry-after-ms": "100"})
+
+        try:
+            if server.error_rate and server.random.random() < server.error_rate:
+                server.count("errors")
+                return self._error(500, "Injected failure", "server_error")
+
+            path = self.path.rstrip("/")
+            if path.endswith("/embeddings"):
+                self._embeddings(payload)
+            elif path.endswith("/chat/completions"):
+                self._chat(payload)
+            else:
+                self._error(404, f"Unknown path {self.path}", "invalid_request_error")
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _embeddings(self, payload: dict) -> None:
+        inputs = payload.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.server.count("embedding_requests")
+        self.server.count("embedding_inputs", len(inputs))
+        time.sleep(self.server.delay(len(inputs)))
+
+        # The SDK asks for base64 (little-endian float32) unless told otherwise
+        as_base64 = payload.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            embedding = fake_embedding(text, self.server.dimensions)
+            if as_base64:
+                embedding = base64.b64encode(array("f", embedding).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(estimate_tokens(text) for text in inputs)
+        self._send(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    def _chat(self, payload: dict) -> None:
+        messages = payload.get("messages") or []
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt = messages[-1]["content"] if messages else ""
+        self.server.count("chat_requests")
+        time.sleep(self.server.delay())
+
+        # Answer in the shape each prompt of the backend expects
+        if "'yes' or 'no'" in system:
+            content = "no"
+        elif "language detector" in system:
+            content = "python"
+        elif "Complete the given code" in system:
+            # Echo the snippet back as the "completed" code
+            match = re.search(r"```[^\n]*\n(.*?)```", prompt, re.DOTALL)
+            content = f"```\n{match.group(1) if match else prompt}```"
+        else:
+            words = prompt.split()
+            content = "Synthetic description: " + " ".join(words[-40:])
+
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        self._send(200, {
+            "id": f"chatcmpl-fake-{self.server.stats['chat_requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake-chat"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **options) -> FakeOpenAIServer:
+    """
+    Start the fake API in a background thread.
+
+    Args:
+        host: Interface to listen on
+        port: Port, 0 picks a free one
+        **options: FakeOpenAIServer options (latency_ms, rps, ...)
+
+    Returns:
+        The running server; its base_url goes into OPENAI_BASE_URL
+    """
+    server = FakeOpenAIServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+def configure_backend(server: FakeOpenAIServer) -> None:
+    """
+    Point the backend at a fake API server. Call before importing app.
+
+    The LLM cache is turned off unless LLM_CACHE_ENABLED is set, so every
+    run pays for its calls.
+
+    Args:
+        server: Running fake API server
+    """
+    os.environ["LLM_MODE"] = "OPENAI"
+    os.environ["EMBEDDING_MODE"] = "OPENAI"
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+def server_stats(server: FakeOpenAIServer) -> Dict[str, int]:
+    with server.lock:
+        return dict(server.stats)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the fake API options to a benchmark's argument parser."""
+    group = parser.add_argument_group("fake OpenAI API")
+    group.add_argument("--latency-ms", type=float, default=50.0, help="base latency per request")
+    group.add_argument("--jitter-ms", type=float, default=0.0, help="uniform latency jitter")
+    group.add_argument("--per-item-ms", type=float, default=0.0, help="extra latency per embedding input")
+    group.add_argument("--rps", type=float, default=0.0, help="requests per second before 429 (0: unlimited)")
+    group.add_argument("--max-concurrency", type=int, default=0, help="concurrent requests before 429 (0: unlimited)")
+    group.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    group.add_argument(
+        "--dimensions", type=int, default=int(os.getenv("EMBEDDING_DIMENSION", DEFAULT_DIMENSIONS)),
+        help="embedding length, defaults to EMBEDDING_DIMENSION"
+    )
+
+def options_from_args(args: argparse.Namespace) -> dict:
+    return {
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "per_item_ms": args.per_item_ms,
+        "rps": args.rps,
+        "max_concurrency": args.max_concurrency,
+        "error_rate": args.error_rate,
+        "dimensions": args.dimensions
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), **options_from_args(args))
+    print(f"Fake OpenAI API on {server.base_url} (stats at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
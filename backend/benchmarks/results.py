@@ -0,0 +1,87 @@
+"""
+Machine-readable benchmark output.
+
+Every run writes one JSON document: what ran, with which parameters, on
+which commit and machine, and its measurements. Compare two runs with
+`python -m benchmarks.compare old.json new.json`.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples, in milliseconds.
+
+    Args:
+        samples: Durations in seconds
+
+    Returns:
+        Count, mean, min, max and p50/p90/p99
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        # Nearest-rank percentile
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": round(percentile(50), 3),
+        "p90_ms": round(percentile(90), 3),
+        "p99_ms": round(percentile(99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(RESULTS_DIR)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_results(benchmark: str, params: Dict[str, Any], results: Any, output: Optional[str] = None) -> str:
+    """
+    Write a run's results as JSON.
+
+    Args:
+        benchmark: Benchmark name
+        params: Parameters the run used
+        results: Measurements
+        output: File to write, defaults to results/<benchmark>-<timestamp>.json
+
+    Returns:
+        Path of the written file
+    """
+    now = datetime.now(timezone.utc)
+    document = {
+        "benchmark": benchmark,
+        "timestamp": now.isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": results
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{benchmark}-{now.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(output, "w") as file:
+        json.dump(document, file, indent=2)
+        file.write("\n")
+    print(f"Results written to {output}")
+    return output
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from app import metrics, profiling
 from app.config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND
 from celery import Celery
 import logging
@@ -14,7 +15,7 @@ app = Celery(
     "code_indexer",
     broker=CELERY_BROKER_URL,
     backend=CELERY_RESULT_BACKEND,
-    include=["app.ingest"]
+    include=["app.ingest", "app.jobs"]
 )
 
 # Configure Celery
@@ -27,6 +28,11 @@ app.conf.update(
     task_soft_time_limit=300,  # Soft time limit for tasks (5 minutes)
 )
 
+# Task durations and the worker's /metrics server, per-task time breakdowns
+# and profiles of the tasks armed through /admin/profiles/tasks
+metrics.instrument_celery()
+profiling.instrument_celery()
+
 if __name__ == "__main__":
     logger.info("Starting Celery worker...")
     # Use direct command execution
@@ -0,0 +1,52 @@
+"""
+Fixtures for tests against a disposable PostgreSQL database with pgvector
+and pg_trgm, e.g. one started from the db image:
+
+    docker build -t code-index-db ../db
+    docker run -d --rm -p 5433:5432 -e POSTGRES_USER=optiq -e POSTGRES_PASSWORD=changeme \
+        -e POSTGRES_DB=code_index_test code-index-db
+    TEST_POSTGRES_DB=code_index_test POSTGRES_HOST=localhost POSTGRES_PORT=5433 python -m pytest
+
+The database named by TEST_POSTGRES_DB is emptied before every test that
+uses it; those tests are skipped when it isn't set. Embeddings come from
+the hashing provider, so no LLM is called.
+"""
+import os
+
+import pytest
+from dotenv import load_dotenv
+
+# The app's own database, as app.config would pick it
+load_dotenv()
+TEST_DATABASE = os.getenv("TEST_POSTGRES_DB")
+if TEST_DATABASE and TEST_DATABASE == (os.getenv("POSTGRES_DB") or "code_index"):
+    raise pytest.UsageError(f"TEST_POSTGRES_DB={TEST_DATABASE} is the app's database; the tests would empty it")
+
+# Set before app.config is imported
+if TEST_DATABASE:
+    os.environ["POSTGRES_DB"] = TEST_DATABASE
+os.environ["EMBEDDING_MODE"] = "HASHING"
+os.environ["LLM_CACHE_ENABLED"] = "false"
+
+@pytest.fixture(scope="session")
+def engine():
+    if not TEST_DATABASE:
+        pytest.skip("TEST_POSTGRES_DB is not set")
+
+    from app.database import direct_engine
+    from app.schema import ensure_schema
+
+    ensure_schema(direct_engine)
+    return direct_engine
+
+@pytest.fixture
+def db(engine):
+    from sqlalchemy import text
+    from app.database import SessionLocal
+
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE code_chunks, templates RESTART IDENTITY CASCADE"))
+
+    session = SessionLocal()
+    yield session
+    session.close()
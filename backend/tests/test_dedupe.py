@@ -0,0 +1,168 @@
+from sqlalchemy import select
+
+from app import ingest
+from app.chunking import CodeSpan
+from app.config import NEAR_DUPLICATE_THRESHOLD
+from app.dedupe import minhash_signature, signature_similarity
+from app.models import ChunkMinhashBand, CodeChunk, content_hash
+from app.providers import HashingProvider
+
+BODY = "\n".join(f"    total = total + values[{i}] * weights[{i % 7}]" for i in range(40))
+
+def function(name, tail=""):
+    return f"def {name}(values, weights):\n    total = 0\n{BODY}\n    return total{tail}\n"
+
+# The same function with a different last line, and a third variant
+ORIGINAL = function("weighted_sum")
+NEAR = function("weighted_sum", " + 1")
+OTHER_NEAR = function("weighted_sum", " * 2")
+UNRELATED = "def greet(name):\n    return f'Hello, {name}!'\n"
+HELPER = "def clamp(value, low, high):\n    return max(low, min(value, high))\n"
+
+def spans_of(*codes):
+    spans = []
+    line = byte = 0
+    for code in codes:
+        lines = code.count("\n") + 1
+        size = len(code.encode("utf-8"))
+        spans.append(CodeSpan(code, line + 1, line + lines, byte, byte + size))
+        line += lines
+        byte += size + 1
+    return spans
+
+def ingest_source(name, *codes):
+    """Store a source the way process_code does, with hashed embeddings."""
+    spans = spans_of(*codes)
+    embeddings = HashingProvider().embed([span.text for span in spans]).vectors
+    analyses = {
+        i: {"incomplete": False, "description": f"{name} chunk {i}", "embedding": embedding}
+        for i, embedding in enumerate(embeddings)
+    }
+    hashes = [content_hash(span.text) for span in spans]
+    return ingest.save_source_chunks(name, "python", spans, hashes, analyses)[0]
+
+def links(db):
+    return dict(db.execute(select(CodeChunk.id, CodeChunk.duplicate_of)).all())
+
+def banded(db):
+    return set(db.execute(select(ChunkMinhashBand.chunk_id).distinct()).scalars())
+
+def assert_consistent(db):
+    rows = links(db)
+    # Copies point at canonical chunks, never at other copies
+    assert all(rows[target] is None for target in rows.values() if target is not None)
+    # Only canonical chunks can be matched by later code
+    canonical = set(db.execute(
+        select(CodeChunk.id).where(CodeChunk.duplicate_of.is_(None), CodeChunk.minhash.isnot(None))
+    ).scalars())
+    assert banded(db) == canonical
+
+def test_variants_are_near_duplicates():
+    for variant in (NEAR, OTHER_NEAR):
+        assert content_hash(variant) != content_hash(ORIGINAL)
+        assert signature_similarity(minhash_signature(ORIGINAL), minhash_signature(variant)) >= NEAR_DUPLICATE_THRESHOLD
+
+def test_copies_link_to_the_canonical_chunk(db):
+    [original] = ingest_source("a.py", ORIGINAL)
+    [exact] = ingest_source("b.py", ORIGINAL)
+    [near] = ingest_source("c.py", NEAR)
+
+    assert links(db) == {original: None, exact: original, near: original}
+    # Copies reuse the canonical chunk's analysis
+    descriptions = dict(db.execute(select(CodeChunk.id, CodeChunk.description)).all())
+    assert descriptions[exact] == descriptions[near] == "a.py chunk 0"
+    assert_consistent(db)
+
+def test_reingesting_canonical_chunk_hands_copies_to_exact_copy(db):
+    [original] = ingest_source("a.py", ORIGINAL)
+    [exact] = ingest_source("b.py", ORIGINAL)
+    [near] = ingest_source("c.py", NEAR)
+
+    # The row is rewritten in place with unrelated code
+    assert ingest_source("a.py", UNRELATED) == [original]
+
+    assert links(db) == {original: None, exact: None, near: exact}
+    assert banded(db) == {original, exact}
+    assert_consistent(db)
+
+def test_reingesting_canonical_chunk_without_exact_copy(db):
+    [original] = ingest_source("a.py", ORIGINAL)
+    [near] = ingest_source("b.py", NEAR)
+    [near_copy] = ingest_source("c.py", NEAR)
+    [other] = ingest_source("d.py", OTHER_NEAR)
+
+    ingest_source("a.py", UNRELATED)
+
+    # Each group of identical near duplicates gets its own canonical chunk
+    assert links(db) == {original: None, near: None, near_copy: near, other: None}
+    assert_consistent(db)
+
+def test_reingesting_canonical_chunk_as_its_copy(db):
+    [original] = ingest_source("a.py", ORIGINAL)
+    [near] = ingest_source("b.py", NEAR)
+
+    # a.py now holds the code of its own near copy, which takes over
+    assert ingest_source("a.py", NEAR) == [original]
+
+    assert links(db) == {original: near, near: None}
+    assert_consistent(db)
+
+def test_deleting_canonical_chunk_promotes_a_copy(db):
+    original, helper = ingest_source("a.py", ORIGINAL, HELPER)
+    [exact] = ingest_source("b.py", ORIGINAL)
+    [near] = ingest_source("c.py", NEAR)
+
+    # The function leaves a.py; only the helper stays
+    assert ingest_source("a.py", HELPER) == [helper]
+
+    assert links(db) == {helper: None, exact: None, near: exact}
+    assert banded(db) == {helper, exact}
+    assert_consistent(db)
+
+def test_deleting_canonical_chunk_promotes_a_near_copy(db):
+    original, helper = ingest_source("a.py", ORIGINAL, HELPER)
+    [near] = ingest_source("b.py", NEAR)
+
+    ingest_source("a.py", HELPER)
+
+    assert links(db) == {helper: None, near: None}
+    # Later copies of the deleted code match the promoted chunk
+    [copy] = ingest_source("c.py", ORIGINAL)
+    assert links(db)[copy] == near
+    assert_consistent(db)
+
+def test_copies_within_one_batch_link_to_the_first(db):
+    first, helper, second = ingest_source("a.py", ORIGINAL, HELPER, ORIGINAL)
+
+    assert links(db) == {first: None, helper: None, second: first}
+    assert_consistent(db)
+
+def test_copies_within_one_batch_of_stored_code(db):
+    [stored] = ingest_source("a.py", ORIGINAL)
+    first, second = ingest_source("b.py", ORIGINAL, ORIGINAL)
+
+    assert links(db) == {stored: None, first: stored, second: stored}
+    assert_consistent(db)
+
+def test_skip_policy_stores_no_copies(db, monkeypatch):
+    monkeypatch.setattr(ingest, "DUPLICATE_POLICY", "skip")
+    [original] = ingest_source("a.py", ORIGINAL)
+
+    helper, copy, helper_copy = ingest_source("b.py", HELPER, ORIGINAL, HELPER)
+
+    # Skipped chunks resolve to the chunk they duplicate
+    assert (copy, helper_copy) == (original, helper)
+    assert links(db) == {original: None, helper: None}
+    assert_consistent(db)
+
+def test_insert_chunks_links_copies_in_the_batch(db):
+    rows = [
+        {"language": "python", "name": f"chunk_{i}", "raw": code, "type": "code", "minhash": minhash_signature(code)}
+        for i, code in enumerate([ORIGINAL, HELPER, ORIGINAL, HELPER])
+    ]
+    chunk_ids = ingest.insert_chunks(db, rows)
+    db.commit()
+
+    first, helper, second, helper_copy = chunk_ids
+    assert links(db) == {first: None, helper: None, second: first, helper_copy: helper}
+    assert_consistent(db)
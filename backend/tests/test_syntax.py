@@ -0,0 +1,42 @@
+import pytest
+
+from app.syntax import check_incomplete
+
+PYTHON = "def area(width, height):\n    return width * height\n"
+JAVASCRIPT = "function area(width, height) {\n  return width * height;\n}\n"
+SQL = "CREATE TABLE shapes (width int, height int);\nSELECT width * height FROM shapes;\n"
+
+@pytest.mark.parametrize("code, language", [
+    (PYTHON, "python"),
+    ("# trailing comment\nx = '{'  # }\n", "python"),
+    (JAVASCRIPT, "javascript"),
+    ("const brace = '}';  // {\n", "javascript"),
+    (SQL, "sql"),
+    ("SELECT 1; -- done\n/* end */\n", "sql"),
+    ("SELECT ';' FROM t;", "sql"),
+])
+def test_complete_code(code, language):
+    assert check_incomplete(code, language) is False
+
+@pytest.mark.parametrize("code, language", [
+    ("def area(width, height):\n", "python"),
+    ("def area(width, height):\n    return (width *", "python"),
+    ('text = """unterminated\n', "python"),
+    ("function area(width, height) {\n  return width * height;\n", "javascript"),
+    ("const text = `unterminated\n", "javascript"),
+    ("/* unterminated comment", "javascript"),
+    ("CREATE TABLE shapes (width int,", "sql"),
+    ("SELECT 'unterminated", "sql"),
+])
+def test_truncated_code(code, language):
+    assert check_incomplete(code, language) is True
+
+@pytest.mark.parametrize("code", [
+    # Balanced brackets, but the statement stops partway
+    "SELECT a, b FROM t WHERE",
+    "CREATE TABLE t (a int);\nSELECT * FROM",
+    "SELECT ';' FROM t",
+    "SELECT 1 -- ;",
+])
+def test_sql_without_final_semicolon_is_undecided(code):
+    assert check_incomplete(code, "sql") is None
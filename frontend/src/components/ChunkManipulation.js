@@ -17,6 +17,7 @@ import { useTranslation } from 'react-i18next';
 import EnhancedChunkManipulation from './EnhancedChunkManipulation';
 import SyntaxHighlighter from 'react-syntax-highlighter';
 import { docco } from 'react-syntax-highlighter/dist/esm/styles/hljs';
+import { waitForTask } from '../tasks';
 
 const ChunkManipulation = ({ 
   setLoading, 
@@ -72,7 +73,8 @@ const ChunkManipulation = ({
       const data = await response.json();
       
       if (response.ok) {
-        handleNotification(t('chunkSplitSuccess', { count: data.child_ids.length }), 'success');
+        const result = await waitForTask(data.task_id);
+        handleNotification(t('chunkSplitSuccess', { count: result.child_ids.length }), 'success');
         // Clear selected chunks after successful operation
         setSelectedChunks([]);
       } else {
@@ -110,6 +112,7 @@ const ChunkManipulation = ({
       const data = await response.json();
       
       if (response.ok) {
+        await waitForTask(data.task_id);
         handleNotification(t('chunksMerged'), 'success');
         setMergeName('');
         // Clear selected chunks after successful operation
@@ -153,12 +156,14 @@ const ChunkManipulation = ({
       const data = await response.json();
       
       if (response.ok) {
+        // Already complete chunks are answered right away, without a task
+        const result = data.task_id ? await waitForTask(data.task_id) : null;
         handleNotification(t('chunkCompletedSuccess'), 'success');
         // Update the selected chunks list to reflect the change
         setSelectedChunks(prevChunks => 
           prevChunks.map(chunk => 
             chunk.id === chunkToComplete.id 
-              ? { ...chunk, incomplete: false, raw: data.raw } 
+              ? { ...chunk, incomplete: false, raw: result ? result.raw : chunk.raw } 
               : chunk
           )
         );
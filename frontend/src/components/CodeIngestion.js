@@ -97,22 +97,18 @@ const CodeIngestion = ({
   const fetchProcessedChunks = async (chunkIds) => {
     try {
       setLoading(true);
-      // Create a comma-separated list of chunk IDs for filtering
+      // Create a comma-separated list of chunk IDs
       const chunkIdsStr = chunkIds.join(',');
       
-      // Fetch all chunks at once using a custom query
-      const response = await fetch(`http://localhost:8000/search/?query=id:${chunkIdsStr}&limit=${chunkIds.length * 2}`);
+      // Fetch all chunks at once by ID
+      const response = await fetch(`http://localhost:8000/chunks/?ids=${chunkIdsStr}`);
       const data = await response.json();
       
       if (response.ok) {
-        // Convert all IDs to numbers for consistent comparison
-        const chunkIdsAsNumbers = chunkIds.map(id => Number(id));
-        // Filter to only include the exact chunks we want, ensuring type consistency
-        const filteredChunks = data.filter(chunk => chunkIdsAsNumbers.includes(Number(chunk.id)));
-        console.log('Received chunks:', data);
-        console.log('Filtered chunks:', filteredChunks);
-        setProcessedChunks(filteredChunks);
-        handleNotification(t('loadedProcessedFragments', { count: filteredChunks.length }), 'success');
+        const chunks = data.chunks;
+        console.log('Received chunks:', chunks);
+        setProcessedChunks(chunks);
+        handleNotification(t('loadedProcessedFragments', { count: chunks.length }), 'success');
       } else {
         handleNotification(`${t('error')}: ${data.detail || t('failedToFetchChunks')}`, 'error');
       }
@@ -14,6 +14,7 @@ import {
 } from '@mui/icons-material';
 import SyntaxHighlighter from 'react-syntax-highlighter';
 import { docco } from 'react-syntax-highlighter/dist/esm/styles/hljs';
+import { waitForTask } from '../tasks';
 
 const TemplateManagement = ({ 
   setLoading, 
@@ -121,15 +122,8 @@ const TemplateManagement = ({
       if (response.ok) {
         setSelectedTemplate(data);
         
-        // Extract parameter keys from template chunks
-        const keys = new Set();
-        data.chunks.forEach(chunk => {
-          const matches = chunk.description?.match(/\{\{\$([a-zA-Z0-9_]+)\}\}/g) || [];
-          matches.forEach(match => {
-            const key = match.replace('{{$', '').replace('}}', '');
-            keys.add(key);
-          });
-        });
+        // Parameter keys are the placeholders found in the template code
+        const keys = new Set(data.parameters || []);
         
         setParameterKeys(Array.from(keys));
         
@@ -195,6 +189,7 @@ const TemplateManagement = ({
       const data = await response.json();
       
       if (response.ok) {
+        await waitForTask(data.task_id);
         handleNotification('Template applied successfully', 'success');
         handleCloseApplyDialog();
       } else {
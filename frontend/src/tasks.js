@@ -0,0 +1,25 @@
+// Long-running operations (split, merge, complete, template apply) run as
+// background tasks: the API returns a task id and the result is polled here.
+const API_URL = 'http://localhost:8000';
+
+const RUNNING_STATUSES = ['pending', 'STARTED', 'RETRY', 'PROGRESS'];
+
+export const waitForTask = async (taskId, intervalMs = 1000) => {
+  for (;;) {
+    const response = await fetch(`${API_URL}/status/${taskId}`);
+    const data = await response.json();
+
+    if (data.status === 'success') {
+      // Tasks report their own errors in the result
+      if (data.info && data.info.status === 'error') {
+        throw new Error(data.info.message);
+      }
+      return data.info;
+    }
+    if (!RUNNING_STATUSES.includes(data.status)) {
+      throw new Error(data.info);
+    }
+
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+  }
+};
@@ -1,5 +1,6 @@
 -- Enable pgvector extension
 CREATE EXTENSION IF NOT EXISTS vector;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 -- Create tables
 CREATE TABLE IF NOT EXISTS code_chunks (
@@ -8,10 +9,23 @@ CREATE TABLE IF NOT EXISTS code_chunks (
     name VARCHAR(255) NOT NULL,
     description TEXT,
     raw TEXT NOT NULL,
-    embedding vector(1536),  -- OpenAI Ada embedding dimension
+    embedding vector(1536),  -- Default EMBEDDING_DIMENSION; python -m app.schema resizes it while no embeddings are stored
     incomplete BOOLEAN DEFAULT FALSE,
     type VARCHAR(50) DEFAULT 'code',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    content_hash VARCHAR(64),  -- SHA-256 of raw
+    source_name VARCHAR(1024),  -- Name the source was ingested under
+    start_line INTEGER,
+    end_line INTEGER,
+    duplicate_of INTEGER REFERENCES code_chunks(id),  -- Canonical chunk this one duplicates
+    minhash BYTEA,  -- MinHash signature for near-duplicate detection
+    -- Full-text document for lexical search
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('simple', left(raw, 200000)), 'C')
+    ) STORED
 );
 
 CREATE TABLE IF NOT EXISTS chunk_relations (
@@ -34,14 +48,32 @@ CREATE TABLE IF NOT EXISTS template_chunks (
     PRIMARY KEY (template_id, chunk_id)
 );
 
+-- LSH bands of canonical chunks' MinHash signatures
+CREATE TABLE IF NOT EXISTS chunk_minhash_bands (
+    band SMALLINT,
+    band_hash BIGINT,
+    chunk_id INTEGER REFERENCES code_chunks(id) ON DELETE CASCADE,
+    PRIMARY KEY (band, band_hash, chunk_id)
+);
+
 -- Create indexes for faster searches
 CREATE INDEX IF NOT EXISTS idx_code_chunks_language ON code_chunks(language);
 CREATE INDEX IF NOT EXISTS idx_code_chunks_type ON code_chunks(type);
 CREATE INDEX IF NOT EXISTS idx_code_chunks_incomplete ON code_chunks(incomplete);
+CREATE INDEX IF NOT EXISTS idx_code_chunks_content_hash ON code_chunks(content_hash);
+CREATE INDEX IF NOT EXISTS idx_code_chunks_source_name ON code_chunks(source_name);
+CREATE INDEX IF NOT EXISTS idx_code_chunks_duplicate_of ON code_chunks(duplicate_of);
+CREATE INDEX IF NOT EXISTS idx_chunk_minhash_bands_chunk_id ON chunk_minhash_bands(chunk_id);
+
+-- One canonical chunk per distinct code; copies point at it via duplicate_of
+CREATE UNIQUE INDEX IF NOT EXISTS uq_code_chunks_canonical_hash ON code_chunks(content_hash) WHERE duplicate_of IS NULL;
+
+-- Create indexes for lexical search
+CREATE INDEX IF NOT EXISTS idx_code_chunks_search_vector ON code_chunks USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS idx_code_chunks_name_trgm ON code_chunks USING gin (name gin_trgm_ops);
 
--- Create index for vector similarity search
-CREATE INDEX IF NOT EXISTS idx_code_chunks_embedding ON code_chunks USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+-- The vector similarity index (idx_code_chunks_embedding) is managed by the
+-- backend: see VECTOR_INDEX_TYPE, VECTOR_INDEX_PRECISION and POST /admin/vector-index/rebuild
 
 -- Comments
 COMMENT ON TABLE code_chunks IS 'Stores code fragments with their embeddings and metadata';